@@ -0,0 +1,51 @@
+"""
+Однопроходные агрегаты по tickets.
+
+Вместо серии count() — один SELECT count(*) FILTER (WHERE ...).
+Счётчики сканов читаются из scan_rollup (app/rollup.py).
+"""
+from sqlalchemy import and_, func, true
+from sqlalchemy.orm import Session
+
+from app.models import Ticket
+
+
+def ticket_counts(db: Session, base_filters=(), scope_filters=(), model=Ticket) -> dict:
+    """Счётчики билетов за один проход.
+
+    base_filters  — WHERE для всего запроса (например club_id).
+    scope_filters — дополнительные условия для total/persons
+                    (видимость, дата, статус — то, что видит список).
+    entered/pending/cancelled считаются по base_filters, как и раньше.
+    Персоны: sum(quantity) и sum(least(scan_count, quantity)) —
+    билеты на несколько человек больше не искажают "вошло".
+    model — Ticket или ArchivedTicket (та же форма колонок).
+    """
+    in_scope = and_(*scope_filters) if scope_filters else true()
+    quantity = func.coalesce(model.quantity, 1)
+    scan_count = func.coalesce(model.scan_count, 0)
+
+    row = db.query(
+        func.count().filter(in_scope).label("total"),
+        func.count().filter(model.status == "used").label("entered"),
+        func.count().filter(model.status == "valid").label("pending"),
+        func.count().filter(model.status == "cancelled").label("cancelled"),
+        func.coalesce(func.sum(quantity).filter(in_scope), 0).label("total_persons"),
+        func.coalesce(
+            func.sum(func.least(scan_count, quantity)).filter(in_scope), 0
+        ).label("entered_persons"),
+    ).select_from(model).filter(*base_filters).one()
+
+    return {
+        "total": row.total,
+        "entered": row.entered,
+        "pending": row.pending,
+        "cancelled": row.cancelled,
+        "total_persons": int(row.total_persons),
+        "entered_persons": int(row.entered_persons),
+    }
+
+
+def merge_counts(*counts: dict) -> dict:
+    """Сумма нескольких результатов ticket_counts (живые + архив)"""
+    return {key: sum(c[key] for c in counts) for key in counts[0]}
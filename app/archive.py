@@ -0,0 +1,451 @@
+"""
+Холодный архив scan_history / deleted_tickets в сжатые файлы.
+
+Строки выгружаются потоково (yield_per) в Parquet (zstd, если установлен
+pyarrow) или в NDJSON (zstd / gzip), файл кладётся в ARCHIVE_URL — локальный
+каталог или s3://bucket/prefix — и только после этого строки удаляются из
+PostgreSQL в той же транзакции, что и запись в манифест archive_segments.
+Если количество удалённых строк не совпало с выгруженным — откат и файл
+удаляется.
+
+Месячные партиции scan_history (app/partitions.py) архивируются целиком:
+DETACH → выгрузка → DROP TABLE.
+
+scan_rollup не трогается — дашборды по архивным периодам продолжают работать.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, func, select, delete, text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal, engine, get_direct_engine, in_statement_class
+from app.models import ArchiveSegment, BatchJob, DeletedTicket, ScanHistory
+from app.partitions import attach_partition, detach_partition, month_bounds, partition_month
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow опционален
+    pa = pq = None
+
+try:
+    import zstandard as zstd
+except ImportError:  # pragma: no cover - zstandard опционален
+    zstd = None
+
+try:
+    import boto3
+except ImportError:  # pragma: no cover - нужен только для s3://
+    boto3 = None
+
+logger = logging.getLogger("impreza.security")
+
+# Таблица → (модель, колонка времени, по которой режется архив)
+TABLES = {
+    "scan_history": (ScanHistory, ScanHistory.scan_time),
+    "deleted_tickets": (DeletedTicket, DeletedTicket.deleted_at),
+}
+
+_EXTENSIONS = {"parquet": "parquet", "ndjson.zst": "ndjson.zst", "ndjson.gz": "ndjson.gz"}
+
+
+def _resolve_format(fmt: Optional[str] = None) -> str:
+    """Фактический формат файла; о подмене запрошенного — предупреждение"""
+    fmt = fmt or settings.ARCHIVE_FORMAT
+    if fmt == "parquet":
+        if pa is not None:
+            return "parquet"
+        logger.warning("Archive format parquet requested but pyarrow is not installed, writing NDJSON")
+    resolved = "ndjson.zst" if zstd is not None else "ndjson.gz"
+    if fmt in ("ndjson", "ndjson.zst") and zstd is None:
+        logger.warning("zstandard is not installed, archive falls back to %s", resolved)
+    return resolved
+
+
+def _columns(model) -> list:
+    return list(model.__table__.columns)
+
+
+# ─── Запись / чтение файлов ───
+
+def _arrow_type(column):
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+class _SegmentWriter:
+    """Потоковая запись пачек строк в один файл сегмента"""
+
+    def __init__(self, path: str, fmt: str, columns: list):
+        self.fmt = fmt
+        self.rows = 0
+        if fmt == "parquet":
+            self.schema = pa.schema([(c.name, _arrow_type(c)) for c in columns])
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        elif fmt == "ndjson.zst":
+            self._raw = open(path, "wb")
+            self._writer = zstd.ZstdCompressor(level=10).stream_writer(self._raw)
+        else:
+            self._writer = gzip.open(path, "wb")
+
+    def write(self, rows: list[dict]) -> None:
+        if not rows:
+            return
+        if self.fmt == "parquet":
+            self._writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        else:
+            payload = "".join(json.dumps(row, default=_jsonable, ensure_ascii=False) + "\n" for row in rows)
+            self._writer.write(payload.encode("utf-8"))
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self._writer.close()
+        raw = getattr(self, "_raw", None)
+        if raw is not None and not raw.closed:
+            raw.close()
+
+
+def _read_rows(path: str, fmt: str) -> Iterator[dict]:
+    if fmt == "parquet":
+        if pq is None:
+            raise RuntimeError("pyarrow не установлен — Parquet-архив не прочитать")
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+        return
+
+    if fmt == "ndjson.zst":
+        if zstd is None:
+            raise RuntimeError("zstandard не установлен — архив .zst не прочитать")
+        stream = io.TextIOWrapper(zstd.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+    else:
+        stream = gzip.open(path, "rt", encoding="utf-8")
+    with stream:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ─── Хранилище: каталог или S3 ───
+
+def _s3_location(uri: str) -> tuple[str, str]:
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def _s3():
+    if boto3 is None:
+        raise RuntimeError("boto3 не установлен — ARCHIVE_URL=s3://... недоступен")
+    return boto3.client("s3")
+
+
+def _store(local_path: str, key: str) -> str:
+    """Кладёт готовый файл в ARCHIVE_URL, возвращает его URI"""
+    base = settings.ARCHIVE_URL.rstrip("/")
+    if base.startswith("s3://"):
+        uri = f"{base}/{key}"
+        bucket, object_key = _s3_location(uri)
+        _s3().upload_file(local_path, bucket, object_key)
+        return uri
+
+    target = os.path.abspath(os.path.join(base, key))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(local_path, target)
+    return target
+
+
+def _discard(uri: str) -> None:
+    try:
+        if uri.startswith("s3://"):
+            bucket, key = _s3_location(uri)
+            _s3().delete_object(Bucket=bucket, Key=key)
+        elif os.path.exists(uri):
+            os.remove(uri)
+    except Exception as e:
+        logger.error("Archive cleanup failed for %s: %s", uri, e)
+
+
+@contextmanager
+def _local_copy(uri: str):
+    if not uri.startswith("s3://"):
+        yield uri
+        return
+    bucket, key = _s3_location(uri)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, os.path.basename(key))
+        _s3().download_file(bucket, key, path)
+        yield path
+
+
+# ─── Выгрузка ───
+
+def _export(batches: Iterator[list[dict]], model, key: str, fmt: str) -> dict:
+    """Пишет пачки во временный файл и переносит его в хранилище"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, os.path.basename(key))
+        writer = _SegmentWriter(path, fmt, _columns(model))
+        try:
+            for rows in batches:
+                writer.write(rows)
+        finally:
+            writer.close()
+        info = {"row_count": writer.rows, "size_bytes": os.path.getsize(path), "sha256": _sha256(path)}
+        info["uri"] = _store(path, key)
+    return info
+
+
+def _segment_key(table: str, label: str, fmt: str) -> str:
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    return f"{table}/{label}_{stamp}.{_EXTENSIONS[fmt]}"
+
+
+def archive_range(db: Session, table: str, start: datetime, end: datetime,
+                  club_id: Optional[int] = None, created_by: Optional[str] = None,
+                  fmt: Optional[str] = None) -> Optional[ArchiveSegment]:
+    """Архивирует строки table с временем в [start, end). Коммитит.
+
+    Возвращает запись манифеста или None, если строк нет.
+    """
+    model, time_column = TABLES[table]
+    fmt = _resolve_format(fmt)
+    filters = [time_column >= start, time_column < end]
+    if club_id and table == "scan_history":
+        filters.append(ScanHistory.club_id == club_id)
+
+    columns = _columns(model)
+    stmt = select(*columns).where(*filters).order_by(model.id).execution_options(
+        stream_results=True, yield_per=settings.HISTORY_BATCH_SIZE
+    )
+    batches = (
+        [dict(row) for row in part]
+        for part in db.execute(stmt).mappings().partitions(settings.HISTORY_BATCH_SIZE)
+    )
+    label = f"{start:%Y%m%d}-{end:%Y%m%d}" + (f"_club{club_id}" if club_id else "")
+    info = _export(batches, model, _segment_key(table, label, fmt), fmt)
+
+    if info["row_count"] == 0:
+        _discard(info["uri"])
+        db.rollback()
+        return None
+
+    try:
+        deleted = db.execute(delete(model).where(*filters).execution_options(synchronize_session=False)).rowcount
+        if deleted != info["row_count"]:
+            raise RuntimeError(f"Archived {info['row_count']} rows but {deleted} matched on delete")
+        segment = ArchiveSegment(
+            table_name=table, source="range", club_id=club_id,
+            start_at=start, end_at=end, format=fmt, created_by=created_by, **info,
+        )
+        db.add(segment)
+        db.commit()
+    except Exception:
+        db.rollback()
+        _discard(info["uri"])
+        raise
+
+    logger.info("Archived %s rows of %s [%s, %s) → %s", info["row_count"], table, start, end, info["uri"])
+    return segment
+
+
+def archive_partition(name: str, created_by: Optional[str] = None, fmt: Optional[str] = None) -> Optional[dict]:
+    """Архивирует месячную партицию scan_history целиком: DETACH → файл → DROP TABLE.
+
+    Если выгрузка или DROP упали — партиция цепляется обратно. Если не
+    удалось и это, таблица остаётся отцепленной: повторный вызов продолжит
+    с неё (DETACH для отцепленной — no-op).
+    """
+    month = partition_month(name)
+    if month is None:
+        raise ValueError(f"Not a monthly scan_history partition: {name}")
+    fmt = _resolve_format(fmt)
+    start, end = (datetime.combine(d, datetime.min.time()) for d in month_bounds(month))
+
+    # DDL (DETACH / DROP / ATTACH) — мимо PgBouncer, как миграции и app/partitions.py.
+    # DETACH — отдельной транзакцией: дальше с таблицей работаем без блокировки родителя
+    direct = get_direct_engine()
+    with direct.begin() as conn:
+        detach_partition(conn, name)
+
+    names = ", ".join(c.name for c in _columns(ScanHistory))
+    info = None
+    db = Session(bind=direct)
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=settings.HISTORY_BATCH_SIZE).execute(
+                text(f"SELECT {names} FROM {name} ORDER BY id")
+            )
+            batches = ([dict(row) for row in part] for part in result.mappings().partitions(settings.HISTORY_BATCH_SIZE))
+            info = _export(batches, ScanHistory, _segment_key("scan_history", name, fmt), fmt)
+            result.close()
+
+        db.execute(text(f"DROP TABLE {name}"))
+        segment = ArchiveSegment(
+            table_name="scan_history", source=name,
+            start_at=start, end_at=end, format=fmt, created_by=created_by, **info,
+        )
+        db.add(segment)
+        db.commit()
+        logger.info("Archived partition %s: %s rows → %s", name, info["row_count"], info["uri"])
+        return segment_to_dict(segment)
+    except Exception:
+        db.rollback()
+        if info is not None:
+            _discard(info["uri"])
+        _reattach(name)
+        raise
+    finally:
+        db.close()
+
+
+def _reattach(name: str) -> None:
+    """Откат DETACH после неудачной выгрузки; ошибку только логируем —
+    наверх уходит исходная"""
+    try:
+        with get_direct_engine().begin() as conn:
+            attach_partition(conn, name)
+        logger.warning("Partition %s re-attached after failed archive", name)
+    except Exception as e:
+        logger.error("Partition %s left detached (retry archive_partition to resume): %s", name, e)
+
+
+# ─── Фоновые задачи ───
+
+@in_statement_class("batch")
+def run_archive_job(job_id: str, action, *args, **kwargs):
+    """Тело BackgroundTasks: выполняет action и пишет итог в batch_jobs"""
+    db = SessionLocal()
+    try:
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({"status": "running"}, synchronize_session=False)
+        db.commit()
+        result = action(*args, **kwargs)
+        rows = result.get("row_count", 0) if isinstance(result, dict) else 0
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({
+            "status": "done",
+            "processed": rows,
+            "finished_at": func.now(),
+        }, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({
+            "status": "failed",
+            "error": str(e)[:1000],
+            "finished_at": func.now(),
+        }, synchronize_session=False)
+        db.commit()
+        logger.error("Archive job %s failed: %s", job_id, e)
+    finally:
+        db.close()
+
+
+def archive_range_job(table: str, start: datetime, end: datetime, club_id: Optional[int] = None,
+                      created_by: Optional[str] = None) -> dict:
+    """archive_range в собственной сессии (для фонового запуска)"""
+    db = SessionLocal()
+    try:
+        segment = archive_range(db, table, start, end, club_id=club_id, created_by=created_by)
+        return segment_to_dict(segment) if segment else {"row_count": 0}
+    finally:
+        db.close()
+
+
+# ─── Чтение архива ───
+
+def _matches(row: dict, time_key: str, start: Optional[datetime], end: Optional[datetime],
+             club_id: Optional[int], order_id: Optional[str]) -> bool:
+    moment = row.get(time_key)
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    if start and (moment is None or moment < start):
+        return False
+    if end and (moment is None or moment >= end):
+        return False
+    if club_id and row.get("club_id") != club_id:
+        return False
+    if order_id and row.get("order_id") != order_id:
+        return False
+    return True
+
+
+def query_archive(db: Session, table: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  club_id: Optional[int] = None, order_id: Optional[str] = None, limit: int = 500) -> list[dict]:
+    """Строки из архивных файлов, пересекающихся с [start, end).
+
+    Файлы читаются по требованию (от новых к старым) до набора limit строк.
+    """
+    _, time_column = TABLES[table]
+    time_key = time_column.key
+
+    segments = db.query(ArchiveSegment).filter(ArchiveSegment.table_name == table)
+    if start:
+        segments = segments.filter(ArchiveSegment.end_at > start)
+    if end:
+        segments = segments.filter(ArchiveSegment.start_at < end)
+    if club_id:
+        segments = segments.filter((ArchiveSegment.club_id == None) | (ArchiveSegment.club_id == club_id))
+
+    found = []
+    for segment in segments.order_by(ArchiveSegment.start_at.desc()).all():
+        with _local_copy(segment.uri) as path:
+            for row in _read_rows(path, segment.format):
+                if _matches(row, time_key, start, end, club_id, order_id):
+                    found.append({k: _jsonable(v) if isinstance(v, (datetime, date)) else v for k, v in row.items()})
+        if len(found) >= limit:
+            break
+
+    found.sort(key=lambda row: row.get(time_key) or "", reverse=True)
+    return found[:limit]
+
+
+def archive_horizon(db: Session, table: str) -> Optional[datetime]:
+    """Верхняя граница заархивированного периода table (None — архива нет)"""
+    return db.query(func.max(ArchiveSegment.end_at)).filter(ArchiveSegment.table_name == table).scalar()
+
+
+def segment_to_dict(segment: ArchiveSegment) -> dict:
+    return {
+        "id": segment.id,
+        "table": segment.table_name,
+        "source": segment.source,
+        "club_id": segment.club_id,
+        "start_at": segment.start_at.isoformat() if segment.start_at else None,
+        "end_at": segment.end_at.isoformat() if segment.end_at else None,
+        "row_count": segment.row_count,
+        "format": segment.format,
+        "uri": segment.uri,
+        "size_bytes": segment.size_bytes,
+        "sha256": segment.sha256,
+        "created_at": str(segment.created_at) if segment.created_at else None,
+        "created_by": segment.created_by,
+    }
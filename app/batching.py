@@ -0,0 +1,127 @@
+"""
+Пакетные UPDATE по id-диапазонам с короткими транзакциями.
+
+Один UPDATE на всю scan_history держит блокировки строк до конца транзакции
+и мешает log_scan на входе. Здесь таблица обходится диапазонами
+[lo, lo + batch_size) по первичному ключу, каждый пакет — своя транзакция,
+количество изменённых строк берётся из RETURNING (без отдельного count()).
+"""
+import logging
+import secrets
+from typing import Callable, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal, in_statement_class
+from app.models import BatchJob
+
+logger = logging.getLogger("impreza.security")
+
+
+def _update_range(db: Session, model, lo: int, hi: int, filters: list, values: dict) -> int:
+    """UPDATE ... WHERE id в [lo, hi) → количество строк через RETURNING"""
+    updated = (
+        update(model)
+        .where(model.id >= lo, model.id < hi, *filters)
+        .values(**values)
+        .returning(model.id)
+        .cte("updated")
+    )
+    return db.execute(select(func.count()).select_from(updated)).scalar()
+
+
+def batched_update(model, filters: list, values: dict, batch_size: Optional[int] = None,
+                   on_batch: Optional[Callable[[Session, int, int, int], None]] = None) -> int:
+    """Обходит строки model, подходящие под filters, пакетами по id.
+
+    Использует собственные сессии (не сессию запроса) — каждый пакет
+    коммитится отдельно. on_batch(db, batch_no, total_batches, updated)
+    вызывается внутри транзакции пакета.
+    """
+    batch_size = batch_size or settings.HISTORY_BATCH_SIZE
+    db = SessionLocal()
+    try:
+        min_id, max_id = db.query(func.min(model.id), func.max(model.id)).filter(*filters).one()
+        db.commit()
+        if min_id is None:
+            return 0
+
+        total_batches = (max_id - min_id) // batch_size + 1
+        processed = 0
+        for batch_no, lo in enumerate(range(min_id, max_id + 1, batch_size), start=1):
+            updated = _update_range(db, model, lo, lo + batch_size, filters, values)
+            if on_batch:
+                on_batch(db, batch_no, total_batches, updated)
+            db.commit()
+            processed += updated
+        return processed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# ─── Фоновые задачи с прогрессом ───
+
+def create_job(db: Session, kind: str) -> str:
+    job = BatchJob(id=secrets.token_hex(8), kind=kind, status="pending")
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+@in_statement_class("batch")
+def run_job(job_id: str, model, filters: list, values: dict):
+    """Тело BackgroundTasks: batched_update с записью прогресса в batch_jobs"""
+
+    def _progress(db: Session, batch_no: int, total_batches: int, updated: int):
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({
+            "status": "running",
+            "done_batches": batch_no,
+            "total_batches": total_batches,
+            "processed": BatchJob.processed + updated,
+        }, synchronize_session=False)
+
+    db = SessionLocal()
+    try:
+        processed = batched_update(model, filters, values, on_batch=_progress)
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({
+            "status": "done",
+            "processed": processed,
+            "finished_at": func.now(),
+        }, synchronize_session=False)
+        db.commit()
+        logger.info("Batch job %s done: %s rows", job_id, processed)
+    except Exception as e:
+        db.rollback()
+        db.query(BatchJob).filter(BatchJob.id == job_id).update({
+            "status": "failed",
+            "error": str(e)[:1000],
+            "finished_at": func.now(),
+        }, synchronize_session=False)
+        db.commit()
+        logger.error("Batch job %s failed: %s", job_id, e)
+    finally:
+        db.close()
+
+
+def job_accepted(job_id: str, **extra) -> dict:
+    """Ответ эндпоинта, запустившего фоновую задачу"""
+    return {"status": "accepted", "job_id": job_id, "progress_url": f"/api/history/jobs/{job_id}", **extra}
+
+
+def job_to_dict(job: BatchJob) -> dict:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "processed": job.processed,
+        "done_batches": job.done_batches,
+        "total_batches": job.total_batches,
+        "error": job.error,
+        "created_at": str(job.created_at) if job.created_at else None,
+        "finished_at": str(job.finished_at) if job.finished_at else None,
+    }
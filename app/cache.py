@@ -0,0 +1,87 @@
+"""
+Простые in-process кэши.
+
+TTLCache — ограниченный по размеру кэш с временем жизни записей и
+версией: bump() мгновенно инвалидирует всё, что было закэшировано до него.
+Каждый воркер uvicorn держит свою копию — кэшируем только то, что можно
+пересчитать, и с коротким TTL.
+"""
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+_instances: "weakref.WeakSet[TTLCache]" = weakref.WeakSet()
+
+
+def all_caches() -> list:
+    """Все живые TTLCache процесса (для /metrics)"""
+    return sorted(_instances, key=lambda cache: cache.name)
+
+
+class TTLCache:
+    """LRU + TTL + версия. Потокобезопасен (sync-эндпоинты идут в threadpool)."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 256):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, version, value = entry
+                if expires_at > now and version == self.version:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, version: Optional[int] = None) -> None:
+        """version — версия на момент начала вычисления value: если между
+        чтением и записью был bump(), запись сразу окажется устаревшей."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, self.version if version is None else version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        version = self.version
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, version=version)
+        return value
+
+    def bump(self) -> None:
+        """Инвалидирует все записи (ленивое удаление по версии)"""
+        with self._lock:
+            self.version += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
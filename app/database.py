@@ -1,14 +1,112 @@
-from sqlalchemy import create_engine
+"""
+Подключение к PostgreSQL: engine, пул, сессии.
+
+Пул настраивается из env (DB_POOL_*). Sync-эндпоинты FastAPI идут в
+threadpool на 40 потоков — если потоков больше, чем соединений, запросы
+ждут checkout; это время видно в pool_status().
+
+DB_ASYNC_HOT_PATHS=true: /api/verify, /api/log-denied и вебхук Tilda
+работают на AsyncSession (asyncpg, свой пул DB_ASYNC_*) — ожидание БД не
+занимает поток, и всплеск сканов не упирается в 40 потоков. Логика
+эндпоинтов — тот же sync-код на Session, запущенный через run_db().
+Остальные эндпоинты — на sync-стеке. По умолчанию выключено: второй пул
+на воркер, включать по результатам benchmarks/loadtest.py compare.
+
+statement_timeout задаётся по классу маршрута (verify / default / report /
+batch) через SET LOCAL в начале каждой транзакции сессии — работает и за
+PgBouncer в transaction-режиме, где SET на уровне сессии «утекает» в чужие
+транзакции.
+
+DB_PGBOUNCER=true: NullPool (пулом занимается PgBouncer), никакого
+состояния на стороне сервера между транзакциями. Миграции и advisory lock
+требуют прямого соединения — DATABASE_DIRECT_URL (get_direct_engine).
+
+DATABASE_REPLICA_URL: read-only эндпоинты берут get_read_db — SELECT идут в
+реплику, пока её отставание не больше REPLICA_MAX_LAG_SECONDS; запись в
+такой сессии уходит в primary, и дальше сессия читает тоже из primary.
+Вызывающий, который недавно что-то менял, читает из primary (app/replica.py).
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional, Union
+from uuid import uuid4
+
+from sqlalchemy import Select, TextClause, create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from starlette.concurrency import run_in_threadpool
+from app.cache import TTLCache
 from app.config import settings
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10
-)
+logger = logging.getLogger("impreza.security")
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool, который считает время ожидания checkout"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """То же для async engine"""
+
+
+def _engine_options() -> dict:
+    if settings.DB_PGBOUNCER:
+        return {"poolclass": NullPool}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+engine = create_engine(settings.DATABASE_URL, **_engine_options())
+
+_direct_engine = None
+
+
+def get_direct_engine():
+    """Engine в обход PgBouncer (миграции, advisory lock, DDL партиций)"""
+    global _direct_engine
+    if not settings.DATABASE_DIRECT_URL:
+        return engine
+    if _direct_engine is None:
+        _direct_engine = create_engine(settings.DATABASE_DIRECT_URL, poolclass=NullPool)
+    return _direct_engine
+
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -19,3 +117,278 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# ─── Реплика для чтения ───
+
+_replica_engine = None
+
+# True — чтения в этом контексте идут в primary (read-your-writes,
+# заполнение общих кэшей процесса)
+_use_primary: ContextVar[bool] = ContextVar("use_primary", default=False)
+
+_REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+replica_lag_cache = TTLCache("replica_lag", ttl=settings.REPLICA_LAG_CHECK_SECONDS, maxsize=1)
+
+
+def get_replica_engine():
+    """Engine реплики; None — реплика не настроена"""
+    global _replica_engine
+    if not settings.DATABASE_REPLICA_URL:
+        return None
+    if _replica_engine is None:
+        _replica_engine = create_engine(settings.DATABASE_REPLICA_URL, **_engine_options())
+    return _replica_engine
+
+
+@contextmanager
+def on_primary(enabled: bool = True):
+    """Чтения через get_read_db внутри блока идут в primary"""
+    token = _use_primary.set(enabled or _use_primary.get())
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def replica_lag() -> Optional[float]:
+    """Отставание реплики, секунды (кэш на REPLICA_LAG_CHECK_SECONDS); None — недоступна.
+
+    Реплика без входящего WAL (primary простаивает) догнала его — отставание 0,
+    хотя pg_last_xact_replay_timestamp() может быть сколь угодно старым.
+    """
+    def _measure():
+        try:
+            with get_replica_engine().connect() as conn:
+                return float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+        except Exception as e:
+            logger.warning("Read replica unavailable, reading from primary: %s", e)
+            return None
+
+    return replica_lag_cache.get_or_set("lag", _measure)
+
+
+def replica_usable() -> bool:
+    if get_replica_engine() is None or _use_primary.get():
+        return False
+    lag = replica_lag()
+    return lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+
+
+class RoutingSession(Session):
+    """SELECT — в реплику; flush, UPDATE/DELETE, SELECT ... FOR UPDATE и
+    прочее — в primary. После первой записи сессия целиком на primary."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = get_replica_engine()
+        if replica is None or self._flushing or self.info.get("wrote") or _use_primary.get():
+            return super().get_bind(mapper=mapper, clause=clause, **kw)
+        if isinstance(clause, Select) and clause._for_update_arg is None:
+            return replica
+        if isinstance(clause, TextClause) and clause.text.lstrip()[:6].upper() == "SELECT":
+            return replica
+        self.info["wrote"] = True
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+
+def get_read_db():
+    """Сессия для read-only эндпоинтов: реплика, если она настроена и догнала
+    primary, иначе обычная сессия primary"""
+    db = ReadSessionLocal() if replica_usable() else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# ─── statement_timeout по классу маршрута ───
+
+STATEMENT_TIMEOUTS_MS = {
+    "verify": settings.DB_STATEMENT_TIMEOUT_VERIFY_MS,
+    "default": settings.DB_STATEMENT_TIMEOUT_DEFAULT_MS,
+    "report": settings.DB_STATEMENT_TIMEOUT_REPORT_MS,
+    "batch": settings.DB_STATEMENT_TIMEOUT_BATCH_MS,
+}
+
+_REPORT_PREFIXES = ("/api/stats", "/api/archive")
+_VERIFY_PREFIXES = ("/api/verify", "/api/log-denied")
+
+# None — вне запроса (CLI, старт): SET LOCAL не выполняется
+_statement_class: ContextVar[Optional[str]] = ContextVar("statement_class", default=None)
+
+
+def route_statement_class(path: str) -> str:
+    if path.startswith(_VERIFY_PREFIXES):
+        return "verify"
+    if path.startswith(_REPORT_PREFIXES):
+        return "report"
+    return "default"
+
+
+@contextmanager
+def statement_class(name: Optional[str]):
+    """Класс statement_timeout для сессий, открытых внутри блока"""
+    token = _statement_class.set(name)
+    try:
+        yield
+    finally:
+        _statement_class.reset(token)
+
+
+def in_statement_class(name: Optional[str]):
+    """Декоратор для фоновых задач: они переживают запрос и его класс"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with statement_class(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(SessionLocal, "after_begin")
+def _apply_statement_timeout(session, transaction, connection):
+    name = _statement_class.get()
+    if name is None:
+        return
+    timeout_ms = int(STATEMENT_TIMEOUTS_MS.get(name, 0))
+    # Без PgBouncer у соединения нет чужих SET — 0 (без лимита) можно не слать
+    if timeout_ms == 0 and not settings.DB_PGBOUNCER:
+        return
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+
+event.listen(ReadSessionLocal, "after_begin", _apply_statement_timeout)
+
+
+def _pool_stats(pool) -> dict:
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__, "pgbouncer": settings.DB_PGBOUNCER}
+    status = {
+        "pool": type(pool).__name__,
+        "pgbouncer": settings.DB_PGBOUNCER,
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_in": pool.checkedin(),
+        "in_use": pool.checkedout(),
+        # overflow() отрицателен, пока пул не заполнен до pool_size
+        "overflow": max(pool.overflow(), 0),
+    }
+    if isinstance(pool, TimedQueuePool):
+        status.update({
+            "checkouts": pool.checkouts,
+            "checkout_wait_seconds_total": round(pool.wait_total, 6),
+            "checkout_wait_seconds_max": round(pool.wait_max, 6),
+            "checkout_timeouts": pool.timeouts,
+        })
+    return status
+
+
+def pool_status() -> dict:
+    """Состояние пула: занятые соединения, overflow, ожидание checkout"""
+    status = _pool_stats(engine.pool)
+    replica = get_replica_engine()
+    if replica is not None:
+        status["replica"] = dict(_pool_stats(replica.pool), lag_seconds=replica_lag())
+    if _async_engine is not None:
+        status["async"] = _pool_stats(_async_engine.sync_engine.pool)
+    return status
+
+
+# ─── Async engine для горячих эндпоинтов (DB_ASYNC_HOT_PATHS) ───
+
+_async_engine = None
+
+
+def async_database_url(url: str):
+    """DATABASE_URL → postgresql+asyncpg. sslmode (libpq) asyncpg не знает —
+    передаём как ssl с тем же значением"""
+    url = make_url(url).set(drivername="postgresql+asyncpg")
+    sslmode = url.query.get("sslmode")
+    if sslmode:
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": sslmode})
+    return url
+
+
+def _async_engine_options() -> dict:
+    if settings.DB_PGBOUNCER:
+        # Transaction pooling: следующая транзакция может попасть на другое
+        # серверное соединение — без кэша prepared statements и с уникальными именами
+        return {
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+        }
+    return {
+        "poolclass": TimedAsyncQueuePool,
+        "pool_size": settings.DB_ASYNC_POOL_SIZE,
+        "max_overflow": settings.DB_ASYNC_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def get_async_engine():
+    """Async engine на том же DATABASE_URL; создаётся при первом запросе"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(async_database_url(settings.DATABASE_URL), **_async_engine_options())
+    return _async_engine
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+class AsyncBackedSession(Session):
+    """sync_session_class для AsyncSession: на нём висят события сессии"""
+
+
+AsyncSessionLocal = async_sessionmaker(
+    class_=AsyncSession, sync_session_class=AsyncBackedSession, autocommit=False, autoflush=False,
+)
+
+event.listen(AsyncBackedSession, "after_begin", _apply_statement_timeout)
+
+
+async def get_async_db():
+    db = AsyncSessionLocal(bind=get_async_engine())
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+# Зависимость горячих эндпоинтов: AsyncSession или обычная Session
+get_hot_db = get_async_db if settings.DB_ASYNC_HOT_PATHS else get_db
+
+HotSession = Union[Session, AsyncSession]
+
+
+async def run_db(db: HotSession, fn, *args):
+    """fn(session, *args) — обычный sync-код на Session — без блокировки event loop.
+
+    AsyncSession: run_sync — запросы fn идут через asyncpg в том же потоке,
+    пока ждём БД, event loop обслуживает другие запросы. Session: fn в
+    threadpool, как sync-эндпоинт.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
@@ -6,18 +6,26 @@ IMPREZA Security: Авторизация через API Key и/или JWT.
   - require_role("manager")  → JWT с ролью >= manager
   - require_admin        → JWT с ролью super
   - get_optional_auth    → если есть токен — парсим, если нет — None (для публичных)
+
+Проверенные JWT кэшируются (по sha256 токена) до их exp: сканер шлёт один
+и тот же токен тысячи раз за ночь, HMAC-проверка и разбор payload делаются
+один раз. JWT_MIN_IAT проверяется и на попадании в кэш.
 """
 
 from __future__ import annotations
 
+import hashlib
 import logging
+import time
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Optional
 
 import jwt
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+from app.cache import TTLCache
 from app.config import settings
 
 logger = logging.getLogger("impreza.security")
@@ -39,6 +47,9 @@ JWT_ALGORITHM = "HS256"
 # Необязательный bearer — не бросает 403 если нет заголовка
 _optional_bearer = HTTPBearer(auto_error=False)
 
+# sha256(token) → (AuthInfo, iat). Невалидные токены не кэшируются.
+token_cache = TTLCache("verified_jwt", ttl=settings.AUTH_CACHE_TTL, maxsize=settings.AUTH_CACHE_SIZE)
+
 
 # ────────────────────────────────────────────
 # Внутренние хелперы
@@ -52,6 +63,20 @@ def _verify_api_key(request: Request) -> bool:
     return api_key == settings.INTERNAL_API_KEY
 
 
+@lru_cache(maxsize=4)
+def _parse_min_iat(value: str) -> int:
+    return int(value or "0")
+
+
+def _revoked(token_iat) -> bool:
+    """Токен выпущен до катоффа JWT_MIN_IAT"""
+    min_iat = _parse_min_iat(settings.JWT_MIN_IAT)
+    if min_iat > 0 and isinstance(token_iat, (int, float)) and token_iat < min_iat:
+        logger.warning("Token rejected: iat=%s < min_iat=%s", token_iat, min_iat)
+        return True
+    return False
+
+
 def _decode_jwt(token: str) -> Optional[dict]:
     """Декодирует и валидирует JWT. Возвращает payload или None."""
     try:
@@ -61,12 +86,8 @@ def _decode_jwt(token: str) -> Optional[dict]:
             algorithms=[JWT_ALGORITHM],
         )
         # Проверяем min_iat — отклоняем токены, выпущенные до катоффа
-        min_iat = int(settings.JWT_MIN_IAT or "0")
-        if min_iat > 0:
-            token_iat = payload.get("iat", 0)
-            if isinstance(token_iat, (int, float)) and token_iat < min_iat:
-                logger.warning("Token rejected: iat=%s < min_iat=%s", token_iat, min_iat)
-                return None
+        if _revoked(payload.get("iat", 0)):
+            return None
         return payload
     except jwt.ExpiredSignatureError:
         return None
@@ -97,6 +118,36 @@ class AuthInfo:
         return ROLE_HIERARCHY.get(self.role, 0)
 
 
+def _auth_from_token(token: str) -> Optional[AuthInfo]:
+    """JWT → AuthInfo через кэш проверенных токенов.
+
+    Запись живёт до exp токена (но не дольше AUTH_CACHE_TTL). Один и тот же
+    AuthInfo отдаётся разным запросам — эндпоинты его не изменяют.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(key)
+    if cached is not None:
+        auth, token_iat = cached
+        return None if _revoked(token_iat) else auth
+
+    payload = _decode_jwt(token)
+    if not payload:
+        return None
+    auth = AuthInfo(
+        auth_type="jwt",
+        role=payload.get("role", "observer"),
+        name=payload.get("name"),
+        allowed_countries=payload.get("allowed_countries"),
+        club_id=payload.get("club_id"),
+    )
+    ttl = settings.AUTH_CACHE_TTL
+    if isinstance(payload.get("exp"), (int, float)):
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(key, (auth, payload.get("iat", 0)), ttl=ttl)
+    return auth
+
+
 # ────────────────────────────────────────────
 # Public dependencies (для use в Depends())
 # ────────────────────────────────────────────
@@ -115,15 +166,9 @@ async def require_auth(
 
     # 2. JWT из Authorization: Bearer ...
     if credentials and credentials.credentials:
-        payload = _decode_jwt(credentials.credentials)
-        if payload:
-            return AuthInfo(
-                auth_type="jwt",
-                role=payload.get("role", "observer"),
-                name=payload.get("name"),
-                allowed_countries=payload.get("allowed_countries"),
-                club_id=payload.get("club_id"),
-            )
+        auth = _auth_from_token(credentials.credentials)
+        if auth:
+            return auth
 
     # 3. Ничего не подошло
     logger.warning(
@@ -147,15 +192,9 @@ async def get_optional_auth(
     if _verify_api_key(request):
         return AuthInfo(auth_type="api_key", role="super")
     if credentials and credentials.credentials:
-        payload = _decode_jwt(credentials.credentials)
-        if payload:
-            return AuthInfo(
-                auth_type="jwt",
-                role=payload.get("role", "observer"),
-                name=payload.get("name"),
-                allowed_countries=payload.get("allowed_countries"),
-                club_id=payload.get("club_id"),
-            )
+        auth = _auth_from_token(credentials.credentials)
+        if auth:
+            return auth
     return None
 
 
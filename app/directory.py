@@ -0,0 +1,124 @@
+"""
+Справочник клубов и стран в памяти процесса.
+
+clubs JOIN countries меняется несколько раз в год, а читается на каждой
+загрузке админки, создании билета и вебхуке Tilda. Снимок грузится при
+старте, живёт CLUB_DIRECTORY_TTL секунд и сбрасывается invalidate_directory()
+после изменения клуба (смена пароля). Каждый воркер держит свою копию —
+другие воркеры увидят изменение не позже чем через TTL.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.cache import TTLCache
+from app.config import settings
+from app.database import SessionLocal, on_primary
+
+logger = logging.getLogger("impreza.security")
+
+directory_cache = TTLCache("club_directory", ttl=settings.CLUB_DIRECTORY_TTL, maxsize=1)
+
+# Поля клуба, которые можно отдавать не-super пользователям
+PUBLIC_FIELDS = ("id", "city_name", "city_english", "country_code", "login", "is_active")
+
+
+def _etag(payload) -> str:
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def load_directory(db: Session) -> dict:
+    """Читает clubs + countries одним проходом и строит индексы"""
+    countries = {
+        row.country_id: row.country_code
+        for row in db.execute(text("SELECT country_id, country_code FROM countries"))
+    }
+    rows = db.execute(text("""
+        SELECT c.club_id AS id, c.city_name, c.city_english, c.country_id,
+               c.login, c.is_active, c.plain_password
+        FROM clubs c
+        ORDER BY c.club_id
+    """)).mappings().all()
+
+    clubs = []
+    for row in rows:
+        club = dict(row)
+        club["country_code"] = countries.get(row["country_id"])
+        clubs.append(club)
+    # Порядок списка для админки — как был в SQL: страна, город
+    clubs.sort(key=lambda c: (c["country_code"] or "", c["city_name"] or ""))
+
+    # Город → клуб по обоим названиям; активные клубы пишутся последними
+    # и перекрывают неактивные с тем же городом
+    by_city = {}
+    for club in sorted(clubs, key=lambda c: bool(c["is_active"])):
+        for field in ("city_name", "city_english"):
+            key = (club[field] or "").strip().lower()
+            if key:
+                by_city[key] = club
+
+    public = [{field: club[field] for field in PUBLIC_FIELDS} for club in clubs]
+    return {
+        "clubs": clubs,
+        "by_id": {club["id"]: club for club in clubs},
+        "by_city": by_city,
+        "countries": countries,
+        "etag_public": _etag(public),
+        "etag_super": _etag([[c["id"], c["plain_password"]] for c in clubs] + public),
+        "loaded_at": datetime.now(timezone.utc),
+    }
+
+
+def get_directory(db: Optional[Session] = None) -> dict:
+    """Текущий снимок справочника (перечитывается по TTL или после invalidate)"""
+    def _load():
+        if db is not None:
+            with on_primary():
+                return load_directory(db)
+        session = SessionLocal()
+        try:
+            return load_directory(session)
+        finally:
+            session.close()
+
+    return directory_cache.get_or_set("clubs", _load)
+
+
+def invalidate_directory() -> None:
+    """Сбросить снимок — следующий запрос перечитает clubs/countries"""
+    directory_cache.bump()
+
+
+def refresh_directory(db: Optional[Session] = None) -> dict:
+    """Сбросить и сразу перечитать (старт приложения, после изменения клуба)"""
+    invalidate_directory()
+    directory = get_directory(db)
+    logger.info("Club directory loaded: %s clubs, %s countries",
+                len(directory["clubs"]), len(directory["countries"]))
+    return directory
+
+
+def club_by_id(club_id: Optional[int], db: Optional[Session] = None) -> Optional[dict]:
+    if not club_id:
+        return None
+    return get_directory(db)["by_id"].get(club_id)
+
+
+def club_by_city(city_name: Optional[str], db: Optional[Session] = None) -> Optional[dict]:
+    """Клуб по городу: city_english или city_name, без учёта регистра"""
+    if not city_name:
+        return None
+    return get_directory(db)["by_city"].get(city_name.strip().lower())
+
+
+def public_club(club: dict, with_password: bool = False) -> dict:
+    result = {field: club[field] for field in PUBLIC_FIELDS}
+    if with_password:
+        result["plain_password"] = club["plain_password"]
+    return result
@@ -0,0 +1,159 @@
+"""
+Метрики Prometheus (GET /metrics).
+
+- http_request_duration_seconds / http_requests_total — по шаблону маршрута
+  (/api/tickets/{order_id}, а не конкретный URL), методу и статусу
+- db_queries_per_request / db_query_seconds_per_request — SQL за запрос
+  (события engine before/after_cursor_execute)
+- impreza_scans_total{result}, impreza_tilda_webhooks_total{outcome}
+- пул соединений, отставание реплики и TTLCache (hits/misses/size) —
+  снимаются в момент scrape
+
+Несколько воркеров uvicorn: задать PROMETHEUS_MULTIPROC_DIR (пустой
+каталог) — счётчики и гистограммы будут сведены по всем воркерам. Пул и
+кэши всегда показываются для воркера, ответившего на scrape (label pid).
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.cache import all_caches
+from app.database import pool_status
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUESTS = Counter("http_requests_total", "Requests by route and status", ["method", "route", "status"])
+REQUEST_SQL_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements per request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "db_query_seconds_per_request", "Time spent in SQL per request",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+SCANS = Counter("impreza_scans_total", "Scans by result", ["result"])
+TILDA_WEBHOOKS = Counter("impreza_tilda_webhooks_total", "Tilda webhooks by outcome", ["outcome"])
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+# ─── SQL за запрос ───
+
+class RequestSql:
+    """Счётчик SQL текущего запроса (живёт в contextvar).
+
+    statements — сколько раз выполнялся каждый текст запроса (для поиска N+1
+    в app/querybudget.py); параметры в тексте — плейсхолдеры, так что один
+    запрос в цикле даёт один ключ.
+    """
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: dict[str, int] = {}
+
+
+_request_sql: ContextVar[Optional[RequestSql]] = ContextVar("request_sql", default=None)
+
+
+def current_sql() -> Optional[RequestSql]:
+    return _request_sql.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_sql.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - conn.info.get("query_start", time.perf_counter())
+        stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+
+def route_label(request) -> str:
+    """Шаблон пути маршрута — метки не размножаются по id в URL"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+async def metrics_middleware(request, call_next):
+    stats = RequestSql()
+    token = _request_sql.set(stats)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _request_sql.reset(token)
+        route = route_label(request)
+        REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+        REQUESTS.labels(request.method, route, str(status)).inc()
+        REQUEST_SQL_QUERIES.labels(route).observe(stats.count)
+        REQUEST_SQL_SECONDS.labels(route).observe(stats.seconds)
+
+
+# ─── Снимок пула и кэшей на момент scrape ───
+
+class RuntimeCollector:
+    def collect(self):
+        pid = str(os.getpid())
+
+        pool = GaugeMetricFamily("db_pool", "Connection pool state of this worker", labels=["pid", "stat"])
+        status = pool_status()
+        for key, value in status.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                pool.add_metric([pid, key], value)
+        yield pool
+
+        replica = status.get("replica")
+        if replica is not None:
+            # -1 — реплика недоступна, чтение идёт из primary
+            lag = GaugeMetricFamily("db_replica_lag_seconds", "Read replica lag as seen by this worker", labels=["pid"])
+            lag.add_metric([pid], -1 if replica["lag_seconds"] is None else replica["lag_seconds"])
+            yield lag
+
+        hits = CounterMetricFamily("cache_hits", "TTLCache hits", labels=["pid", "cache"])
+        misses = CounterMetricFamily("cache_misses", "TTLCache misses", labels=["pid", "cache"])
+        size = GaugeMetricFamily("cache_size", "TTLCache entries", labels=["pid", "cache"])
+        ratio = GaugeMetricFamily("cache_hit_ratio", "TTLCache hit ratio since start", labels=["pid", "cache"])
+        for cache in all_caches():
+            stats = cache.stats()
+            hits.add_metric([pid, stats["name"]], stats["hits"])
+            misses.add_metric([pid, stats["name"]], stats["misses"])
+            size.add_metric([pid, stats["name"]], stats["size"])
+            ratio.add_metric([pid, stats["name"]], stats["hit_rate"])
+        yield from (hits, misses, size, ratio)
+
+
+_runtime_collector = RuntimeCollector()
+REGISTRY.register(_runtime_collector)
+
+
+def render() -> bytes:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_runtime_collector)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
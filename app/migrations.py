@@ -0,0 +1,223 @@
+"""
+Версионные миграции схемы.
+
+Таблица schema_version хранит применённые версии. При старте каждый воркер
+делает одну проверку max(version); если схема отстала — берёт advisory lock
+(остальные воркеры ждут на нём), перечитывает версию и применяет недостающие
+миграции, каждую в своей транзакции.
+
+Новая таблица/колонка/индекс → новая функция с @migration(<следующая версия>)
+в конце файла. Уже применённые миграции не меняются. Миграции пишутся
+идемпотентно (IF NOT EXISTS): базы, созданные старым startup(), получают
+baseline без ошибок.
+
+CLI: python migrate.py [status]
+"""
+import logging
+from contextlib import contextmanager
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger("impreza.security")
+
+# Ключи pg_advisory_lock (произвольные, но постоянные)
+MIGRATION_LOCK_KEY = 7_310_041
+MAINTENANCE_LOCK_KEY = 7_310_042
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = []
+
+
+def migration(version: int, description: str):
+    def register(fn: Callable[[Connection], None]):
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise ValueError(f"Migration {version} must be greater than {MIGRATIONS[-1][0]}")
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def head_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn: Connection) -> int:
+    """Версия схемы БД (0 — schema_version ещё нет)"""
+    if not conn.execute(text("SELECT to_regclass('schema_version') IS NOT NULL")).scalar():
+        return 0
+    return conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version")).scalar()
+
+
+@contextmanager
+def advisory_lock(conn: Connection, key: int, wait: bool = True):
+    """Сессионный advisory lock. wait=False — не ждать: yield False, если занят."""
+    if wait:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+        acquired = True
+    else:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+    conn.commit()
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+            conn.commit()
+
+
+def migrate(engine: Engine) -> list[int]:
+    """Доводит схему до head_version(). Возвращает применённые версии."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+        conn.commit()
+        if version >= head_version():
+            return []
+
+        with advisory_lock(conn, MIGRATION_LOCK_KEY):
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR(200) NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                )
+            """))
+            conn.commit()
+            # Пока ждали lock, другой воркер мог всё применить
+            version = current_version(conn)
+
+            applied = []
+            for number, description, apply in MIGRATIONS:
+                if number <= version:
+                    continue
+                try:
+                    apply(conn)
+                    conn.execute(
+                        text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                        {"v": number, "d": description},
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    logger.exception("Migration %s (%s) failed", number, description)
+                    raise
+                logger.info("Migration %s applied: %s", number, description)
+                applied.append(number)
+            return applied
+
+
+def status(engine: Engine) -> dict:
+    with engine.connect() as conn:
+        version = current_version(conn)
+        rows = []
+        if version:
+            rows = conn.execute(text(
+                "SELECT version, description, applied_at FROM schema_version ORDER BY version"
+            )).mappings().all()
+    applied = {row["version"]: row for row in rows}
+    return {
+        "current": version,
+        "head": head_version(),
+        "migrations": [
+            {
+                "version": number,
+                "description": description,
+                "applied_at": applied[number]["applied_at"] if number in applied else None,
+            }
+            for number, description, _ in MIGRATIONS
+        ],
+    }
+
+
+# ─── Миграции ───
+
+@migration(1, "baseline: tables from models + legacy columns")
+def _baseline(conn: Connection) -> None:
+    # Бывшие add_deleted_tickets_table.py / migration_hidden_for_manager.py /
+    # add_plain_password_migration.py и проверки information_schema в startup()
+    from app.database import Base
+    from app.partitions import ensure_partitions, is_partitioned
+
+    Base.metadata.create_all(bind=conn)
+    for statement in (
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS visible_to_managers BOOLEAN DEFAULT TRUE",
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS quantity INTEGER DEFAULT 1",
+        "ALTER TABLE clubs ADD COLUMN IF NOT EXISTS plain_password VARCHAR(255)",
+        "ALTER TABLE scan_history ADD COLUMN IF NOT EXISTS hidden_for_manager BOOLEAN DEFAULT FALSE",
+    ):
+        conn.execute(text(statement))
+    # Новая БД: create_all создал партиционированную scan_history без партиций
+    if is_partitioned(conn):
+        ensure_partitions(conn)
+
+
+@migration(2, "indexes for sync, stats and history queries")
+def _query_indexes(conn: Connection) -> None:
+    # create_all не добавляет индексы в уже существующие таблицы
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_tickets_updated_at ON tickets (updated_at)",
+        "CREATE INDEX IF NOT EXISTS ix_scan_history_club_time_result ON scan_history (club_id, scan_time, scan_result)",
+        "CREATE INDEX IF NOT EXISTS ix_scan_history_result_time ON scan_history (scan_result, scan_time)",
+        "CREATE INDEX IF NOT EXISTS ix_tickets_club_history "
+        "ON tickets (club_id, first_scan_at DESC NULLS LAST, created_at DESC)",
+    ):
+        conn.execute(text(statement))
+
+
+@migration(3, "backfill scan_rollup from scan_history")
+def _backfill_rollup(conn: Connection) -> None:
+    from sqlalchemy.orm import Session
+    from app.rollup import rebuild_rollup
+
+    has_rollup = conn.execute(text("SELECT EXISTS (SELECT 1 FROM scan_rollup)")).scalar()
+    has_scans = conn.execute(text("SELECT EXISTS (SELECT 1 FROM scan_history)")).scalar()
+    if has_scans and not has_rollup:
+        # Сессия на том же соединении: её commit() закрывает только savepoint,
+        # миграция фиксируется целиком в migrate()
+        with Session(bind=conn, join_transaction_mode="create_savepoint") as db:
+            logger.info("Backfilled scan_rollup: %s buckets", rebuild_rollup(db))
+
+
+@migration(4, "partial index for denied scans")
+def _denied_scans_index(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_scan_history_denied_club_time "
+        "ON scan_history (club_id, scan_time DESC, id DESC) "
+        "WHERE scan_result IN ('denied', 'forged', 'invalid')"
+    ))
+
+
+@migration(5, "visibility rules bounded by max_row_id")
+def _bounded_visibility_rules(conn: Connection) -> None:
+    # Существующим правилам — граница по времени создания: старший id строк,
+    # записанных не позже правила (для билетов — и закрытых мероприятий)
+    conn.execute(text("ALTER TABLE visibility_rules ADD COLUMN IF NOT EXISTS max_row_id INTEGER"))
+    conn.execute(text("""
+        UPDATE visibility_rules r SET max_row_id = coalesce(greatest(
+            (SELECT max(t.id) FROM tickets t WHERE t.created_at <= r.created_at),
+            (SELECT max(a.original_id) FROM tickets_archive a WHERE a.original_created_at <= r.created_at)
+        ), 0)
+        WHERE r.target = 'tickets' AND r.max_row_id IS NULL AND r.created_at IS NOT NULL
+    """))
+    conn.execute(text("""
+        UPDATE visibility_rules r SET max_row_id = coalesce(
+            (SELECT max(h.id) FROM scan_history h WHERE h.scan_time <= r.created_at), 0)
+        WHERE r.target = 'history' AND r.max_row_id IS NULL AND r.created_at IS NOT NULL
+    """))
+
+
+@migration(6, "shared revenue cache version")
+def _revenue_cache_version(conn: Connection) -> None:
+    # Общая для воркеров версия кэша выручки (app/revenue.py)
+    conn.execute(text("CREATE SEQUENCE IF NOT EXISTS revenue_cache_version"))
+
+
+@migration(7, "scan_history ticket_id index")
+def _scan_history_ticket_index(conn: Connection) -> None:
+    # UPDATE/DELETE по ticket_id IN (...) в close_event и удалении билетов —
+    # без индекса Seq Scan по всем месячным партициям под FOR UPDATE билетов
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_scan_history_ticket_id "
+        "ON scan_history (ticket_id) WHERE ticket_id IS NOT NULL"
+    ))
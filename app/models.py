@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey, Boolean, Index, BigInteger, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -46,15 +47,28 @@ class Ticket(Base):
     telegram_message_id = Column(Integer)
     
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    # SYNC: индекс для инкрементальной выдачи (updated_since)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), index=True)
     
     scan_history = relationship("ScanHistory", back_populates="ticket")
+    
+    # HISTORY: порядок выдачи /api/history по клубу
+    __table_args__ = (
+        Index(
+            "ix_tickets_club_history",
+            "club_id",
+            text("first_scan_at DESC NULLS LAST"),
+            text("created_at DESC"),
+        ),
+    )
 
 
 class ScanHistory(Base):
+    """Журнал сканов. Партиционирован по месяцам scan_time (app/partitions.py),
+    поэтому scan_time входит в первичный ключ."""
     __tablename__ = "scan_history"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     ticket_id = Column(Integer, ForeignKey("tickets.id"))
     order_id = Column(String(50), index=True)
     
@@ -64,12 +78,123 @@ class ScanHistory(Base):
     # IMPREZA: Скрытие от менеджеров
     hidden_for_manager = Column(Boolean, default=False, index=True)
     
-    scan_time = Column(DateTime, server_default=func.now())
+    scan_time = Column(DateTime, primary_key=True, server_default=func.now())
     scan_result = Column(String(20))
     scanner_id = Column(String(100))
     notes = Column(Text)
     
     ticket = relationship("Ticket", back_populates="scan_history")
+    
+    # Составные индексы для статистики "за сегодня" (диапазон по scan_time)
+    __table_args__ = (
+        Index("ix_scan_history_club_time_result", "club_id", "scan_time", "scan_result"),
+        Index("ix_scan_history_result_time", "scan_result", "scan_time"),
+        # Отвязка/вычитание сканов по билетам: close_event, удаление билетов
+        Index("ix_scan_history_ticket_id", "ticket_id", postgresql_where=text("ticket_id IS NOT NULL")),
+        # Красная вкладка сканера (/api/denied-scans): keyset по (scan_time, id)
+        Index(
+            "ix_scan_history_denied_club_time",
+            "club_id", text("scan_time DESC"), text("id DESC"),
+            postgresql_where=text("scan_result IN ('denied', 'forged', 'invalid')"),
+        ),
+        {"postgresql_partition_by": "RANGE (scan_time)"},
+    )
+
+
+class ScanRollup(Base):
+    """Инкрементальные счётчики сканов: клуб / мероприятие / час / результат.
+
+    Поддерживается в log_scan, пересчитывается rebuild_scan_rollup.py.
+    NULL-ключи хранятся как 0 / '' — иначе не работает ON CONFLICT.
+    """
+    __tablename__ = "scan_rollup"
+    
+    club_id = Column(Integer, primary_key=True, default=0)
+    event_name = Column(String(200), primary_key=True, default="")
+    bucket = Column(DateTime, primary_key=True)  # date_trunc('hour', scan_time)
+    scan_result = Column(String(20), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_scan_rollup_club_bucket", "club_id", "bucket"),
+        Index("ix_scan_rollup_bucket", "bucket"),
+    )
+
+
+class BatchJob(Base):
+    """Прогресс фоновых пакетных операций (скрытие/восстановление истории и т.п.).
+
+    Хранится в БД, а не в памяти — статус видят все воркеры.
+    """
+    __tablename__ = "batch_jobs"
+    
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(50), nullable=False)
+    status = Column(String(20), default="pending", index=True)  # pending | running | done | failed
+    processed = Column(Integer, default=0)
+    total_batches = Column(Integer, default=0)
+    done_batches = Column(Integer, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime, server_default=func.now())
+    finished_at = Column(DateTime)
+
+
+class ArchiveSegment(Base):
+    """Манифест холодного архива (app/archive.py): один файл — одна запись.
+
+    Строки из файла удалены из PostgreSQL; [start_at, end_at) — диапазон
+    scan_time (scan_history) или deleted_at (deleted_tickets).
+    """
+    __tablename__ = "archive_segments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String(50), nullable=False)
+    source = Column(String(100))  # имя партиции или "range"
+    club_id = Column(Integer)
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    row_count = Column(Integer, default=0)
+    format = Column(String(20), nullable=False)  # parquet | ndjson.zst | ndjson.gz
+    uri = Column(String(500), nullable=False)
+    size_bytes = Column(BigInteger, default=0)
+    sha256 = Column(String(64))
+    created_at = Column(DateTime, server_default=func.now())
+    created_by = Column(String(100))
+    
+    __table_args__ = (
+        Index("ix_archive_segments_table_range", "table_name", "start_at", "end_at"),
+    )
+
+
+class VisibilityRule(Base):
+    """Правило видимости для менеджеров вместо массовой перезаписи флагов.
+
+    target: "tickets" (вместо tickets.visible_to_managers)
+            "history" (вместо scan_history.hidden_for_manager)
+    effect: "hide" | "show" — действует последнее (по id) подходящее правило;
+            если ни одно не подошло — используется старый флаг в строке.
+    Пустые поля scope не ограничивают. start_at/end_at — [start, end) по
+    created_at для билетов и по scan_time для истории.
+    max_row_id — старший id строк на момент создания: правило не действует
+    на строки, добавленные позже (NULL — правило старше этой колонки, без границы).
+    """
+    __tablename__ = "visibility_rules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    target = Column(String(20), nullable=False, index=True)
+    effect = Column(String(10), nullable=False, default="hide")
+    
+    club_id = Column(Integer)
+    city_name = Column(String(100))
+    country_code = Column(String(10))
+    event_name = Column(String(200))
+    start_at = Column(DateTime)
+    end_at = Column(DateTime)
+    ticket_ids = Column(ARRAY(Integer))
+    max_row_id = Column(Integer)
+    
+    created_at = Column(DateTime, server_default=func.now())
+    created_by = Column(String(100))
 
 
 class Club(Base):
@@ -86,10 +211,12 @@ class Club(Base):
     is_active = Column(Boolean, default=True)
 
 
-class DeletedTicket(Base):
-    """Архив удалённых билетов — для восстановления и аудита"""
-    __tablename__ = "deleted_tickets"
-    
+class TicketSnapshotMixin:
+    """Копия строки tickets (id → original_id, created/updated → original_*).
+
+    Общая форма для deleted_tickets и tickets_archive — перенос и
+    восстановление идут одним INSERT ... SELECT (app/ticket_archive.py).
+    """
     id = Column(Integer, primary_key=True, index=True)
     
     # Оригинальные поля из tickets
@@ -130,8 +257,30 @@ class DeletedTicket(Base):
     
     original_created_at = Column(DateTime)  # Когда билет был создан
     original_updated_at = Column(DateTime)  # Когда билет был обновлён
+
+
+class DeletedTicket(TicketSnapshotMixin, Base):
+    """Архив удалённых билетов — для восстановления и аудита"""
+    __tablename__ = "deleted_tickets"
     
     # Поля архива
     deleted_at = Column(DateTime, server_default=func.now(), index=True)
     deleted_by = Column(String(100))  # Кто удалил
     delete_reason = Column(String(500))  # Причина удаления
+
+
+class ArchivedTicket(TicketSnapshotMixin, Base):
+    """Билеты закрытых мероприятий (вынесены из tickets вместе с состоянием сканирования).
+
+    scan_history этих билетов остаётся (ticket_id = NULL, связь по order_id)
+    и перепривязывается при повторном открытии мероприятия.
+    """
+    __tablename__ = "tickets_archive"
+    
+    archived_at = Column(DateTime, server_default=func.now(), index=True)
+    archived_by = Column(String(100))
+    archive_reason = Column(String(500))
+    
+    __table_args__ = (
+        Index("ix_tickets_archive_club_event", "club_id", "event_name"),
+    )
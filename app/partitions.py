@@ -0,0 +1,267 @@
+"""
+Помесячные партиции scan_history (PARTITION BY RANGE (scan_time)).
+
+- ensure_partitions  — партиции на текущий и HISTORY_PARTITION_MONTHS_AHEAD
+                       месяцев вперёд + DEFAULT-партиция для всего остального
+- apply_retention    — старые месяцы отцепляются (DETACH) или удаляются (DROP)
+                       целиком, без DELETE по строкам
+- convert_to_partitioned — разовый перевод обычной таблицы (partition_scan_history.py)
+
+Границы месяцев — в naive-времени БД, как и сам scan_time.
+scan_rollup при retention не трогается: агрегаты живут дольше сырых сканов.
+"""
+import logging
+import re
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.config import settings
+from app.models import ScanHistory
+
+logger = logging.getLogger("impreza.security")
+
+PARENT = "scan_history"
+DEFAULT_PARTITION = "scan_history_default"
+_NAME_RE = re.compile(r"^scan_history_p(\d{4})(\d{2})$")
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month:%Y%m}"
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_month(name: str) -> Optional[date]:
+    match = _NAME_RE.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def month_bounds(month: date) -> tuple[date, date]:
+    return month, _add_months(month, 1)
+
+
+def _db_month(conn: Connection) -> date:
+    """Текущий месяц по часам БД (scan_time пишется через now())"""
+    return conn.execute(text("SELECT date_trunc('month', localtimestamp)::date")).scalar()
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return bool(conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p
+            JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = :parent AND c.relnamespace = 'public'::regnamespace
+        )
+    """), {"parent": PARENT}).scalar())
+
+
+def list_partitions(conn: Connection) -> list[dict]:
+    """Партиции scan_history: имя, месяц (None для DEFAULT), оценка строк"""
+    rows = conn.execute(text("""
+        SELECT c.relname AS name, c.reltuples::bigint AS approx_rows,
+               pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :parent
+        ORDER BY c.relname
+    """), {"parent": PARENT}).mappings().all()
+
+    result = []
+    for row in rows:
+        result.append({
+            "name": row["name"],
+            "month": partition_month(row["name"]),
+            "approx_rows": max(row["approx_rows"], 0),
+            "bound": row["bound"],
+        })
+    return result
+
+
+def detached_partitions(conn: Connection) -> list[dict]:
+    """Месячные таблицы scan_history_pYYYYMM, отцеплённые retention (ждут архивации)"""
+    rows = conn.execute(text("""
+        SELECT c.relname AS name, c.reltuples::bigint AS approx_rows
+        FROM pg_class c
+        WHERE c.relkind = 'r' AND NOT c.relispartition
+          AND c.relnamespace = 'public'::regnamespace
+          AND c.relname ~ '^scan_history_p[0-9]{6}$'
+        ORDER BY c.relname
+    """)).mappings().all()
+    return [
+        {"name": row["name"], "month": partition_month(row["name"]), "approx_rows": max(row["approx_rows"], 0)}
+        for row in rows
+    ]
+
+
+def _is_attached(conn: Connection, name: str) -> bool:
+    return bool(conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = :parent AND c.relname = :name
+        )
+    """), {"parent": PARENT, "name": name}).scalar())
+
+
+def detach_partition(conn: Connection, name: str) -> bool:
+    """DETACH месячной партиции, если она ещё прицеплена. Не коммитит."""
+    attached = _is_attached(conn, name)
+    if attached:
+        conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+    return attached
+
+
+def attach_partition(conn: Connection, name: str) -> bool:
+    """ATTACH отцепленной месячной партиции обратно (откат detach_partition). Не коммитит."""
+    month = partition_month(name)
+    if month is None or _is_attached(conn, name):
+        return False
+    start, end = month_bounds(month)
+    conn.execute(text(
+        f"ALTER TABLE {PARENT} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return True
+
+
+def _create_month(conn: Connection, month: date) -> None:
+    """CREATE TABLE ... PARTITION OF для месяца.
+
+    Если в DEFAULT уже лежат строки этого месяца, PostgreSQL не даст создать
+    партицию — сначала переносим их во временную таблицу.
+    """
+    name = partition_name(month)
+    start, end = month_bounds(month)
+    bounds = {"start": start, "end": end}
+
+    has_default = conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": DEFAULT_PARTITION}).scalar()
+    stray = has_default and conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE scan_time >= :start AND scan_time < :end)"
+    ), bounds).scalar()
+
+    if stray:
+        conn.execute(text(f"CREATE TEMP TABLE _moved_scans (LIKE {PARENT}) ON COMMIT DROP"))
+        conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE scan_time >= :start AND scan_time < :end RETURNING *
+            ) INSERT INTO _moved_scans SELECT * FROM moved
+        """), bounds)
+
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+
+    if stray:
+        conn.execute(text(f"INSERT INTO {PARENT} SELECT * FROM _moved_scans"))
+        conn.execute(text("DROP TABLE _moved_scans"))
+
+
+def ensure_partitions(conn: Connection, months_ahead: Optional[int] = None,
+                      start: Optional[date] = None) -> list[str]:
+    """Создаёт недостающие месячные партиции от start (по умолчанию — текущий
+    месяц) до текущего + months_ahead и DEFAULT-партицию. Не коммитит."""
+    months_ahead = settings.HISTORY_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = _db_month(conn)
+    month = start.replace(day=1) if start else current
+    last = _add_months(current, months_ahead)
+
+    existing = {p["name"] for p in list_partitions(conn)}
+    created = []
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            _create_month(conn, month)
+            created.append(name)
+        month = _add_months(month, 1)
+
+    if DEFAULT_PARTITION not in existing:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT"))
+        created.append(DEFAULT_PARTITION)
+    return created
+
+
+def apply_retention(conn: Connection, keep_months: Optional[int] = None,
+                    mode: Optional[str] = None) -> list[str]:
+    """Отцепляет (mode="detach") или удаляет (mode="drop") месячные партиции
+    старше keep_months. keep_months=0 — retention выключен. Не коммитит.
+
+    Отцеплённые таблицы остаются в БД под тем же именем (их забирает архив).
+    """
+    keep_months = settings.HISTORY_RETENTION_MONTHS if keep_months is None else keep_months
+    mode = mode or settings.HISTORY_RETENTION_MODE
+    if keep_months <= 0:
+        return []
+    if mode not in ("detach", "drop"):
+        raise ValueError(f"Unknown retention mode: {mode}")
+
+    cutoff = _add_months(_db_month(conn), -keep_months)
+    removed = []
+    for partition in list_partitions(conn):
+        if partition["month"] is None or partition["month"] >= cutoff:
+            continue
+        detach_partition(conn, partition["name"])
+        if mode == "drop":
+            conn.execute(text(f"DROP TABLE {partition['name']}"))
+        removed.append(partition["name"])
+        logger.info("scan_history retention: %s %s", mode, partition["name"])
+    return removed
+
+
+def maintain(conn: Connection) -> dict:
+    """ensure_partitions + apply_retention (при старте и из CLI). Не коммитит."""
+    return {
+        "created": ensure_partitions(conn),
+        "removed": apply_retention(conn),
+    }
+
+
+def convert_to_partitioned(conn: Connection) -> int:
+    """Переводит обычную scan_history в партиционированную. Не коммитит.
+
+    Одна транзакция под ACCESS EXCLUSIVE: старая таблица переименовывается,
+    создаётся родитель с теми же колонками, партиции на весь диапазон данных,
+    строки копируются, старая таблица удаляется. Последовательность id
+    сохраняется. Возвращает число перенесённых строк.
+    """
+    legacy = f"{PARENT}_unpartitioned"
+    conn.execute(text(f"LOCK TABLE {PARENT} IN ACCESS EXCLUSIVE MODE"))
+
+    first = conn.execute(text(f"SELECT min(scan_time)::date FROM {PARENT}")).scalar()
+    # Ключ партиционирования входит в PK — NULL не допускается
+    conn.execute(text(f"UPDATE {PARENT} SET scan_time = '1970-01-01' WHERE scan_time IS NULL"))
+
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": PARENT}).scalar()
+
+    conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {legacy}"))
+    conn.execute(text(
+        f"CREATE TABLE {PARENT} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (scan_time)"
+    ))
+    conn.execute(text(f"ALTER TABLE {PARENT} ALTER COLUMN scan_time SET NOT NULL"))
+    ensure_partitions(conn, start=first)
+
+    moved = conn.execute(text(f"INSERT INTO {PARENT} SELECT * FROM {legacy}")).rowcount
+
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    conn.execute(text(f"DROP TABLE {legacy}"))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {PARENT}.id"))
+
+    # Имена PK/индексов освободились вместе со старой таблицей
+    conn.execute(text(f"ALTER TABLE {PARENT} ADD PRIMARY KEY (id, scan_time)"))
+    conn.execute(text(
+        f"ALTER TABLE {PARENT} ADD CONSTRAINT {PARENT}_ticket_id_fkey "
+        f"FOREIGN KEY (ticket_id) REFERENCES tickets(id)"
+    ))
+    for index in ScanHistory.__table__.indexes:
+        index.create(conn)
+    return moved
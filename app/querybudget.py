@@ -0,0 +1,95 @@
+"""
+Бюджет SQL-запросов на HTTP-запрос и поиск N+1.
+
+Маршрут объявляет бюджет декоратором (под @router.<method>):
+
+    @router.post("/verify")
+    @query_budget(20)
+    async def verify_ticket(...): ...
+
+Без декоратора действует SQL_QUERY_BUDGET_DEFAULT. N+1 — один и тот же
+текст запроса выполнен за запрос не меньше SQL_N_PLUS_ONE_THRESHOLD раз
+(запрос в цикле по строкам).
+
+SQL_BUDGET_MODE:
+  off   — только Server-Timing
+  log   — предупреждение в лог (прод)
+  raise — ответ заменяется на 500 с описанием нарушения: тестовый режим,
+          любой тест, задевший N+1 или превысивший бюджет, падает
+
+Server-Timing: db;dur=<мс>;desc="<N> queries", app;dur=<мс> — видно во
+вкладке Network браузера.
+"""
+import logging
+import time
+from typing import Optional
+
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+from app.metrics import RequestSql, current_sql, route_label
+
+logger = logging.getLogger("impreza.security")
+
+
+def query_budget(max_queries: int):
+    """Объявить бюджет SQL-запросов для эндпоинта"""
+    def decorator(fn):
+        fn.__query_budget__ = max_queries
+        return fn
+    return decorator
+
+
+def _budget_for(request) -> int:
+    endpoint = request.scope.get("endpoint")
+    return getattr(endpoint, "__query_budget__", settings.SQL_QUERY_BUDGET_DEFAULT)
+
+
+def find_violations(stats: RequestSql, budget: int) -> list[str]:
+    violations = []
+    if stats.count > budget:
+        violations.append(f"{stats.count} SQL statements, budget {budget}")
+    threshold = settings.SQL_N_PLUS_ONE_THRESHOLD
+    for statement, times in stats.statements.items():
+        # SET LOCAL statement_timeout идёт в каждой транзакции — это не N+1
+        if times >= threshold and not statement.startswith("SET "):
+            snippet = " ".join(statement.split())[:200]
+            violations.append(f"N+1: executed {times}x: {snippet}")
+    return violations
+
+
+def server_timing(stats: RequestSql, total_seconds: float) -> str:
+    return (
+        f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", '
+        f"app;dur={total_seconds * 1000:.1f}"
+    )
+
+
+async def query_budget_middleware(request, call_next):
+    """Должен стоять внутри metrics_middleware: тот создаёт счётчик SQL"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    stats: Optional[RequestSql] = current_sql()
+    if stats is None:
+        return response
+
+    if settings.SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(stats, time.perf_counter() - started)
+
+    mode = settings.SQL_BUDGET_MODE
+    if mode == "off":
+        return response
+    violations = find_violations(stats, _budget_for(request))
+    if not violations:
+        return response
+
+    route = route_label(request)
+    logger.warning("SQL budget exceeded: %s %s: %s", request.method, route, "; ".join(violations))
+    if mode == "raise":
+        timing = response.headers.get("Server-Timing")
+        return JSONResponse(
+            status_code=500,
+            content={"detail": "SQL budget exceeded", "route": route, "violations": violations},
+            headers={"Server-Timing": timing} if timing else None,
+        )
+    return response
@@ -0,0 +1,117 @@
+"""
+Rate limiting, общий для всех воркеров uvicorn.
+
+Хранилище счётчиков — RATE_LIMIT_STORAGE_URI (библиотека limits):
+  memory://            — в процессе (локально и в тестах)
+  redis://host:6379/0  — общее для всех воркеров/инстансов (прод),
+                         async-клиент redis-py (пакет redis, без coredis)
+
+Ключ — кто вызывает, а не IP: вся площадка сидит за одним NAT.
+  - сканер (JWT с club_id)  → club:<id> (все сканеры клуба — одно ведро;
+                              X-Scanner-Id задаёт клиент, ключом он быть не может)
+  - JWT без club_id         → <role>:<name>
+  - API Key                 → api_key
+  - без авторизации         → ip:<адрес>
+
+Бюджеты раздельные: /api/verify и /api/log-denied (RATE_LIMIT_VERIFY),
+вебхук Tilda (RATE_LIMIT_WEBHOOK — волна продаж идёт с нескольких IP Tilda)
+и всё остальное (RATE_LIMIT_ADMIN). Если хранилище недоступно или не
+создаётся — пропускаем запрос (сканирование важнее лимита) и пишем в лог.
+"""
+import logging
+import time
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from limits import parse
+from limits.aio.strategies import FixedWindowRateLimiter
+from limits.storage import storage_from_string
+
+from app.config import settings
+from app.dependencies.auth import _auth_from_token, _verify_api_key
+
+logger = logging.getLogger("impreza.security")
+
+VERIFY_PATHS = ("/api/verify", "/api/log-denied")
+WEBHOOK_PATHS = ("/api/tilda/webhook",)
+EXEMPT_PATHS = ("/health", "/", "/docs", "/openapi.json", "/metrics")
+
+BUDGETS = {
+    "verify": parse(settings.RATE_LIMIT_VERIFY),
+    "webhook": parse(settings.RATE_LIMIT_WEBHOOK),
+    "admin": parse(settings.RATE_LIMIT_ADMIN),
+}
+
+REDIS_SCHEMES = ("redis", "rediss", "redis+sentinel", "redis+cluster")
+
+_limiter: Optional[FixedWindowRateLimiter] = None
+
+
+def get_limiter() -> FixedWindowRateLimiter:
+    """Лимитер поверх async-хранилища (создаётся при первом запросе)"""
+    global _limiter
+    if _limiter is None:
+        uri = settings.RATE_LIMIT_STORAGE_URI
+        if not uri.startswith("async+"):
+            uri = f"async+{uri}"
+        options = {}
+        if uri[len("async+"):].split("://", 1)[0] in REDIS_SCHEMES:
+            # По умолчанию limits берёт coredis; в requirements — redis-py
+            options["implementation"] = "redispy"
+        _limiter = FixedWindowRateLimiter(storage_from_string(uri, **options))
+    return _limiter
+
+
+def route_class(path: str) -> Optional[str]:
+    """Бюджет для пути; None — без лимита"""
+    if path in EXEMPT_PATHS:
+        return None
+    if path.startswith(VERIFY_PATHS):
+        return "verify"
+    if path.startswith(WEBHOOK_PATHS):
+        return "webhook"
+    return "admin"
+
+
+def rate_limit_key(request: Request) -> str:
+    """Идентичность вызывающего из AuthInfo (через кэш проверенных JWT)"""
+    if _verify_api_key(request):
+        return "api_key"
+
+    header = request.headers.get("Authorization", "")
+    if header[:7].lower() == "bearer ":
+        auth = _auth_from_token(header[7:].strip())
+        if auth and auth.club_id:
+            return f"club:{auth.club_id}"
+        if auth:
+            return f"{auth.role}:{auth.name or '-'}"
+
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    budget_name = route_class(request.url.path)
+    if not settings.RATE_LIMIT_ENABLED or budget_name is None or request.method == "OPTIONS":
+        return await call_next(request)
+
+    budget = BUDGETS[budget_name]
+    key = rate_limit_key(request)
+    try:
+        limiter = get_limiter()
+        allowed = await limiter.hit(budget, budget_name, key)
+    except Exception as e:
+        logger.warning("Rate limit storage unavailable, request allowed: %s", e)
+        return await call_next(request)
+
+    if not allowed:
+        reset_at, _ = await limiter.get_window_stats(budget, budget_name, key)
+        retry_after = max(int(reset_at - time.time()), 1)
+        logger.warning("Rate limit exceeded: %s %s key=%s budget=%s",
+                       request.method, request.url.path, key, budget)
+        return JSONResponse(
+            status_code=429,
+            content={"error": f"Rate limit exceeded: {budget}"},
+            headers={"Retry-After": str(retry_after)},
+        )
+    return await call_next(request)
@@ -0,0 +1,34 @@
+"""
+Read-your-writes для реплики (app/database.py, get_read_db).
+
+После успешного POST/PUT/PATCH/DELETE вызывающий (тот же ключ, что у rate
+limit: клуб/сканер, role:name, api_key, ip) ещё REPLICA_READ_YOUR_WRITES_SECONDS
+читает из primary — админка сразу видит скрытые/удалённые билеты, даже если
+реплика отстаёт.
+
+Отметка хранится в памяти воркера. Если чтение попало на другой воркер,
+защищает только порог отставания REPLICA_MAX_LAG_SECONDS — держать его
+меньше, чем между действием в админке и следующим её запросом.
+"""
+from fastapi import Request
+
+from app.cache import TTLCache
+from app.config import settings
+from app.database import get_replica_engine, on_primary
+from app.ratelimit import rate_limit_key
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+recent_writers = TTLCache("recent_writers", ttl=settings.REPLICA_READ_YOUR_WRITES_SECONDS, maxsize=10000)
+
+
+async def read_your_writes_middleware(request: Request, call_next):
+    if get_replica_engine() is None:
+        return await call_next(request)
+
+    key = rate_limit_key(request)
+    with on_primary(recent_writers.get(key, False)):
+        response = await call_next(request)
+    if request.method in WRITE_METHODS and response.status_code < 400:
+        recent_writers.set(key, True)
+    return response
@@ -0,0 +1,282 @@
+"""
+Аналитика выручки и промокодов.
+
+Суммы считаются в SQL одним проходом (GROUP BY GROUPING SETS по всем
+разрезам сразу), производные метрики — векторно через NumPy, если он
+установлен. Источник — tickets и (по умолчанию) tickets_archive: закрытое
+мероприятие не пропадает из выручки.
+
+Кэш — в памяти воркера, ключ — (версия, scope). Версия общая для всех
+воркеров и процессов: sequence revenue_cache_version, которую двигает
+транзакция, меняющая выручку (ORM-запись в tickets/tickets_archive — сама,
+raw SQL и скрипты — через bump_revenue_version()). Воркеры читают версию
+не чаще раза в VERSION_CHECK_SECONDS. Устаревание ограничено: запись,
+закоммиченная позже чтения версии, видна в других воркерах через
+VERSION_CHECK_SECONDS, в худшем случае (кэш заполнен между nextval и
+commit) — через TTL кэша.
+"""
+import logging
+from datetime import datetime
+from itertools import chain
+from typing import Optional
+
+from sqlalchemy import event, func, inspect, literal_column, select, text, union_all
+from sqlalchemy.orm import Session
+
+from app.cache import TTLCache
+from app.database import on_primary
+from app.models import ArchivedTicket, Ticket
+
+logger = logging.getLogger("impreza.security")
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy опционален
+    np = None
+
+DIMENSIONS = ("event", "club", "country", "ticket_type", "promocode")
+
+# Колонки билета, из которых считается выручка (одинаковы в tickets и tickets_archive)
+SOURCE_FIELDS = (
+    "event_name", "club_id", "country_code", "ticket_type", "promocode",
+    "quantity", "price", "subtotal", "discount", "payment_amount",
+)
+
+# Поля, от которых зависит выручка: запись в другие (scan_count, last_scan_at...)
+# не сбрасывает кэш — иначе он бы не жил во время сканирования на входе
+REVENUE_FIELDS = (
+    "price", "subtotal", "discount", "payment_amount", "promocode",
+    "event_name", "club_id", "country_code", "ticket_type", "quantity",
+)
+
+revenue_cache = TTLCache("revenue", ttl=300, maxsize=128)
+
+VERSION_CHECK_SECONDS = 2
+version_cache = TTLCache("revenue_version", ttl=VERSION_CHECK_SECONDS, maxsize=1)
+
+_BUMP_VERSION = text("SELECT nextval('revenue_cache_version')")
+_READ_VERSION = text("SELECT last_value FROM revenue_cache_version")
+
+
+def invalidate_revenue():
+    """Сброс кэша этого воркера (остальные узнают по версии)"""
+    revenue_cache.bump()
+    version_cache.bump()
+
+
+def bump_revenue_version(db) -> None:
+    """Для записи в tickets мимо ORM (text(), COPY, скрипты): вызвать в той же
+    транзакции. db — Session или Connection."""
+    db.execute(_BUMP_VERSION)
+    if isinstance(db, Session):
+        db.info["revenue_dirty"] = db.info["revenue_bumped"] = True
+
+
+def revenue_version(db: Session) -> Optional[int]:
+    """Текущая общая версия (кэш на VERSION_CHECK_SECONDS); None — sequence недоступна"""
+    def _read():
+        try:
+            with on_primary():
+                return db.execute(_READ_VERSION).scalar()
+        except Exception as e:
+            logger.warning("Revenue cache version unavailable: %s", e)
+            return None
+
+    return version_cache.get_or_set("version", _read)
+
+
+# ─── Инвалидация при записи в tickets ───
+# Слушатели на классе Session — для всех сессий: SessionLocal, реплики
+# (RoutingSession) и sync-фасада AsyncSession горячих эндпоинтов (вебхук Tilda)
+
+def _mark_dirty(session) -> None:
+    """Версия двигается один раз за транзакцию, на её же соединении"""
+    session.info["revenue_dirty"] = True
+    if not session.info.get("revenue_bumped"):
+        session.connection().execute(_BUMP_VERSION)
+        session.info["revenue_bumped"] = True
+
+
+def _touches_revenue(ticket: Ticket) -> bool:
+    state = inspect(ticket)
+    for field in REVENUE_FIELDS:
+        if state.attrs[field].history.has_changes():
+            return True
+    status = state.attrs.status.history
+    return "cancelled" in chain(status.added or (), status.deleted or ())
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_ticket_writes(session, flush_context):
+    if any(isinstance(obj, Ticket) for obj in chain(session.new, session.deleted)) or any(
+        isinstance(obj, Ticket) and _touches_revenue(obj) for obj in session.dirty
+    ):
+        _mark_dirty(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_bulk_ticket_writes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (Ticket, ArchivedTicket):
+            _mark_dirty(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    session.info.pop("revenue_bumped", None)
+    if session.info.pop("revenue_dirty", False):
+        invalidate_revenue()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("revenue_dirty", None)
+    session.info.pop("revenue_bumped", None)
+
+
+# ─── SQL ───
+
+def revenue_filters(model, club_id: Optional[int] = None, country_code: Optional[str] = None,
+                    event_name: Optional[str] = None, event_date: Optional[str] = None,
+                    start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    include_cancelled: bool = False) -> list:
+    """Фильтры выручки для Ticket или ArchivedTicket (дата покупки — created_at /
+    original_created_at)"""
+    created_at = model.original_created_at if model is ArchivedTicket else model.created_at
+    filters = []
+    if not include_cancelled:
+        filters.append(model.status != "cancelled")
+    if club_id:
+        filters.append(model.club_id == club_id)
+    if country_code:
+        filters.append(model.country_code == country_code)
+    if event_name:
+        filters.append(model.event_name == event_name)
+    if event_date:
+        filters.append(model.event_date.like(f"%{event_date}%"))
+    if start is not None:
+        filters.append(created_at >= start)
+    if end is not None:
+        filters.append(created_at < end)
+    return filters
+
+
+def _revenue_rows(db: Session, ticket_filters: list, archive_filters: Optional[list]) -> list:
+    """archive_filters=None — без tickets_archive"""
+    parts = [select(*[getattr(Ticket, f) for f in SOURCE_FIELDS]).where(*ticket_filters)]
+    if archive_filters is not None:
+        parts.append(select(*[getattr(ArchivedTicket, f) for f in SOURCE_FIELDS]).where(*archive_filters))
+    sold = (union_all(*parts) if len(parts) > 1 else parts[0]).subquery("sold")
+
+    # Пустой промокод считаем отсутствием промокода (литерал, а не
+    # bind-параметр — выражение в SELECT и GROUP BY должно совпадать)
+    dimensions = {
+        "event": sold.c.event_name,
+        "club": sold.c.club_id,
+        "country": sold.c.country_code,
+        "ticket_type": sold.c.ticket_type,
+        "promocode": func.nullif(sold.c.promocode, literal_column("''")),
+    }
+    gross = func.coalesce(func.nullif(sold.c.subtotal, 0), sold.c.price, 0)
+    columns = [col.label(name) for name, col in dimensions.items()]
+    grouping = [func.grouping(col).label(f"g_{name}") for name, col in dimensions.items()]
+
+    return db.execute(select(
+        *columns,
+        *grouping,
+        func.count().label("tickets"),
+        func.sum(func.coalesce(sold.c.quantity, 1)).label("persons"),
+        func.sum(gross).label("gross"),
+        func.sum(func.coalesce(sold.c.discount, 0)).label("discount"),
+        func.sum(func.coalesce(sold.c.payment_amount, 0)).label("revenue"),
+    ).group_by(
+        func.grouping_sets(*dimensions.values(), text("()"))
+    )).all()
+
+
+# ─── Производные метрики ───
+
+def _safe_ratio(num, den):
+    if np is not None:
+        num = np.asarray(num, dtype=float)
+        den = np.asarray(den, dtype=float)
+        out = np.zeros_like(num)
+        np.divide(num, den, out=out, where=den != 0)
+        return out.round(4).tolist()
+    return [round(n / d, 4) if d else 0.0 for n, d in zip(num, den)]
+
+
+def _breakdown(rows: list, total_revenue: float, baseline_avg: Optional[float] = None) -> list[dict]:
+    """Строки одного разреза → список словарей с производными метриками"""
+    tickets = [r["tickets"] for r in rows]
+    gross = [r["gross"] for r in rows]
+    discount = [r["discount"] for r in rows]
+    revenue = [r["revenue"] for r in rows]
+
+    discount_rate = _safe_ratio(discount, gross)
+    avg_price = _safe_ratio(revenue, tickets)
+    share = _safe_ratio(revenue, [total_revenue] * len(rows))
+
+    uplift = None
+    if baseline_avg:
+        # Средний чек с промокодом относительно среднего чека без промокода
+        uplift = _safe_ratio([a - baseline_avg for a in avg_price], [baseline_avg] * len(rows))
+
+    result = []
+    for i, row in enumerate(rows):
+        item = dict(row, discount_rate=discount_rate[i], avg_price=avg_price[i], revenue_share=share[i])
+        if uplift is not None:
+            item["uplift_vs_no_promo"] = uplift[i]
+        result.append(item)
+
+    result.sort(key=lambda item: item["revenue"], reverse=True)
+    return result
+
+
+def compute_revenue(db: Session, ticket_filters: list, archive_filters: Optional[list] = None) -> dict:
+    totals = None
+    groups = {name: [] for name in DIMENSIONS}
+
+    for row in _revenue_rows(db, ticket_filters, archive_filters):
+        metrics = {
+            "tickets": row.tickets,
+            "persons": int(row.persons or 0),
+            "gross": float(row.gross or 0),
+            "discount": float(row.discount or 0),
+            "revenue": float(row.revenue or 0),
+        }
+        active = [name for name in DIMENSIONS if getattr(row, f"g_{name}") == 0]
+        if not active:
+            totals = metrics
+            continue
+        name = active[0]
+        groups[name].append({"key": getattr(row, name), **metrics})
+
+    totals = totals or {"tickets": 0, "persons": 0, "gross": 0.0, "discount": 0.0, "revenue": 0.0}
+    total_revenue = totals["revenue"]
+
+    no_promo = next((g for g in groups["promocode"] if g["key"] is None), None)
+    baseline_avg = no_promo["revenue"] / no_promo["tickets"] if no_promo and no_promo["tickets"] else None
+
+    totals["discount_rate"] = _safe_ratio([totals["discount"]], [totals["gross"]])[0]
+    totals["avg_price"] = _safe_ratio([totals["revenue"]], [totals["tickets"]])[0]
+
+    return {
+        "totals": totals,
+        "by_event": _breakdown(groups["event"], total_revenue),
+        "by_club": _breakdown(groups["club"], total_revenue),
+        "by_country": _breakdown(groups["country"], total_revenue),
+        "by_ticket_type": _breakdown(groups["ticket_type"], total_revenue),
+        "by_promocode": _breakdown(groups["promocode"], total_revenue, baseline_avg),
+    }
+
+
+def get_revenue(db: Session, scope: tuple, ticket_filters: list, archive_filters: Optional[list] = None) -> dict:
+    """Кэшированная аналитика: scope — хешируемый ключ набора фильтров"""
+    def _compute():
+        # Данные отстающей реплики не должны попасть в кэш до следующего bump
+        with on_primary():
+            return compute_revenue(db, ticket_filters, archive_filters)
+
+    return revenue_cache.get_or_set((revenue_version(db), scope), _compute)
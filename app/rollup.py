@@ -0,0 +1,195 @@
+"""
+Rollup сканов: scan_rollup(club_id, event_name, bucket, scan_result) → count.
+
+Дашборды читают O(часов) строк вместо O(сканов):
+  - record_scan   — инкремент из log_scan (та же транзакция, что и INSERT скана)
+  - discount_scans — декремент перед массовым удалением scan_history
+  - rename_event_rollup — перенос бакетов при переименовании мероприятия
+  - rebuild_rollup — полный/поклубный пересчёт из scan_history (backfill)
+"""
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, literal, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models import ScanHistory, ScanRollup, Ticket
+
+
+def _grouped_scans(*filters):
+    """SELECT club/event/hour/result, count(*) FROM scan_history [LEFT JOIN tickets]"""
+    bucket = func.date_trunc("hour", ScanHistory.scan_time)
+    club = func.coalesce(ScanHistory.club_id, 0)
+    event = func.coalesce(Ticket.event_name, "")
+    return (
+        select(
+            club.label("club_id"),
+            event.label("event_name"),
+            bucket.label("bucket"),
+            ScanHistory.scan_result.label("scan_result"),
+            func.count().label("cnt"),
+        )
+        .select_from(ScanHistory)
+        .outerjoin(Ticket, Ticket.id == ScanHistory.ticket_id)
+        .where(ScanHistory.scan_result.isnot(None), *filters)
+        .group_by(club, event, bucket, ScanHistory.scan_result)
+    )
+
+
+def record_scan(db: Session, club_id: Optional[int], event_name: Optional[str], scan_result: str):
+    """+1 в бакет текущего часа. Не коммитит — вызывается до commit в log_scan.
+
+    now() в одной транзакции с INSERT скана → бакет совпадает с scan_time.
+    """
+    stmt = insert(ScanRollup).values(
+        club_id=club_id or 0,
+        event_name=event_name or "",
+        bucket=func.date_trunc("hour", func.localtimestamp()),
+        scan_result=scan_result,
+        count=1,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ScanRollup.club_id, ScanRollup.event_name, ScanRollup.bucket, ScanRollup.scan_result],
+        set_={"count": ScanRollup.count + 1},
+    )
+    db.execute(stmt)
+
+
+def discount_scans(db: Session, *filters) -> int:
+    """Вычитает из rollup сканы, которые сейчас будут удалены из scan_history.
+
+    filters — те же условия по ScanHistory, что и у последующего DELETE.
+    Вызывать ДО удаления (нужен join к tickets за event_name).
+    """
+    grouped = _grouped_scans(*filters).subquery()
+    result = db.execute(
+        update(ScanRollup)
+        .where(and_(
+            ScanRollup.club_id == grouped.c.club_id,
+            ScanRollup.event_name == grouped.c.event_name,
+            ScanRollup.bucket == grouped.c.bucket,
+            ScanRollup.scan_result == grouped.c.scan_result,
+        ))
+        .values(count=ScanRollup.count - grouped.c.cnt)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(delete(ScanRollup).where(ScanRollup.count <= 0).execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def rename_event_rollup(db: Session, old_name: str, new_name: str, club_ids: Optional[list] = None) -> int:
+    """Переносит бакеты old_name → new_name (club_ids — только эти клубы).
+    Не коммитит — вызывается в транзакции переименования билетов.
+
+    Если у new_name уже есть такой же бакет — счётчики складываются.
+    Возвращает количество перенесённых бакетов.
+    """
+    if old_name == new_name:
+        return 0
+    filters = [ScanRollup.event_name == old_name]
+    if club_ids is not None:
+        filters.append(ScanRollup.club_id.in_([club_id or 0 for club_id in club_ids]))
+
+    moved = select(
+        ScanRollup.club_id, literal(new_name), ScanRollup.bucket, ScanRollup.scan_result, ScanRollup.count,
+    ).where(*filters)
+    stmt = insert(ScanRollup).from_select(["club_id", "event_name", "bucket", "scan_result", "count"], moved)
+    result = db.execute(stmt.on_conflict_do_update(
+        index_elements=[ScanRollup.club_id, ScanRollup.event_name, ScanRollup.bucket, ScanRollup.scan_result],
+        set_={"count": ScanRollup.count + stmt.excluded.count},
+    ))
+    db.execute(delete(ScanRollup).where(*filters).execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def clear_rollup(db: Session, club_id: Optional[int] = None) -> int:
+    """Удаляет rollup целиком или для одного клуба (при удалении всей истории)"""
+    stmt = delete(ScanRollup)
+    if club_id is not None:
+        stmt = stmt.where(ScanRollup.club_id == club_id)
+    return db.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+
+def rebuild_rollup(db: Session, club_id: Optional[int] = None) -> int:
+    """Пересчитывает rollup из scan_history (backfill). Коммитит.
+
+    На время пересчёта scan_rollup блокируется (SHARE ROW EXCLUSIVE):
+    record_scan из log_scan ждёт commit, иначе его upsert между DELETE и
+    INSERT ... SELECT дал бы unique violation или двойной счёт текущего часа.
+    Скан, записанный во время пересчёта, прибавится после — его строки
+    scan_history пересчёт не видит. Для больших баз — поклубно (club_id).
+
+    Возвращает количество записанных бакетов.
+    """
+    db.execute(text("LOCK TABLE scan_rollup IN SHARE ROW EXCLUSIVE MODE"))
+    filters = []
+    if club_id is not None:
+        filters.append(func.coalesce(ScanHistory.club_id, 0) == club_id)
+
+    # Сырые сканы старше retention уже удалены вместе с партициями —
+    # их бакеты не трогаем, пересчитываем только покрытый данными период
+    first_scan = db.query(func.min(ScanHistory.scan_time)).filter(*filters).scalar()
+    stale = delete(ScanRollup).execution_options(synchronize_session=False)
+    if club_id is not None:
+        stale = stale.where(ScanRollup.club_id == club_id)
+    if first_scan is not None:
+        stale = stale.where(ScanRollup.bucket >= func.date_trunc("hour", first_scan))
+    db.execute(stale)
+
+    grouped = _grouped_scans(*filters)
+    result = db.execute(
+        insert(ScanRollup).from_select(
+            ["club_id", "event_name", "bucket", "scan_result", "count"],
+            grouped,
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def rollup_counts(db: Session, start: datetime, end: datetime, club_id: Optional[int] = None,
+                  event_name: Optional[str] = None) -> dict:
+    """Сумма по результатам за [start, end) — для /api/stats"""
+    query = db.query(ScanRollup.scan_result, func.sum(ScanRollup.count)).filter(
+        ScanRollup.bucket >= start,
+        ScanRollup.bucket < end,
+    )
+    if club_id:
+        query = query.filter(ScanRollup.club_id == club_id)
+    if event_name:
+        query = query.filter(ScanRollup.event_name == event_name)
+
+    return {result: int(total) for result, total in query.group_by(ScanRollup.scan_result).all()}
+
+
+def rollup_total(db: Session, results: tuple, club_id: Optional[int] = None) -> int:
+    """Сколько всего сканов с результатами results (за всё время, включая
+    сканы, уже ушедшие из scan_history по retention/архиву)"""
+    query = db.query(func.coalesce(func.sum(ScanRollup.count), 0)).filter(ScanRollup.scan_result.in_(results))
+    if club_id:
+        query = query.filter(ScanRollup.club_id == club_id)
+    return int(query.scalar())
+
+
+def rollup_series(db: Session, start: datetime, end: datetime, club_id: Optional[int] = None,
+                  event_name: Optional[str] = None, scan_result: Optional[str] = None) -> list[dict]:
+    """Почасовой ряд за [start, end), по бакету и результату"""
+    query = db.query(
+        ScanRollup.bucket,
+        ScanRollup.scan_result,
+        func.sum(ScanRollup.count).label("count"),
+    ).filter(ScanRollup.bucket >= start, ScanRollup.bucket < end)
+
+    if club_id:
+        query = query.filter(ScanRollup.club_id == club_id)
+    if event_name:
+        query = query.filter(ScanRollup.event_name == event_name)
+    if scan_result:
+        query = query.filter(ScanRollup.scan_result == scan_result)
+
+    rows = query.group_by(ScanRollup.bucket, ScanRollup.scan_result).order_by(ScanRollup.bucket).all()
+    return [
+        {"bucket": row.bucket.isoformat(), "scan_result": row.scan_result, "count": int(row.count)}
+        for row in rows
+    ]
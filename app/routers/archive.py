@@ -0,0 +1,147 @@
+"""
+Холодный архив истории сканов и удалённых билетов (app/archive.py).
+
+Запись — фоновыми задачами (прогресс: GET /api/history/jobs/{job_id}),
+чтение — по требованию из файлов сегментов.
+"""
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.archive import (
+    archive_partition, archive_range_job, query_archive, run_archive_job, segment_to_dict,
+)
+from app.batching import create_job
+from app.database import get_db
+from app.models import ArchiveSegment
+from app.partitions import detached_partitions
+from app.timerange import day_range, venue_today
+from app.dependencies.auth import require_role, AuthInfo
+
+router = APIRouter(prefix="/api/archive", tags=["archive"])
+
+
+def _parse_dates(start_date: Optional[str], end_date: Optional[str]) -> tuple[Optional[datetime], Optional[datetime]]:
+    """YYYY-MM-DD (включительно, по времени площадки) → [start, end) в времени БД"""
+    try:
+        start = day_range(datetime.strptime(start_date, "%Y-%m-%d").date())[0] if start_date else None
+        end = day_range(datetime.strptime(end_date, "%Y-%m-%d").date())[1] if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    return start, end
+
+
+def _accepted(job_id: str, **extra) -> dict:
+    return {"status": "accepted", "job_id": job_id, "progress_url": f"/api/history/jobs/{job_id}", **extra}
+
+
+@router.get("/segments")
+def list_segments(
+    table: Optional[str] = None,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super_observer")),
+):
+    """Манифест архива + отцеплённые партиции, ожидающие архивации"""
+    query = db.query(ArchiveSegment)
+    if table:
+        query = query.filter(ArchiveSegment.table_name == table)
+    segments = query.order_by(ArchiveSegment.start_at.desc()).all()
+    pending = detached_partitions(db.connection())
+    return {
+        "segments": [segment_to_dict(s) for s in segments],
+        "detached_partitions": [{**p, "month": p["month"].isoformat()} for p in pending],
+    }
+
+
+@router.get("/history")
+def get_archived_history(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    club_id: Optional[int] = None,
+    order_id: Optional[str] = None,
+    limit: int = Query(default=500, le=5000),
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super_observer")),
+):
+    """Сканы из архива (scan_history, выгруженная из PostgreSQL)"""
+    start, end = _parse_dates(start_date, end_date)
+    items = query_archive(db, "scan_history", start, end, club_id=club_id, order_id=order_id, limit=limit)
+    return {"items": items, "count": len(items)}
+
+
+@router.get("/deleted-tickets")
+def get_archived_deleted_tickets(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    order_id: Optional[str] = None,
+    limit: int = Query(default=500, le=5000),
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super_observer")),
+):
+    """Удалённые билеты из архива (по дате удаления)"""
+    start, end = _parse_dates(start_date, end_date)
+    items = query_archive(db, "deleted_tickets", start, end, order_id=order_id, limit=limit)
+    return {"items": items, "count": len(items)}
+
+
+@router.post("/history")
+def archive_history_range(
+    start_date: str,
+    end_date: str,
+    background_tasks: BackgroundTasks,
+    club_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Выгрузить в архив и удалить из БД сканы за [start_date, end_date] (только прошедшие дни)"""
+    start, end = _parse_dates(start_date, end_date)
+    if end > day_range(venue_today())[0]:
+        raise HTTPException(status_code=400, detail="Архивировать можно только прошедшие дни")
+
+    job_id = create_job(db, "archive_history")
+    background_tasks.add_task(
+        run_archive_job, job_id, archive_range_job, "scan_history", start, end,
+        club_id=club_id, created_by=auth.name,
+    )
+    return _accepted(job_id, start=start.isoformat(), end=end.isoformat(), club_id=club_id)
+
+
+@router.post("/partitions/{name}")
+def archive_history_partition(
+    name: str,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Архивировать месячную партицию scan_history_pYYYYMM целиком (DETACH → файл → DROP)"""
+    known = {p["name"] for p in detached_partitions(db.connection())}
+    if name not in known:
+        raise HTTPException(
+            status_code=400,
+            detail="Партиция должна быть отцеплена retention (HISTORY_RETENTION_MODE=detach)",
+        )
+    job_id = create_job(db, "archive_partition")
+    background_tasks.add_task(run_archive_job, job_id, archive_partition, name, created_by=auth.name)
+    return _accepted(job_id, partition=name)
+
+
+@router.post("/deleted-tickets")
+def archive_deleted_tickets(
+    before: str,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Выгрузить в архив и удалить из БД записи deleted_tickets, удалённые до before (YYYY-MM-DD)"""
+    end, _ = _parse_dates(before, None)
+    if end is None:
+        raise HTTPException(status_code=400, detail="before обязателен")
+
+    job_id = create_job(db, "archive_deleted_tickets")
+    background_tasks.add_task(
+        run_archive_job, job_id, archive_range_job, "deleted_tickets", datetime(1970, 1, 1), end,
+        created_by=auth.name,
+    )
+    return _accepted(job_id, before=end.isoformat())
@@ -6,9 +6,10 @@ import logging
 from datetime import datetime, timedelta, timezone
 
 import jwt
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy import text
+from sqlalchemy.orm import Session
 
 from app.config import settings
 from app.database import get_db
@@ -25,49 +26,43 @@ class LoginRequest(BaseModel):
     password_hash: str
 
 @router.post("/login")
-def login(credentials: LoginRequest):
+def login(credentials: LoginRequest, db: Session = Depends(get_db)):
     """Проверка логина/пароля клуба → возвращает JWT токен"""
-    db = next(get_db())
+    # Найти клуб (пароль — всегда по БД, не по справочнику клубов)
+    query = text("""
+        SELECT c.club_id, c.city_name, co.country_code, c.city_english
+        FROM clubs c
+        JOIN countries co ON c.country_id = co.country_id
+        WHERE c.login = :login 
+        AND c.password_hash = :password_hash 
+        AND c.is_active = TRUE
+    """)
     
-    try:
-        # Найти клуб
-        query = text("""
-            SELECT c.club_id, c.city_name, co.country_code, c.city_english
-            FROM clubs c
-            JOIN countries co ON c.country_id = co.country_id
-            WHERE c.login = :login 
-            AND c.password_hash = :password_hash 
-            AND c.is_active = TRUE
-        """)
-        
-        result = db.execute(query, {"login": credentials.login, "password_hash": credentials.password_hash})
-        club = result.fetchone()
-        
-        if not club:
-            logger.warning("Failed scanner login attempt: login=%s", credentials.login)
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        # Генерируем JWT токен для сканера
-        payload = {
-            "club_id": club[0],
-            "role": "scanner",
-            "name": club[1],
-            "city_english": club[3],
-            "allowed_countries": [club[2]],
-            "iat": datetime.now(timezone.utc),
-            "exp": datetime.now(timezone.utc) + timedelta(hours=SCANNER_TOKEN_HOURS),
-        }
-        token = jwt.encode(payload, settings.API_SECRET_KEY, algorithm=JWT_ALGORITHM)
-        
-        logger.info("Scanner login success: club_id=%s, city=%s", club[0], club[1])
-        
-        return {
-            "club_id": club[0],
-            "city_name": club[1],
-            "country_code": club[2],
-            "city_english": club[3],
-            "token": token,
-        }
+    result = db.execute(query, {"login": credentials.login, "password_hash": credentials.password_hash})
+    club = result.fetchone()
     
-    finally:
-        db.close()
+    if not club:
+        logger.warning("Failed scanner login attempt: login=%s", credentials.login)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Генерируем JWT токен для сканера
+    payload = {
+        "club_id": club[0],
+        "role": "scanner",
+        "name": club[1],
+        "city_english": club[3],
+        "allowed_countries": [club[2]],
+        "iat": datetime.now(timezone.utc),
+        "exp": datetime.now(timezone.utc) + timedelta(hours=SCANNER_TOKEN_HOURS),
+    }
+    token = jwt.encode(payload, settings.API_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    
+    logger.info("Scanner login success: club_id=%s, city=%s", club[0], club[1])
+    
+    return {
+        "club_id": club[0],
+        "city_name": club[1],
+        "country_code": club[2],
+        "city_english": club[3],
+        "token": token,
+    }
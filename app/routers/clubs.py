@@ -3,9 +3,11 @@ IMPREZA: Эндпоинт для получения списка всех клу
 """
 import logging
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from sqlalchemy import text
-from app.database import get_db
+from sqlalchemy.orm import Session
+from app.database import get_db, get_read_db
+from app.directory import get_directory, club_by_id, public_club, refresh_directory
 from app.dependencies.auth import require_auth, require_role, AuthInfo
 
 logger = logging.getLogger("impreza.security")
@@ -14,103 +16,43 @@ router = APIRouter(prefix="/clubs", tags=["clubs"])
 
 
 @router.get("/")
-def get_all_clubs(auth: AuthInfo = Depends(require_auth)):
-    """Получить список всех клубов для админ панели.
-    plain_password возвращается только для super admin."""
-    db = next(get_db())
+def get_all_clubs(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    auth: AuthInfo = Depends(require_auth),
+):
+    """Получить список всех клубов для админ панели (из справочника в памяти).
+    plain_password возвращается только для super admin.
+    ETag меняется при любом изменении клубов — на If-None-Match отвечаем 304."""
     is_super = auth.role == "super"
+    directory = get_directory(db)
+    etag = directory["etag_super"] if is_super else directory["etag_public"]
     
-    try:
-        if is_super:
-            query = text("""
-                SELECT 
-                    c.club_id as id,
-                    c.city_name,
-                    c.city_english,
-                    co.country_code,
-                    c.login,
-                    c.is_active,
-                    c.plain_password
-                FROM clubs c
-                JOIN countries co ON c.country_id = co.country_id
-                ORDER BY co.country_code, c.city_name
-            """)
-        else:
-            query = text("""
-                SELECT 
-                    c.club_id as id,
-                    c.city_name,
-                    c.city_english,
-                    co.country_code,
-                    c.login,
-                    c.is_active
-                FROM clubs c
-                JOIN countries co ON c.country_id = co.country_id
-                ORDER BY co.country_code, c.city_name
-            """)
-        
-        result = db.execute(query)
-        clubs = []
-        
-        for row in result:
-            club = {
-                "id": row[0],
-                "city_name": row[1],
-                "city_english": row[2],
-                "country_code": row[3],
-                "login": row[4],
-                "is_active": row[5],
-            }
-            if is_super and len(row) > 6:
-                club["plain_password"] = row[6]
-            clubs.append(club)
-        
-        return {"clubs": clubs}
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
     
-    finally:
-        db.close()
+    response.headers.update(headers)
+    return {"clubs": [public_club(club, with_password=is_super) for club in directory["clubs"]]}
 
 
 @router.get("/{club_id}")
-def get_club_by_id(club_id: int, auth: AuthInfo = Depends(require_auth)):
+def get_club_by_id(club_id: int, db: Session = Depends(get_read_db), auth: AuthInfo = Depends(require_auth)):
     """Получить информацию о конкретном клубе по ID. Пароли НЕ возвращаются."""
-    db = next(get_db())
-    
-    try:
-        query = text("""
-            SELECT 
-                c.club_id as id,
-                c.city_name,
-                c.city_english,
-                co.country_code,
-                c.login,
-                c.is_active
-            FROM clubs c
-            JOIN countries co ON c.country_id = co.country_id
-            WHERE c.club_id = :club_id
-        """)
-        
-        result = db.execute(query, {"club_id": club_id})
-        row = result.fetchone()
-        
-        if not row:
-            raise HTTPException(status_code=404, detail="Club not found")
-        
-        return {
-            "id": row[0],
-            "city_name": row[1], 
-            "city_english": row[2],
-            "country_code": row[3],
-            "login": row[4],
-            "is_active": row[5],
-        }
-    
-    finally:
-        db.close()
+    club = club_by_id(club_id, db)
+    if not club:
+        raise HTTPException(status_code=404, detail="Club not found")
+    return public_club(club)
 
 
 @router.put("/{club_id}/password")
-def update_club_password(club_id: int, data: dict, auth: AuthInfo = Depends(require_role("super"))):
+def update_club_password(
+    club_id: int,
+    data: dict,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
     """Обновить пароль клуба (только для super admin).
     Принимает:
       - {new_password: "..."} — хеш считается на сервере (веб-панель)
@@ -118,7 +60,6 @@ def update_club_password(club_id: int, data: dict, auth: AuthInfo = Depends(requ
     """
     import hashlib
     logger.info("Club %s password updated by %s", club_id, auth.name)
-    db = next(get_db())
     
     try:
         new_password = data.get("new_password")
@@ -147,6 +88,8 @@ def update_club_password(club_id: int, data: dict, auth: AuthInfo = Depends(requ
             "club_id": club_id
         })
         db.commit()
+        # plain_password и ETag списка клубов изменились
+        refresh_directory(db)
         
         return {"success": True, "message": "Password updated"}
     
@@ -155,6 +98,3 @@ def update_club_password(club_id: int, data: dict, auth: AuthInfo = Depends(requ
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error")
-    
-    finally:
-        db.close()
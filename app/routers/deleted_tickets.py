@@ -1,18 +1,24 @@
 """
 API для работы с удалёнными билетами (архив)
 """
+import logging
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from typing import Optional, List
 from datetime import datetime
+from pydantic import BaseModel
 
-from app.database import get_db
-from app.models import Ticket, DeletedTicket, ScanHistory
+from app.database import get_db, get_read_db
+from app.models import Ticket, DeletedTicket, ScanHistory, ArchivedTicket
 from app.dependencies.auth import require_auth, require_role, AuthInfo
+from app.sync import db_now, sync_filter, next_watermark
+from app.ticket_archive import archived_to_dict, restore_to_tickets
+from app.timerange import day_range
 
 router = APIRouter(prefix="/api/deleted-tickets", tags=["deleted-tickets"])
+logger = logging.getLogger("impreza.security")
 
 
 @router.get("")
@@ -20,13 +26,20 @@ def get_deleted_tickets(
     city_name: Optional[str] = None,
     event_name: Optional[str] = None,
     search: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+    after_id: Optional[int] = None,
     limit: int = Query(default=500, le=2000),
     offset: int = 0,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     auth: AuthInfo = Depends(require_role("super_observer")),
 ):
-    """Получить список удалённых билетов"""
+    """Получить список удалённых билетов
+
+    SYNC: если передан updated_since — только записи, попавшие в архив после watermark.
+    Пока has_more — следующая страница с after_id=watermark_id (app/sync.py).
+    """
     try:
+        started_at = db_now(db) if updated_since else None
         query = db.query(DeletedTicket)
         
         # Фильтры
@@ -46,7 +59,16 @@ def get_deleted_tickets(
         
         # Сортировка по дате удаления (новые первые)
         total = query.count()
-        tickets = query.order_by(desc(DeletedTicket.deleted_at)).offset(offset).limit(limit).all()
+        watermark, watermark_id, has_more = None, None, None
+        if updated_since:
+            tickets = query.filter(
+                sync_filter(DeletedTicket.deleted_at, DeletedTicket.id, updated_since, after_id)
+            ).order_by(
+                DeletedTicket.deleted_at, DeletedTicket.id
+            ).limit(limit).all()
+            watermark, watermark_id, has_more = next_watermark(tickets, limit, "deleted_at", started_at)
+        else:
+            tickets = query.order_by(desc(DeletedTicket.deleted_at)).offset(offset).limit(limit).all()
         
         result = []
         for t in tickets:
@@ -72,18 +94,89 @@ def get_deleted_tickets(
                 "original_created_at": str(t.original_created_at) if t.original_created_at else None,
             })
         
-        return {
+        response = {
             "tickets": result,
             "total": total,
             "limit": limit,
             "offset": offset
         }
+        if updated_since:
+            response["watermark"] = watermark.isoformat() if watermark else None
+            response["watermark_id"] = watermark_id
+            response["has_more"] = has_more
+        return response
         
     except Exception as e:
         print(f"❌ Ошибка получения удалённых билетов: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class RestoreRequest(BaseModel):
+    """Пакетное восстановление: ids ИЛИ фильтры (комбинируются через AND)"""
+    ids: Optional[List[int]] = None
+    event_name: Optional[str] = None
+    city_name: Optional[str] = None
+    deleted_by: Optional[str] = None
+    deleted_from: Optional[str] = None  # YYYY-MM-DD, включительно
+    deleted_to: Optional[str] = None    # YYYY-MM-DD, включительно
+
+
+def _restore_filters(request: RestoreRequest) -> list:
+    filters = []
+    if request.ids:
+        filters.append(DeletedTicket.id.in_(request.ids))
+    if request.event_name:
+        filters.append(DeletedTicket.event_name == request.event_name)
+    if request.city_name:
+        filters.append(DeletedTicket.city_name == request.city_name)
+    if request.deleted_by:
+        filters.append(DeletedTicket.deleted_by == request.deleted_by)
+    try:
+        if request.deleted_from:
+            filters.append(DeletedTicket.deleted_at >= day_range(datetime.strptime(request.deleted_from, "%Y-%m-%d").date())[0])
+        if request.deleted_to:
+            filters.append(DeletedTicket.deleted_at < day_range(datetime.strptime(request.deleted_to, "%Y-%m-%d").date())[1])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    return filters
+
+
+@router.post("/restore")
+def restore_tickets(
+    request: RestoreRequest,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Восстановить набор билетов из архива одной транзакцией
+
+    INSERT INTO tickets ... SELECT ... ON CONFLICT DO NOTHING + DELETE ... RETURNING.
+    Билеты, которые не удалось вернуть (order_id или qr_token уже заняты,
+    более старая копия того же заказа), перечислены в conflicts.
+    """
+    filters = _restore_filters(request)
+    if not filters:
+        raise HTTPException(status_code=400, detail="Укажите ids или хотя бы один фильтр")
+    
+    try:
+        restored, conflicts = restore_to_tickets(db, DeletedTicket, filters)
+        db.commit()
+        
+        logger.info("Batch restore by %s: %s restored, %s conflicts", auth.name, len(restored), len(conflicts))
+        print(f"✅ Восстановлено {len(restored)} билетов, конфликтов: {len(conflicts)}")
+        
+        return {
+            "restored_count": len(restored),
+            "conflict_count": len(conflicts),
+            "restored": restored,
+            "conflicts": conflicts
+        }
+        
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка пакетного восстановления: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/{deleted_ticket_id}/restore")
 def restore_ticket(
     deleted_ticket_id: int,
@@ -92,64 +185,28 @@ def restore_ticket(
 ):
     """Восстановить билет из архива в основную таблицу"""
     try:
-        # Находим удалённый билет
-        deleted = db.query(DeletedTicket).filter(DeletedTicket.id == deleted_ticket_id).first()
-        
-        if not deleted:
+        if not db.query(DeletedTicket.id).filter(DeletedTicket.id == deleted_ticket_id).first():
             raise HTTPException(status_code=404, detail=f"Удалённый билет #{deleted_ticket_id} не найден")
         
-        # Проверяем, нет ли уже билета с таким order_id
-        existing = db.query(Ticket).filter(Ticket.order_id == deleted.order_id).first()
-        if existing:
+        restored, conflicts = restore_to_tickets(db, DeletedTicket, [DeletedTicket.id == deleted_ticket_id])
+        
+        if conflicts:
+            db.rollback()
+            conflict = conflicts[0]
             raise HTTPException(
                 status_code=400, 
-                detail=f"Билет с order_id={deleted.order_id} уже существует (id={existing.id})"
+                detail=f"Билет с order_id={conflict['order_id']} уже существует (id={conflict['existing_ticket_id']})"
             )
         
-        # Создаём новый билет в основной таблице
-        restored_ticket = Ticket(
-            order_id=deleted.order_id,
-            transaction_id=deleted.transaction_id,
-            customer_name=deleted.customer_name,
-            customer_email=deleted.customer_email,
-            customer_phone=deleted.customer_phone,
-            ticket_type=deleted.ticket_type,
-            event_date=deleted.event_date,
-            event_name=deleted.event_name,
-            price=deleted.price,
-            subtotal=deleted.subtotal,
-            discount=deleted.discount,
-            payment_amount=deleted.payment_amount,
-            promocode=deleted.promocode,
-            qr_token=deleted.qr_token,
-            qr_signature=deleted.qr_signature,
-            country_code=deleted.country_code,
-            city_name=deleted.city_name,
-            club_id=deleted.club_id,
-            visible_to_managers=deleted.visible_to_managers,
-            quantity=deleted.quantity,
-            status=deleted.status,
-            scan_count=deleted.scan_count,
-            first_scan_at=deleted.first_scan_at,
-            last_scan_at=deleted.last_scan_at,
-            scanned_by=deleted.scanned_by,
-            telegram_message_id=deleted.telegram_message_id,
-        )
-        
-        db.add(restored_ticket)
-        
-        # Удаляем из архива
-        db.delete(deleted)
-        
         db.commit()
-        db.refresh(restored_ticket)
+        restored_ticket = restored[0]
         
-        print(f"✅ Билет #{deleted_ticket_id} восстановлен как #{restored_ticket.id}")
+        print(f"✅ Билет #{deleted_ticket_id} восстановлен как #{restored_ticket['ticket_id']}")
         
         return {
             "message": f"Билет восстановлен",
-            "restored_ticket_id": restored_ticket.id,
-            "order_id": restored_ticket.order_id
+            "restored_ticket_id": restored_ticket["ticket_id"],
+            "order_id": restored_ticket["order_id"]
         }
         
     except HTTPException:
@@ -190,7 +247,7 @@ def permanently_delete(
 
 
 @router.get("/stats")
-def get_deleted_stats(db: Session = Depends(get_db), auth: AuthInfo = Depends(require_role("super_observer"))):
+def get_deleted_stats(db: Session = Depends(get_read_db), auth: AuthInfo = Depends(require_role("super_observer"))):
     """Статистика удалённых билетов"""
     try:
         total = db.query(DeletedTicket).count()
@@ -225,9 +282,10 @@ def get_all_tickets_with_deleted(
     event_name: Optional[str] = None,
     search: Optional[str] = None,
     filter_mode: str = Query(default="all", description="all | deleted | active"),
+    include_archived: bool = False,
     limit: int = Query(default=10000, le=50000),
     offset: int = 0,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     auth: AuthInfo = Depends(require_role("super_observer")),
 ):
     """Получить ВСЕ билеты (активные + удалённые) для Super Observer
@@ -236,6 +294,7 @@ def get_all_tickets_with_deleted(
     - all: все билеты (активные + удалённые)
     - deleted: только удалённые
     - active: только активные
+    include_archived — к активным добавить билеты закрытых мероприятий (_is_archived)
     """
     try:
         result = []
@@ -335,12 +394,42 @@ def get_all_tickets_with_deleted(
                     "_original_id": t.original_id
                 })
         
+        # ===== ЗАКРЫТЫЕ МЕРОПРИЯТИЯ (tickets_archive) =====
+        if include_archived and filter_mode in ("all", "active"):
+            query = db.query(ArchivedTicket)
+            
+            if city_name:
+                query = query.filter(ArchivedTicket.city_name == city_name)
+            if event_name:
+                query = query.filter(ArchivedTicket.event_name == event_name)
+            if search:
+                search_pattern = f"%{search}%"
+                query = query.filter(
+                    (ArchivedTicket.customer_name.ilike(search_pattern)) |
+                    (ArchivedTicket.customer_email.ilike(search_pattern)) |
+                    (ArchivedTicket.order_id.ilike(search_pattern))
+                )
+            
+            for t in query.all():
+                item = archived_to_dict(t)
+                for key in ("first_scan_at", "created_at"):
+                    item[key] = str(item[key]) if item[key] else None
+                item.update({
+                    "_is_deleted": False,
+                    "_is_archived": True,
+                    "_archived_at": str(t.archived_at) if t.archived_at else None,
+                    "_deleted_at": None,
+                    "_deleted_by": None
+                })
+                result.append(item)
+        
         # Сортировка по дате создания (новые первые)
         result.sort(key=lambda x: x.get("created_at") or "", reverse=True)
         
         total = len(result)
         active_count = sum(1 for r in result if not r.get("_is_deleted"))
         deleted_count = sum(1 for r in result if r.get("_is_deleted"))
+        archived_count = sum(1 for r in result if r.get("_is_archived"))
         
         # Применяем offset/limit
         result = result[offset:offset+limit]
@@ -350,6 +439,7 @@ def get_all_tickets_with_deleted(
             "total": total,
             "active_count": active_count,
             "deleted_count": deleted_count,
+            "archived_count": archived_count,
             "filter_mode": filter_mode,
             "limit": limit,
             "offset": offset
@@ -1,57 +1,131 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from datetime import datetime
+from sqlalchemy import desc, func
+from datetime import datetime, timedelta
+from typing import Optional
 from pydantic import BaseModel
 
-from app.database import get_db
-from app.models import Ticket, ScanHistory
+from app.database import get_db, get_read_db
+from app.models import Ticket, ScanHistory, BatchJob
 from app.schemas import HistoryResponse, HistoryItem
-from app.dependencies.auth import require_auth, require_role, AuthInfo
+from app.aggregates import ticket_counts
+from app.batching import create_job, job_accepted, job_to_dict
+from app.dependencies.auth import require_auth, require_role, AuthInfo, ROLE_HIERARCHY
+from app.rollup import clear_rollup
+from app.visibility import TARGET_HISTORY, history_visible, add_rule, unhide, invalidate_rules, compact_job
 
 router = APIRouter(prefix="/api/history", tags=["history"])
 
+# Колонки для выдачи истории — без загрузки целых строк tickets
+_HISTORY_COLUMNS = (
+    Ticket.id,
+    Ticket.order_id,
+    Ticket.customer_name,
+    Ticket.ticket_type,
+    Ticket.event_date,
+    Ticket.price,
+)
+
+
+def _display_status(status: str, scan_count: int) -> str:
+    if status == "used" and scan_count == 1:
+        return "entered"
+    elif status == "used" and scan_count > 1:
+        return "duplicate"
+    elif status == "cancelled":
+        return "cancelled"
+    return "pending"
+
+
 @router.get("/", response_model=HistoryResponse)
-def get_history(event_date: str = None, limit: int = 100, db: Session = Depends(get_db), auth: AuthInfo = Depends(require_auth)):
-    query = db.query(Ticket)
+def get_history(
+    event_date: str = None,
+    club_id: Optional[int] = None,
+    mode: str = Query(default="tickets", description="tickets | scans"),
+    limit: int = 100,
+    db: Session = Depends(get_read_db),
+    auth: AuthInfo = Depends(require_auth),
+):
+    """История для сканера.
+
+    mode=tickets — билеты, отсортированные по первому скану
+                   (индекс ix_tickets_club_history: club_id, first_scan_at DESC NULLS LAST, created_at DESC).
+    mode=scans   — реальные события входа из scan_history (scan_result = 'valid').
+    """
+    if mode not in ("tickets", "scans"):
+        raise HTTPException(status_code=400, detail="mode must be 'tickets' or 'scans'")
     
+    filters = []
+    if club_id:
+        filters.append(Ticket.club_id == club_id)
     if event_date:
-        query = query.filter(Ticket.event_date.like(f"%{event_date}%"))
+        filters.append(Ticket.event_date.like(f"%{event_date}%"))
     
-    tickets = query.order_by(
-        desc(Ticket.first_scan_at.isnot(None)),
-        desc(Ticket.first_scan_at),
-        desc(Ticket.created_at)
-    ).limit(limit).all()
-    
-    items = []
-    for t in tickets:
-        if t.status == "used" and t.scan_count == 1:
-            display_status = "entered"
-        elif t.status == "used" and t.scan_count > 1:
-            display_status = "duplicate"
-        elif t.status == "cancelled":
-            display_status = "cancelled"
-        else:
-            display_status = "pending"
+    if mode == "scans":
+        scan_query = db.query(
+            *_HISTORY_COLUMNS,
+            ScanHistory.scan_time,
+        ).join(Ticket, Ticket.id == ScanHistory.ticket_id).filter(
+            ScanHistory.scan_result == "valid",
+            *filters
+        )
+        if club_id:
+            scan_query = scan_query.filter(ScanHistory.club_id == club_id)
+        if auth.role_level < ROLE_HIERARCHY["super"]:
+            scan_query = scan_query.filter(history_visible(db))
         
-        items.append(HistoryItem(
-            id=t.id,
-            order_id=t.order_id,
-            customer_name=t.customer_name,
-            ticket_type=t.ticket_type,
-            event_date=t.event_date,
-            status=display_status,
-            scan_time=t.first_scan_at,
-            price=t.price
-        ))
+        rows = scan_query.order_by(desc(ScanHistory.scan_time)).limit(limit).all()
+        items = [
+            HistoryItem(
+                id=row.id,
+                order_id=row.order_id,
+                customer_name=row.customer_name,
+                ticket_type=row.ticket_type,
+                event_date=row.event_date,
+                status="entered",
+                scan_time=row.scan_time,
+                price=row.price
+            )
+            for row in rows
+        ]
+    else:
+        rows = db.query(
+            *_HISTORY_COLUMNS,
+            Ticket.status,
+            Ticket.scan_count,
+            Ticket.first_scan_at,
+        ).filter(*filters).order_by(
+            Ticket.first_scan_at.desc().nulls_last(),
+            desc(Ticket.created_at)
+        ).limit(limit).all()
+        items = [
+            HistoryItem(
+                id=row.id,
+                order_id=row.order_id,
+                customer_name=row.customer_name,
+                ticket_type=row.ticket_type,
+                event_date=row.event_date,
+                status=_display_status(row.status, row.scan_count),
+                scan_time=row.first_scan_at,
+                price=row.price
+            )
+            for row in rows
+        ]
     
-    total = query.count()
-    entered = query.filter(Ticket.status == "used").count()
+    # Один агрегат вместо count() + count(status='used')
+    counts = ticket_counts(db, base_filters=filters)
+    total = counts["total"]
+    entered = counts["entered"]
     
     return HistoryResponse(
         items=items,
-        stats={"bought": total, "entered": entered, "pending": total - entered}
+        stats={
+            "bought": total,
+            "entered": entered,
+            "pending": total - entered,
+            "total_persons": counts["total_persons"],
+            "entered_persons": counts["entered_persons"]
+        }
     )
 
 @router.delete("/")
@@ -65,6 +139,7 @@ def delete_history(club_id: int, db: Session = Depends(get_db), auth: AuthInfo =
         deleted_scans = db.query(ScanHistory).filter(
             ScanHistory.club_id == club_id
         ).delete(synchronize_session=False)
+        clear_rollup(db, club_id)
         
         # Сбрасываем статусы билетов этого клуба обратно в valid
         updated_tickets = db.query(Ticket).filter(
@@ -74,7 +149,8 @@ def delete_history(club_id: int, db: Session = Depends(get_db), auth: AuthInfo =
             "status": "valid",
             "scan_count": 0,
             "first_scan_at": None,
-            "last_scan_at": None
+            "last_scan_at": None,
+            "updated_at": func.now()
         }, synchronize_session=False)
         
         db.commit()
@@ -95,33 +171,68 @@ class HideDateRange(BaseModel):
     start_date: str  # YYYY-MM-DD
     end_date: str    # YYYY-MM-DD
 
+
+def _parse_day_range(start_date: str, end_date: str) -> tuple[datetime, datetime]:
+    """YYYY-MM-DD..YYYY-MM-DD (включительно) → полуоткрытый [start, end)"""
+    try:
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+        end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    return start_dt, end_dt + timedelta(days=1)
+
+
+def _hide(db: Session, auth: AuthInfo, **scope) -> int:
+    """Правило hide вместо UPDATE строк — одна вставка, без подсчёта по scan_history.
+    Возвращает id правила."""
+    rule = add_rule(db, TARGET_HISTORY, "hide", created_by=auth.name, **scope)
+    db.commit()
+    invalidate_rules()
+    return rule.id
+
+
+def _restore(db: Session, auth: AuthInfo, **scope) -> int:
+    """Правило show (перекрывает и правила, и флаги строк). Возвращает id правила."""
+    rule = unhide(db, TARGET_HISTORY, created_by=auth.name, **scope)
+    db.commit()
+    invalidate_rules()
+    return rule.id
+
+
+def _apply_in_background(db: Session, background: bool, background_tasks: BackgroundTasks) -> Optional[str]:
+    """background=true — сразу записать правила во флаги строк фоновой задачей:
+    UPDATE пакетами по id-диапазонам (app/batching.py), число изменённых строк
+    из RETURNING копится в processed. Возвращает job_id или None."""
+    if not background:
+        return None
+    job_id = create_job(db, f"compact_{TARGET_HISTORY}")
+    background_tasks.add_task(compact_job, job_id, TARGET_HISTORY)
+    return job_id
+
+
 @router.post("/hide-for-managers")
 def hide_for_all_managers(
     date_range: HideDateRange,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("super")),
 ):
-    """Скрывает записи от ВСЕХ менеджеров в выбранном диапазоне дат"""
-    try:
-        start_dt = datetime.strptime(date_range.start_date, "%Y-%m-%d").date()
-        end_dt = datetime.strptime(date_range.end_date, "%Y-%m-%d").date()
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-    
-    # Обновляем записи в диапазоне дат
-    query = db.query(ScanHistory).filter(
-        ScanHistory.scan_time >= start_dt,
-        ScanHistory.scan_time <= datetime.combine(end_dt, datetime.max.time()),
-        ScanHistory.hidden_for_manager == False
-    )
+    """Скрывает записи от ВСЕХ менеджеров в выбранном диапазоне дат
     
-    count = query.count()
-    query.update({"hidden_for_manager": True})
-    db.commit()
+    Одна вставка в visibility_rules — мгновенно при любом объёме истории.
+    background=true — дополнительно записать правила во флаги строк фоновой
+    задачей (так же у всех hide/restore), прогресс и число изменённых строк:
+    GET /api/history/jobs/{job_id}
+    """
+    start_dt, end_dt = _parse_day_range(date_range.start_date, date_range.end_date)
+    rule_id = _hide(db, auth, start_at=start_dt, end_at=end_dt)
+    job_id = _apply_in_background(db, background, background_tasks)
     
     return {
         "status": "hidden",
-        "hidden": count,
+        "rule_id": rule_id,
+        **(job_accepted(job_id) if job_id else {}),
         "start_date": date_range.start_date,
         "end_date": date_range.end_date,
         "scope": "all_managers"
@@ -131,31 +242,20 @@ def hide_for_all_managers(
 def hide_for_city_manager(
     club_id: int,
     date_range: HideDateRange,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("manager")),
 ):
     """Скрывает записи от менеджера конкретного города в выбранном диапазоне дат"""
-    try:
-        start_dt = datetime.strptime(date_range.start_date, "%Y-%m-%d").date()
-        end_dt = datetime.strptime(date_range.end_date, "%Y-%m-%d").date()
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-    
-    # Обновляем записи для конкретного города в диапазоне дат
-    query = db.query(ScanHistory).filter(
-        ScanHistory.club_id == club_id,
-        ScanHistory.scan_time >= start_dt,
-        ScanHistory.scan_time <= datetime.combine(end_dt, datetime.max.time()),
-        ScanHistory.hidden_for_manager == False
-    )
-    
-    count = query.count()
-    query.update({"hidden_for_manager": True})
-    db.commit()
+    start_dt, end_dt = _parse_day_range(date_range.start_date, date_range.end_date)
+    rule_id = _hide(db, auth, club_id=club_id, start_at=start_dt, end_at=end_dt)
+    job_id = _apply_in_background(db, background, background_tasks)
     
     return {
         "status": "hidden",
-        "hidden": count,
+        "rule_id": rule_id,
+        **(job_accepted(job_id) if job_id else {}),
         "club_id": club_id,
         "start_date": date_range.start_date,
         "end_date": date_range.end_date,
@@ -167,28 +267,19 @@ def hide_for_city_manager(
 
 @router.post("/restore-hidden")
 def restore_all_hidden(
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("super")),
 ):
     """Восстанавливает ВСЕ скрытые записи (делает видимыми для менеджеров)"""
-    query = db.query(ScanHistory).filter(
-        ScanHistory.hidden_for_manager == True
-    )
-    
-    count = query.count()
-    if count == 0:
-        return {
-            "status": "no_changes",
-            "restored": 0,
-            "message": "Нет скрытых записей для восстановления"
-        }
-    
-    query.update({"hidden_for_manager": False})
-    db.commit()
+    rule_id = _restore(db, auth)
+    job_id = _apply_in_background(db, background, background_tasks)
     
     return {
         "status": "restored",
-        "restored": count,
+        "rule_id": rule_id,
+        **(job_accepted(job_id) if job_id else {}),
         "scope": "all"
     }
 
@@ -196,30 +287,19 @@ def restore_all_hidden(
 @router.post("/restore-hidden/{club_id}")
 def restore_hidden_by_city(
     club_id: int,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("manager")),
 ):
     """Восстанавливает скрытые записи для конкретного города"""
-    query = db.query(ScanHistory).filter(
-        ScanHistory.club_id == club_id,
-        ScanHistory.hidden_for_manager == True
-    )
-    
-    count = query.count()
-    if count == 0:
-        return {
-            "status": "no_changes",
-            "restored": 0,
-            "club_id": club_id,
-            "message": f"Нет скрытых записей для club_id={club_id}"
-        }
-    
-    query.update({"hidden_for_manager": False})
-    db.commit()
+    rule_id = _restore(db, auth, club_id=club_id)
+    job_id = _apply_in_background(db, background, background_tasks)
     
     return {
         "status": "restored",
-        "restored": count,
+        "rule_id": rule_id,
+        **(job_accepted(job_id) if job_id else {}),
         "club_id": club_id,
         "scope": "city"
     }
@@ -234,49 +314,43 @@ class RestoreDateRange(BaseModel):
 @router.post("/restore-hidden-filtered")
 def restore_hidden_filtered(
     filters: RestoreDateRange,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("manager")),
 ):
     """Восстанавливает скрытые записи с фильтрами по дате и городу"""
-    query = db.query(ScanHistory).filter(
-        ScanHistory.hidden_for_manager == True
-    )
-    
-    # Применяем фильтры
-    if filters.club_id:
-        query = query.filter(ScanHistory.club_id == filters.club_id)
+    start_dt = end_dt = None
     
-    if filters.start_date:
-        try:
-            start_dt = datetime.strptime(filters.start_date, "%Y-%m-%d").date()
-            query = query.filter(ScanHistory.scan_time >= start_dt)
-        except ValueError:
-            pass
+    # Диапазон — только с обеими границами; неверная дата — ошибка, а не "без фильтра"
+    if filters.start_date or filters.end_date:
+        if not (filters.start_date and filters.end_date):
+            raise HTTPException(status_code=400, detail="Укажите обе даты: start_date и end_date")
+        start_dt, end_dt = _parse_day_range(filters.start_date, filters.end_date)
     
-    if filters.end_date:
-        try:
-            end_dt = datetime.strptime(filters.end_date, "%Y-%m-%d").date()
-            query = query.filter(ScanHistory.scan_time <= datetime.combine(end_dt, datetime.max.time()))
-        except ValueError:
-            pass
-    
-    count = query.count()
-    if count == 0:
-        return {
-            "status": "no_changes",
-            "restored": 0,
-            "message": "Нет скрытых записей с указанными фильтрами"
-        }
-    
-    query.update({"hidden_for_manager": False})
-    db.commit()
+    rule_id = _restore(db, auth, club_id=filters.club_id, start_at=start_dt, end_at=end_dt)
+    job_id = _apply_in_background(db, background, background_tasks)
     
     return {
         "status": "restored",
-        "restored": count,
+        "rule_id": rule_id,
+        **(job_accepted(job_id) if job_id else {}),
         "filters": {
             "club_id": filters.club_id,
             "start_date": filters.start_date,
             "end_date": filters.end_date
         }
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/jobs/{job_id}")
+def get_history_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("manager")),
+):
+    """Прогресс фоновой операции скрытия/восстановления истории"""
+    job = db.query(BatchJob).filter(BatchJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_to_dict(job)
@@ -0,0 +1,22 @@
+"""
+Prometheus scrape endpoint (app/metrics.py).
+
+Если задан METRICS_TOKEN — нужен заголовок Authorization: Bearer <METRICS_TOKEN>.
+"""
+import hmac
+
+from fastapi import APIRouter, HTTPException, Request, Response
+
+from app.config import settings
+from app.metrics import CONTENT_TYPE, render
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics(request: Request):
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=render(), media_type=CONTENT_TYPE)
@@ -1,53 +1,139 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from datetime import date
+from datetime import datetime
+from typing import Optional
 
-from app.database import get_db
-from app.models import Ticket, ScanHistory
+from app.database import get_read_db, pool_status
+from app.models import Ticket, ArchivedTicket
 from app.schemas import StatsResponse
-from app.dependencies.auth import require_auth, AuthInfo
+from app.aggregates import ticket_counts, merge_counts
+from app.rollup import rollup_counts, rollup_series
+from app.timerange import day_range
+from app.revenue import get_revenue, revenue_filters
+from app.visibility import archived_ticket_visible, ticket_visible
+from app.dependencies.auth import require_auth, require_role, AuthInfo
 
 router = APIRouter(prefix="/api/stats", tags=["stats"])
 
 @router.get("/", response_model=StatsResponse)
-def get_stats(event_date: str = None, club_id: int = None, show_all_for_admin: bool = False, db: Session = Depends(get_db), auth: AuthInfo = Depends(require_auth)):
-    """IMPREZA: Добавлен параметр club_id для фильтрации"""
-    query = db.query(Ticket)
-    
+def get_stats(event_date: str = None, club_id: int = None, show_all_for_admin: bool = False, include_archived: bool = False, db: Session = Depends(get_read_db), auth: AuthInfo = Depends(require_auth)):
+    """IMPREZA: Добавлен параметр club_id для фильтрации
+
+    include_archived — учитывать билеты закрытых мероприятий (tickets_archive)
+    """
+    filters = []
+
     # Сканеры видят только видимые билеты (не скрытые)
     if not show_all_for_admin:
-        query = query.filter(Ticket.visible_to_managers == True)
-    
+        filters.append(ticket_visible(db))
+
     if event_date:
-        query = query.filter(Ticket.event_date.like(f"%{event_date}%"))
-    
+        filters.append(Ticket.event_date.like(f"%{event_date}%"))
+
     # IMPREZA: Фильтр по club_id
     if club_id:
-        query = query.filter(Ticket.club_id == club_id)
-    
-    total = query.count()
-    entered = query.filter(Ticket.status == "used").count()
-    pending = query.filter(Ticket.status == "valid").count()
-    cancelled = query.filter(Ticket.status == "cancelled").count()
-    
-    today = date.today()
-    today_scans_query = db.query(ScanHistory).filter(
-        func.date(ScanHistory.scan_time) == today
-    )
-    
-    # IMPREZA: Фильтр по club_id в scan_history
-    if club_id:
-        today_scans_query = today_scans_query.filter(ScanHistory.club_id == club_id)
-    
-    duplicate_attempts = today_scans_query.filter(ScanHistory.scan_result == "duplicate").count()
-    invalid_attempts = today_scans_query.filter(ScanHistory.scan_result.in_(["invalid", "forged"])).count()
+        filters.append(Ticket.club_id == club_id)
+
+    # Один проход по tickets: count(*) FILTER (...) вместо четырёх count()
+    counts = ticket_counts(db, base_filters=filters)
     
+    if include_archived:
+        archive_filters = []
+        if not show_all_for_admin:
+            archive_filters.append(archived_ticket_visible(db))
+        if event_date:
+            archive_filters.append(ArchivedTicket.event_date.like(f"%{event_date}%"))
+        if club_id:
+            archive_filters.append(ArchivedTicket.club_id == club_id)
+        counts = merge_counts(counts, ticket_counts(db, base_filters=archive_filters, model=ArchivedTicket))
+
+    # ROLLUP: попытки за сутки площадки — из почасовых бакетов, а не из scan_history
+    today_start, today_end = day_range()
+    by_result = rollup_counts(db, today_start, today_end, club_id=club_id)
+
     return StatsResponse(
-        total_tickets=total,
-        entered=entered,
-        pending=pending,
-        cancelled=cancelled,
-        duplicate_attempts=duplicate_attempts,
-        invalid_attempts=invalid_attempts
+        total_tickets=counts["total"],
+        entered=counts["entered"],
+        pending=counts["pending"],
+        cancelled=counts["cancelled"],
+        duplicate_attempts=by_result.get("duplicate", 0),
+        invalid_attempts=by_result.get("invalid", 0) + by_result.get("forged", 0),
+        total_persons=counts["total_persons"],
+        entered_persons=counts["entered_persons"]
     )
+
+
+@router.get("/timeseries")
+def get_scan_timeseries(
+    club_id: Optional[int] = None,
+    event_name: Optional[str] = None,
+    scan_result: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    auth: AuthInfo = Depends(require_auth),
+):
+    """Почасовой ряд сканов из scan_rollup (по умолчанию — сегодня).
+
+    start_date / end_date: YYYY-MM-DD, включительно, по времени площадки.
+    """
+    try:
+        start_day = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+        end_day = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else start_day
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    days = (end_day - start_day).days + 1 if start_day and end_day else 1
+    if days < 1:
+        raise HTTPException(status_code=400, detail="end_date must be >= start_date")
+
+    start, end = day_range(start_day, days=days)
+    buckets = rollup_series(db, start, end, club_id=club_id, event_name=event_name, scan_result=scan_result)
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "club_id": club_id,
+        "event_name": event_name,
+        "buckets": buckets
+    }
+
+
+@router.get("/revenue")
+def get_revenue_stats(
+    club_id: Optional[int] = None,
+    country_code: Optional[str] = None,
+    event_name: Optional[str] = None,
+    event_date: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    include_cancelled: bool = False,
+    include_archived: bool = True,
+    db: Session = Depends(get_read_db),
+    auth: AuthInfo = Depends(require_role("super_observer")),
+):
+    """Выручка и промокоды: итоги + разрезы по мероприятию, клубу, стране,
+    типу билета и промокоду. start_date / end_date (YYYY-MM-DD) — по дате покупки.
+    include_archived — с билетами закрытых мероприятий (tickets_archive).
+    """
+    start = end = None
+    try:
+        if start_date:
+            start = day_range(datetime.strptime(start_date, "%Y-%m-%d").date())[0]
+        if end_date:
+            end = day_range(datetime.strptime(end_date, "%Y-%m-%d").date())[1]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    criteria = dict(club_id=club_id, country_code=country_code, event_name=event_name, event_date=event_date,
+                    start=start, end=end, include_cancelled=include_cancelled)
+    archive_filters = revenue_filters(ArchivedTicket, **criteria) if include_archived else None
+
+    scope = (club_id, country_code, event_name, event_date, start_date, end_date, include_cancelled, include_archived)
+    return get_revenue(db, scope, revenue_filters(Ticket, **criteria), archive_filters)
+
+
+@router.get("/db-pool")
+def get_db_pool_stats(auth: AuthInfo = Depends(require_role("super_observer"))):
+    """Пул соединений этого воркера: занятые, overflow, ожидание checkout"""
+    return pool_status()
@@ -2,15 +2,26 @@ import logging
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, text
-from datetime import date, datetime
+from sqlalchemy import or_, text, func
+from datetime import date, datetime, timedelta
 from typing import Optional
 
-from app.database import get_db
-from app.models import Ticket, ScanHistory, Club
+from app.database import get_db, get_read_db
+from app.models import Ticket, ScanHistory, ArchivedTicket
 from app.schemas import TicketCreate, TicketResponse, TicketListResponse, SyncFieldsRequest
 from app.security import generate_token, generate_signature
 from app.dependencies.auth import require_auth, require_role, AuthInfo
+from app.aggregates import ticket_counts, merge_counts
+from app.rollup import discount_scans, clear_rollup, rename_event_rollup
+from app.sync import db_now, sync_since, sync_filter, next_watermark, get_tombstones
+from app.revenue import bump_revenue_version
+from app.archive import archive_horizon
+from app.directory import club_by_city, get_directory
+from app.ticket_archive import close_event, reopen_event, closable_events, archived_to_dict
+from app.visibility import (
+    TARGET_TICKETS, ticket_visible, ticket_hidden, is_ticket_visible, archived_ticket_visible,
+    load_rules, add_rule, unhide, set_tickets_visibility, rules_changed_since, invalidate_rules,
+)
 
 logger = logging.getLogger("impreza.security")
 
@@ -21,6 +32,44 @@ def convert_date_for_db_filter(date_str: str) -> str:
 
 router = APIRouter(prefix="/api/tickets", tags=["tickets"])
 
+
+def _parse_ids(ticket_ids: str) -> list[int]:
+    ids_list = [int(x.strip()) for x in ticket_ids.split(",") if x.strip().isdigit()]
+    if not ids_list:
+        raise HTTPException(status_code=400, detail="Неверный формат ticket_ids")
+    return ids_list
+
+
+def _tombstones_archived(db: Session, since: datetime) -> bool:
+    """Tombstones за окно синхронизации уже ушли в холодный архив"""
+    horizon = archive_horizon(db, "deleted_tickets")
+    return horizon is not None and since < horizon
+
+
+def _archive_filters(db: Session, club_id: Optional[int], event_date: Optional[str], status_filter: Optional[str],
+                     show_all_for_admin: bool) -> tuple[list, list]:
+    """Те же фильтры списка, но по tickets_archive (видимость — правила + флаг строки)"""
+    scope_filters = []
+    if not show_all_for_admin:
+        scope_filters.append(archived_ticket_visible(db))
+    if event_date:
+        scope_filters.append(ArchivedTicket.event_date.like(f"%{event_date}%"))
+    if status_filter:
+        scope_filters.append(ArchivedTicket.status == status_filter)
+    base_filters = [ArchivedTicket.club_id == club_id] if club_id else []
+    return base_filters, scope_filters
+
+
+def _with_visibility(db: Session, tickets: list) -> list:
+    """Для админского списка: visible_to_managers с учётом правил, а не только флага строки"""
+    if not load_rules(db, TARGET_TICKETS):
+        return tickets
+    return [
+        TicketResponse.model_validate(t).model_copy(update={"visible_to_managers": is_ticket_visible(db, t)})
+        for t in tickets
+    ]
+
+
 @router.post("/", response_model=TicketResponse, status_code=status.HTTP_201_CREATED)
 def create_ticket(ticket: TicketCreate, db: Session = Depends(get_db), auth: AuthInfo = Depends(require_auth)):
     existing = db.query(Ticket).filter(Ticket.order_id == ticket.order_id).first()
@@ -41,23 +90,13 @@ def create_ticket(ticket: TicketCreate, db: Session = Depends(get_db), auth: Aut
 
     if resolved_city_name and (not resolved_club_id or not resolved_country_code):
         try:
-            club = db.query(Club).filter(
-                or_(
-                    Club.city_english.ilike(resolved_city_name),
-                    Club.city_name.ilike(resolved_city_name),
-                )
-            ).first()
+            club = club_by_city(resolved_city_name, db)
             if club:
                 if not resolved_club_id:
-                    resolved_club_id = club.club_id
-                if not resolved_country_code:
-                    row = db.execute(
-                        text("SELECT country_code FROM countries WHERE country_id = :cid"),
-                        {"cid": club.country_id},
-                    ).fetchone()
-                    if row:
-                        resolved_country_code = row[0]
-                        logger.info(f"Auto-resolved country_code='{resolved_country_code}' for city '{resolved_city_name}'")
+                    resolved_club_id = club["id"]
+                if not resolved_country_code and club["country_code"]:
+                    resolved_country_code = club["country_code"]
+                    logger.info(f"Auto-resolved country_code='{resolved_country_code}' for city '{resolved_city_name}'")
         except Exception as e:
             logger.warning(f"Could not auto-resolve club/country for city '{resolved_city_name}': {e}")
 
@@ -98,46 +137,97 @@ def get_tickets(
     status_filter: str = None,
     club_id: int = None,
     show_all_for_admin: bool = False,
+    updated_since: Optional[datetime] = None,
+    after_id: Optional[int] = None,
+    include_archived: bool = False,
     limit: int = 10000,
     offset: int = 0,
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_auth),
 ):
-    query = db.query(Ticket)
+    """Список билетов.
+
+    SYNC: если передан updated_since — возвращаются только билеты с updated_at
+    новее watermark, tombstones удалённых билетов и новый watermark.
+    Пока has_more — следующая страница с after_id=watermark_id (app/sync.py).
+    Билеты закрытых мероприятий приходят в sync как tombstones.
+    include_archived — добавить билеты закрытых мероприятий (tickets_archive)
+    после живых, счётчики — суммарные.
+    """
+    started_at = db_now(db) if updated_since else None
+    scope_filters = []
     
-    # БАГ FIX #2: Фильтрация по visible_to_managers
+    # БАГ FIX #2: Фильтрация по видимости (правила + флаг строки)
     if not show_all_for_admin:
-        query = query.filter(Ticket.visible_to_managers == True)
+        scope_filters.append(ticket_visible(db))
     
     if event_date:
-        query = query.filter(Ticket.event_date.like(f"%{event_date}%"))
+        scope_filters.append(Ticket.event_date.like(f"%{event_date}%"))
     
     if status_filter:
-        query = query.filter(Ticket.status == status_filter)
+        scope_filters.append(Ticket.status == status_filter)
     
-    if club_id:
-        query = query.filter(Ticket.club_id == club_id)
+    base_filters = [Ticket.club_id == club_id] if club_id else []
+    query = db.query(Ticket).filter(*base_filters, *scope_filters)
     
-    total = query.count()
+    # Один проход: total по фильтрам списка, entered/pending — по клубу
+    counts = ticket_counts(db, base_filters=base_filters, scope_filters=scope_filters)
+    total = counts["total"]
+    entered = counts["entered"]
+    pending = counts["pending"]
     
-    entered_query = db.query(Ticket).filter(Ticket.status == "used")
-    if club_id:
-        entered_query = entered_query.filter(Ticket.club_id == club_id)
-    entered = entered_query.count()
-    
-    pending_query = db.query(Ticket).filter(Ticket.status == "valid")
-    if club_id:
-        pending_query = pending_query.filter(Ticket.club_id == club_id)
-    pending = pending_query.count()
+    if updated_since:
+        since = sync_since(updated_since)
+        changed = query.filter(sync_filter(Ticket.updated_at, Ticket.id, updated_since, after_id)).order_by(
+            Ticket.updated_at, Ticket.id
+        ).limit(limit).all()
+        watermark, watermark_id, has_more = next_watermark(changed, limit, "updated_at", started_at)
+        
+        return TicketListResponse(
+            tickets=_with_visibility(db, changed) if show_all_for_admin else changed,
+            total=total,
+            bought=total,
+            entered=entered,
+            pending=pending,
+            total_persons=counts["total_persons"],
+            entered_persons=counts["entered_persons"],
+            deleted=get_tombstones(db, since, club_id=club_id),
+            watermark=watermark,
+            watermark_id=watermark_id,
+            has_more=has_more,
+            full_resync=rules_changed_since(db, TARGET_TICKETS, since) or _tombstones_archived(db, since)
+        )
     
     tickets = query.order_by(Ticket.created_at.desc()).offset(offset).limit(limit).all()
+    if show_all_for_admin:
+        tickets = _with_visibility(db, tickets)
+    
+    if include_archived:
+        archive_base, archive_scope = _archive_filters(db, club_id, event_date, status_filter, show_all_for_admin)
+        archived_counts = ticket_counts(db, base_filters=archive_base, scope_filters=archive_scope, model=ArchivedTicket)
+        
+        # Страница продолжается архивом, когда живые билеты закончились
+        if len(tickets) < limit:
+            archived = db.query(ArchivedTicket).filter(*archive_base, *archive_scope).order_by(
+                ArchivedTicket.original_created_at.desc(), ArchivedTicket.id.desc()
+            ).offset(max(0, offset - total)).limit(limit - len(tickets)).all()
+            if show_all_for_admin and load_rules(db, TARGET_TICKETS):
+                archived_items = [dict(archived_to_dict(a), visible_to_managers=is_ticket_visible(db, a)) for a in archived]
+            else:
+                archived_items = [archived_to_dict(a) for a in archived]
+            tickets = list(tickets) + archived_items
+        
+        counts = merge_counts(counts, archived_counts)
+        total, entered, pending = counts["total"], counts["entered"], counts["pending"]
     
     return TicketListResponse(
         tickets=tickets,
         total=total,
         bought=total,
         entered=entered,
-        pending=pending
+        pending=pending,
+        total_persons=counts["total_persons"],
+        entered_persons=counts["entered_persons"]
     )
 
 
@@ -154,62 +244,60 @@ def hide_tickets_from_managers(
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("manager")),
 ):
-    """Скрыть билеты от менеджеров (visible_to_managers = false)
-    
+    """Скрыть билеты от менеджеров
+
     ВАЖНО: Если указан ticket_id или ticket_ids, скрываются ТОЛЬКО эти билеты!
+    Массовое скрытие по фильтрам — одно правило в visibility_rules вместо UPDATE строк.
     """
     try:
-        query = db.query(Ticket)
-        
-        # ПРИОРИТЕТ 1: Если указан конкретный ticket_id — скрываем ТОЛЬКО его
-        if ticket_id:
-            query = query.filter(Ticket.id == ticket_id)
-            print(f"👁️ Скрытие конкретного билета ID={ticket_id}")
-        
-        # ПРИОРИТЕТ 2: Если указан список ticket_ids — скрываем ТОЛЬКО их
-        elif ticket_ids:
-            ids_list = [int(x.strip()) for x in ticket_ids.split(",") if x.strip().isdigit()]
-            if not ids_list:
-                raise HTTPException(status_code=400, detail="Неверный формат ticket_ids")
-            query = query.filter(Ticket.id.in_(ids_list))
+        # ПРИОРИТЕТ 1-2: конкретные билеты — флаг в строке
+        if ticket_id or ticket_ids:
+            ids_list = [ticket_id] if ticket_id else _parse_ids(ticket_ids)
             print(f"👁️ Скрытие билетов ID={ids_list}")
-        
+            tickets = db.query(Ticket).filter(Ticket.id.in_(ids_list)).all()
+            updated_count = set_tickets_visibility(db, tickets, False, created_by=auth.name)
+            db.commit()
+            invalidate_rules()
+            print(f"✅ Скрыто {updated_count} билетов от менеджеров")
+            return {"message": f"Скрыто {updated_count} билетов от менеджеров", "updated_count": updated_count}
+
         # ПРИОРИТЕТ 3: Массовое скрытие по фильтрам
-        else:
-            # Требуем хотя бы один фильтр для безопасности
-            if not any([club_id, city_name, country_code, event_name, start_date]):
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Для массового скрытия требуется указать хотя бы один фильтр"
-                )
-            
-            # Фильтр по стране
-            if country_code:
-                query = query.filter(Ticket.country_code == country_code)
-            
+        # Требуем хотя бы один фильтр для безопасности
+        if not any([club_id, city_name, country_code, event_name, start_date]):
+            raise HTTPException(
+                status_code=400,
+                detail="Для массового скрытия требуется указать хотя бы один фильтр"
+            )
+
+        # Фильтр по датам: [start_date 00:00, end_date + 1 день); только обе границы —
+        # открытый диапазон скрыл бы всё до/после даты, включая будущие продажи
+        if bool(start_date) != bool(end_date):
+            raise HTTPException(status_code=400, detail="Укажите обе даты: start_date и end_date")
+        start_at = end_at = None
+        if start_date and end_date:
+            try:
+                start_at = datetime.strptime(start_date, "%Y-%m-%d")
+                end_at = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+        scope = dict(
+            club_id=club_id,
             # Фильтр по городу (club_id или city_name)
-            if club_id:
-                query = query.filter(Ticket.club_id == club_id)
-            elif city_name:
-                query = query.filter(Ticket.city_name == city_name)
-            
-            # Фильтр по мероприятию
-            if event_name:
-                query = query.filter(Ticket.event_name == event_name)
-            
-            # Фильтр по датам
-            if start_date and end_date:
-                start_datetime = f"{start_date} 00:00:00"
-                end_datetime = f"{end_date} 23:59:59"
-                query = query.filter(Ticket.created_at >= start_datetime)
-                query = query.filter(Ticket.created_at <= end_datetime)
-        
-        updated_count = query.update({"visible_to_managers": False}, synchronize_session='fetch')
+            city_name=None if club_id else city_name,
+            country_code=country_code,
+            event_name=event_name,
+            start_at=start_at,
+            end_at=end_at,
+        )
+        # Одна вставка правила, без подсчёта строк (CASE по правилам индексом не обслуживается)
+        rule = add_rule(db, TARGET_TICKETS, "hide", created_by=auth.name, **scope)
         db.commit()
-        
-        print(f"✅ Скрыто {updated_count} билетов от менеджеров")
-        return {"message": f"Скрыто {updated_count} билетов от менеджеров", "updated_count": updated_count}
-        
+        invalidate_rules()
+
+        print(f"✅ Билеты скрыты от менеджеров (правило #{rule.id})")
+        return {"message": "Билеты скрыты от менеджеров", "rule_id": rule.id}
+
     except HTTPException:
         raise
     except Exception as e:
@@ -220,37 +308,93 @@ def hide_tickets_from_managers(
 
 @router.get("/hidden-events")
 def get_hidden_events(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     auth: AuthInfo = Depends(require_role("manager")),
 ):
     """Получить список скрытых мероприятий (уникальные event_name со скрытыми билетами)"""
     try:
-        # Получаем уникальные event_name, country_code, city_name для скрытых билетов
-        hidden_tickets = db.query(Ticket).filter(Ticket.visible_to_managers == False).all()
-        
-        # Группируем по event_name с подсчётом и информацией о стране/городе
-        events_data = {}
-        for ticket in hidden_tickets:
-            event_name = ticket.event_name or "Без названия"
-            if event_name not in events_data:
-                events_data[event_name] = {
-                    "event_name": event_name,
-                    "country_code": ticket.country_code,
-                    "city_name": ticket.city_name,
-                    "count": 0
-                }
-            events_data[event_name]["count"] += 1
-        
+        # Группировка в SQL: скрытость — с учётом правил видимости
+        rows = db.query(
+            Ticket.event_name,
+            func.min(Ticket.country_code).label("country_code"),
+            func.min(Ticket.city_name).label("city_name"),
+            func.count(Ticket.id).label("count"),
+        ).filter(ticket_hidden(db)).group_by(Ticket.event_name).all()
+
+        hidden_events = [
+            {
+                "event_name": row.event_name or "Без названия",
+                "country_code": row.country_code,
+                "city_name": row.city_name,
+                "count": row.count
+            }
+            for row in rows
+        ]
+
         return {
-            "hidden_events": list(events_data.values()),
-            "total_hidden": len(hidden_tickets)
+            "hidden_events": hidden_events,
+            "total_hidden": sum(row.count for row in rows)
         }
-        
+
     except Exception as e:
         print(f"❌ Ошибка получения скрытых событий: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
 
+@router.get("/closable-events")
+def get_closable_events(
+    idle_days: int = Query(default=14, ge=1),
+    club_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Мероприятия без продаж и сканов последние idle_days дней — кандидаты на закрытие"""
+    return {"events": closable_events(db, idle_days=idle_days, club_id=club_id), "idle_days": idle_days}
+
+
+@router.post("/close-event")
+def close_event_endpoint(
+    event_name: str = Query(..., description="Название мероприятия"),
+    club_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Закрыть мероприятие: билеты (со статусом и счётчиками сканирования) переносятся
+    в tickets_archive одним INSERT ... SELECT. Списки и статистика видят их
+    только с include_archived=true. Обратная операция — /reopen-event.
+    """
+    try:
+        result = close_event(db, event_name, club_id=club_id, archived_by=auth.name)
+        db.commit()
+        logger.info("Event closed by %s: '%s' (club_id=%s), %s tickets archived",
+                    auth.name, event_name, club_id, result["archived"])
+        print(f"📦 Мероприятие '{event_name}' закрыто: {result['archived']} билетов в архиве")
+        return {"event_name": event_name, "club_id": club_id, **result}
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка закрытия мероприятия: {e}")
+        raise HTTPException(status_code=500, detail=f"Close event error: {str(e)}")
+
+
+@router.post("/reopen-event")
+def reopen_event_endpoint(
+    event_name: str = Query(..., description="Название мероприятия"),
+    club_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Вернуть билеты закрытого мероприятия из tickets_archive (с прежними id)"""
+    try:
+        result = reopen_event(db, event_name, club_id=club_id)
+        db.commit()
+        print(f"📤 Мероприятие '{event_name}' открыто: восстановлено {result['restored']}, конфликтов {len(result['conflicts'])}")
+        return {"event_name": event_name, "club_id": club_id, **result}
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка открытия мероприятия: {e}")
+        raise HTTPException(status_code=500, detail=f"Reopen event error: {str(e)}")
+
+
 @router.put("/show-to-managers")
 def show_tickets_to_managers(
     club_id: Optional[int] = None,
@@ -262,49 +406,46 @@ def show_tickets_to_managers(
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("manager")),
 ):
-    """Восстановить скрытые билеты (visible_to_managers = true)
-    
+    """Восстановить скрытые билеты
+
     ВАЖНО: Если указан ticket_id, ticket_ids или order_id, восстанавливаются ТОЛЬКО эти билеты!
+    Массовое восстановление по фильтрам — одно правило show (перекрывает и правила, и флаги строк).
     """
     try:
-        query = db.query(Ticket).filter(Ticket.visible_to_managers == False)
-        
-        # ПРИОРИТЕТ 1: Если указан order_id (номер заказа) — восстанавливаем ТОЛЬКО его
-        if order_id:
-            query = query.filter(Ticket.order_id == order_id)
-            print(f"👁️ Восстановление билета по order_id={order_id}")
-        
-        # ПРИОРИТЕТ 2: Если указан конкретный ticket_id — восстанавливаем ТОЛЬКО его
-        elif ticket_id:
-            query = query.filter(Ticket.id == ticket_id)
-            print(f"👁️ Восстановление конкретного билета ID={ticket_id}")
-        
-        # ПРИОРИТЕТ 3: Если указан список ticket_ids — восстанавливаем ТОЛЬКО их
-        elif ticket_ids:
-            ids_list = [int(x.strip()) for x in ticket_ids.split(",") if x.strip().isdigit()]
-            if not ids_list:
-                raise HTTPException(status_code=400, detail="Неверный формат ticket_ids")
-            query = query.filter(Ticket.id.in_(ids_list))
-            print(f"👁️ Восстановление билетов ID={ids_list}")
-        
-        # ПРИОРИТЕТ 4: Массовое восстановление по фильтрам
-        else:
-            # Фильтр по городу (club_id или city_name)
-            if club_id:
-                query = query.filter(Ticket.club_id == club_id)
-            elif city_name:
-                query = query.filter(Ticket.city_name == city_name)
-            
-            # Фильтр по мероприятию
-            if event_name:
-                query = query.filter(Ticket.event_name == event_name)
-        
-        updated_count = query.update({"visible_to_managers": True}, synchronize_session='fetch')
+        # ПРИОРИТЕТ 1-3: конкретные билеты
+        if order_id or ticket_id or ticket_ids:
+            query = db.query(Ticket).filter(ticket_hidden(db))
+            if order_id:
+                query = query.filter(Ticket.order_id == order_id)
+                print(f"👁️ Восстановление билета по order_id={order_id}")
+            elif ticket_id:
+                query = query.filter(Ticket.id == ticket_id)
+                print(f"👁️ Восстановление конкретного билета ID={ticket_id}")
+            else:
+                ids_list = _parse_ids(ticket_ids)
+                query = query.filter(Ticket.id.in_(ids_list))
+                print(f"👁️ Восстановление билетов ID={ids_list}")
+            updated_count = set_tickets_visibility(db, query.all(), True, created_by=auth.name)
+            db.commit()
+            invalidate_rules()
+            print(f"✅ Восстановлено {updated_count} билетов для менеджеров")
+            return {"message": f"Восстановлено {updated_count} билетов", "updated_count": updated_count}
+
+        # ПРИОРИТЕТ 4: Массовое восстановление по фильтрам — одна вставка правила, без подсчёта
+        scope = dict(
+            club_id=club_id,
+            city_name=None if club_id else city_name,
+            event_name=event_name,
+        )
+        rule = unhide(db, TARGET_TICKETS, created_by=auth.name, **scope)
         db.commit()
-        
-        print(f"✅ Восстановлено {updated_count} билетов для менеджеров")
-        return {"message": f"Восстановлено {updated_count} билетов", "updated_count": updated_count}
-        
+        invalidate_rules()
+
+        print(f"✅ Билеты восстановлены для менеджеров (правило #{rule.id})")
+        return {"message": "Билеты восстановлены для менеджеров", "rule_id": rule.id}
+
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         print(f"❌ Ошибка восстановления: {e}")
@@ -429,6 +570,7 @@ def delete_tickets_range(
             
             # ===== УДАЛЕНИЕ из основных таблиц =====
             # СНАЧАЛА удаляем связанные записи из scan_history (ForeignKey fix)
+            discount_scans(db, ScanHistory.ticket_id.in_(ids_to_delete))
             db.query(ScanHistory).filter(ScanHistory.ticket_id.in_(ids_to_delete)).delete(synchronize_session='fetch')
             
             # ПОТОМ удаляем билеты
@@ -452,9 +594,16 @@ def delete_tickets_range(
 
 
 @router.get("/{order_id}", response_model=TicketResponse)
-def get_ticket(order_id: str, db: Session = Depends(get_db), auth: AuthInfo = Depends(require_auth)):
+def get_ticket(order_id: str, include_archived: bool = False, db: Session = Depends(get_db), auth: AuthInfo = Depends(require_auth)):
     ticket = db.query(Ticket).filter(Ticket.order_id == order_id).first()
     
+    if not ticket and include_archived:
+        archived = db.query(ArchivedTicket).filter(ArchivedTicket.order_id == order_id).order_by(
+            ArchivedTicket.id.desc()
+        ).first()
+        if archived:
+            return archived_to_dict(archived)
+    
     if not ticket:
         raise HTTPException(status_code=404, detail=f"Ticket {order_id} not found")
     
@@ -503,10 +652,11 @@ def update_ticket_by_id(
         print(f"✅ Билет {ticket_id}: scan_count → {scan_count}")
     
     if visible_to_managers is not None:
-        ticket.visible_to_managers = visible_to_managers
+        set_tickets_visibility(db, [ticket], visible_to_managers, created_by=auth.name)
         print(f"✅ Билет {ticket_id}: visible_to_managers → {visible_to_managers}")
     
     db.commit()
+    invalidate_rules()
     db.refresh(ticket)
     
     return {"message": f"Билет {ticket_id} обновлён", "ticket": {
@@ -640,8 +790,9 @@ def hide_ticket(order_id: str, db: Session = Depends(get_db), auth: AuthInfo = D
     if not ticket:
         raise HTTPException(status_code=404, detail=f"Ticket {order_id} not found")
     
-    ticket.visible_to_managers = False
+    set_tickets_visibility(db, [ticket], False, created_by=auth.name)
     db.commit()
+    invalidate_rules()
     
     return {
         "success": True,
@@ -724,6 +875,7 @@ def delete_tickets_by_club(
         
         if ticket_ids:
             # Сначала удаляем связанные записи из scan_history (FK constraint)
+            discount_scans(db, ScanHistory.ticket_id.in_(ticket_ids))
             db.query(ScanHistory).filter(ScanHistory.ticket_id.in_(ticket_ids)).delete(synchronize_session=False)
             # Потом удаляем билеты
             db.query(Ticket).filter(Ticket.id.in_(ticket_ids)).delete(synchronize_session=False)
@@ -785,6 +937,7 @@ def delete_tickets_by_club_id(
         
         if ticket_ids:
             # Сначала удаляем связанные записи из scan_history (FK constraint)
+            discount_scans(db, ScanHistory.ticket_id.in_(ticket_ids))
             db.query(ScanHistory).filter(ScanHistory.ticket_id.in_(ticket_ids)).delete(synchronize_session=False)
             # Потом удаляем билеты
             db.query(Ticket).filter(Ticket.id.in_(ticket_ids)).delete(synchronize_session=False)
@@ -805,8 +958,10 @@ def delete_all_tickets(db: Session = Depends(get_db), auth: AuthInfo = Depends(r
     try:
         count = db.query(Ticket).count()
         
-        # Сначала удаляем всю историю сканирований (FK constraint)
-        db.query(ScanHistory).delete(synchronize_session=False)
+        # Сначала удаляем всю историю сканирований (FK constraint).
+        # TRUNCATE освобождает все партиции сразу, без построчного DELETE
+        db.execute(text("TRUNCATE TABLE scan_history"))
+        clear_rollup(db)
         # Потом удаляем все билеты
         db.query(Ticket).delete(synchronize_session=False)
         
@@ -822,19 +977,15 @@ def delete_all_tickets(db: Session = Depends(get_db), auth: AuthInfo = Depends(r
 @router.put("/fix-club-ids")
 def fix_club_ids(db: Session = Depends(get_db), auth: AuthInfo = Depends(require_role("super"))):
     """Исправляет club_id для всех билетов на основе city_name.
-    Маппинг city_name (английское название) → club_id из таблицы clubs.
+    Маппинг city_name (английское название) → club_id из справочника клубов.
     """
-    from sqlalchemy import text
-    
     try:
-        # Загружаем все клубы через raw SQL
-        result = db.execute(text("SELECT club_id, city_english FROM clubs WHERE is_active = true"))
-        
-        # Создаём маппинг city_english -> club_id
-        city_to_club_id = {}
-        for row in result:
-            if row[1]:  # city_english
-                city_to_club_id[row[1].lower()] = row[0]  # club_id
+        # Активные клубы из справочника: city_english -> club_id
+        city_to_club_id = {
+            club["city_english"].lower(): club["id"]
+            for club in get_directory(db)["clubs"]
+            if club["is_active"] and club["city_english"]
+        }
         
         print(f"📋 Загружено {len(city_to_club_id)} клубов для маппинга")
         print(f"📋 Маппинг: {city_to_club_id}")
@@ -952,6 +1103,7 @@ def delete_tickets_by_event(
         
         # ===== УДАЛЕНИЕ =====
         # Сначала удаляем все связанные записи из scan_history
+        discount_scans(db, ScanHistory.ticket_id.in_(ticket_ids))
         scan_history_deleted = db.query(ScanHistory).filter(ScanHistory.ticket_id.in_(ticket_ids)).delete(synchronize_session=False)
         
         print(f"🗑️ Удалено записей из scan_history: {scan_history_deleted}")
@@ -988,7 +1140,8 @@ def rename_event(
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_role("super")),
 ):
-    """Переименовать мероприятие — обновить event_name у всех билетов"""
+    """Переименовать мероприятие — обновить event_name у всех билетов
+    и бакетов scan_rollup их клубов (в той же транзакции)"""
     try:
         if not old_name or not new_name:
             raise HTTPException(status_code=400, detail="old_name and new_name are required")
@@ -997,9 +1150,11 @@ def rename_event(
         if count == 0:
             return {"updated_count": 0, "message": f"No tickets found with event_name='{old_name}'"}
 
+        club_ids = [row[0] for row in db.query(Ticket.club_id).filter(Ticket.event_name == old_name).distinct()]
         db.query(Ticket).filter(Ticket.event_name == old_name).update(
-            {Ticket.event_name: new_name}, synchronize_session=False
+            {Ticket.event_name: new_name, Ticket.updated_at: func.now()}, synchronize_session=False
         )
+        rename_event_rollup(db, old_name, new_name, club_ids)
         db.commit()
 
         print(f"✅ Переименовано мероприятие: '{old_name}' → '{new_name}' ({count} билетов)")
@@ -1044,7 +1199,7 @@ def repair_after_restore(
     try:
         # ── 1. Fix NULL visible_to_managers ──
         fixed_vis = db.execute(text("""
-            UPDATE tickets SET visible_to_managers = true
+            UPDATE tickets SET visible_to_managers = true, updated_at = now()
             WHERE visible_to_managers IS NULL
         """))
         db.commit()
@@ -1053,7 +1208,7 @@ def repair_after_restore(
         # ── 2. Fix missing club_id (join by city_name) ──
         fixed_club = db.execute(text("""
             UPDATE tickets t
-            SET club_id = c.club_id
+            SET club_id = c.club_id, updated_at = now()
             FROM clubs c
             WHERE t.club_id IS NULL
               AND (LOWER(t.city_name) = LOWER(c.city_english) OR LOWER(t.city_name) = LOWER(c.city_name))
@@ -1064,7 +1219,7 @@ def repair_after_restore(
         # ── 3. Fix missing country_code via club_id → countries ──
         fixed_cc = db.execute(text("""
             UPDATE tickets t
-            SET country_code = co.country_code
+            SET country_code = co.country_code, updated_at = now()
             FROM clubs c
             JOIN countries co ON c.country_id = co.country_id
             WHERE (t.country_code IS NULL OR t.country_code = '')
@@ -1076,7 +1231,7 @@ def repair_after_restore(
         # ── 3b. Fix country_code by city_name match ──
         fixed_cc2 = db.execute(text("""
             UPDATE tickets t
-            SET country_code = co.country_code
+            SET country_code = co.country_code, updated_at = now()
             FROM clubs c
             JOIN countries co ON c.country_id = co.country_id
             WHERE (t.country_code IS NULL OR t.country_code = '')
@@ -1084,6 +1239,10 @@ def repair_after_restore(
         """))
         db.commit()
         results["country_code_fixed"] += fixed_cc2.rowcount
+        if results["club_id_fixed"] or results["country_code_fixed"]:
+            # club_id/country_code — разрезы выручки; raw UPDATE мимо ORM-слушателей
+            bump_revenue_version(db)
+            db.commit()
 
         # ── 4. Fix PostgreSQL sequences ──
         for tbl, col in [("tickets", "id"), ("scan_history", "id"), ("deleted_tickets", "id"), ("clubs", "club_id"), ("countries", "country_id")]:
@@ -7,11 +7,13 @@ import hmac
 import hashlib
 import re
 
-from app.database import get_db
-from app.models import Ticket, Club
+from app.database import HotSession, get_hot_db, run_db
+from app.models import Ticket
+from app.directory import club_by_city, club_by_id
 from app.schemas import TicketCreate, TicketResponse
 from app.security import generate_token, generate_signature
 from app.config import settings
+from app.metrics import TILDA_WEBHOOKS
 
 # Настройка логирования
 logger = logging.getLogger("impreza.security")
@@ -58,14 +60,12 @@ def normalize_city_name(city_name: str, db: Session = None) -> str:
         if city_lower.startswith(en.lower() + ' ') or city_lower.startswith(en.lower() + '-'):
             return en
 
-    # Поиск в clubs таблице (если доступна БД)
+    # Поиск в справочнике клубов (если доступна БД)
     if db:
         try:
-            club = db.query(Club).filter(
-                Club.city_english.ilike(city_name)
-            ).first()
+            club = club_by_city(city_name, db)
             if club:
-                return club.city_english
+                return club["city_english"]
         except Exception:
             pass
     
@@ -99,6 +99,7 @@ def process_tilda_order(webhook_data: TildaWebhookData, db: Session) -> Ticket:
     existing_ticket = db.query(Ticket).filter(Ticket.order_id == webhook_data.order_id).first()
     if existing_ticket:
         logger.info(f"Ticket with order_id {webhook_data.order_id} already exists")
+        TILDA_WEBHOOKS.labels("duplicate").inc()
         return existing_ticket
     
     # Нормализуем city_name (русский → английский, убираем суффиксы типа "MEET AND GREET")
@@ -111,30 +112,21 @@ def process_tilda_order(webhook_data: TildaWebhookData, db: Session) -> Ticket:
     club = None
     if not club_id and normalized_city:
         try:
-            club = db.query(Club).filter(
-                Club.city_english.ilike(normalized_city)
-            ).first()
+            club = club_by_city(normalized_city, db)
             if club:
-                club_id = club.club_id
+                club_id = club["id"]
                 logger.info(f"Auto-resolved club_id={club_id} for city '{normalized_city}'")
         except Exception as e:
             logger.warning(f"Could not resolve club_id for city '{normalized_city}': {e}")
     
-    # Auto-resolve country_code из club → countries, если не указан или пустой
+    # Auto-resolve country_code из справочника клубов, если не указан или пустой
     resolved_country = webhook_data.country_code
     if (not resolved_country or resolved_country == '') and club_id:
         try:
-            if not club:
-                club = db.query(Club).filter(Club.club_id == club_id).first()
-            if club:
-                from sqlalchemy import text
-                row = db.execute(
-                    text("SELECT country_code FROM countries WHERE country_id = :cid"),
-                    {"cid": club.country_id},
-                ).fetchone()
-                if row:
-                    resolved_country = row[0]
-                    logger.info(f"Auto-resolved country_code='{resolved_country}' for club_id={club_id}")
+            club = club or club_by_id(club_id, db)
+            if club and club["country_code"]:
+                resolved_country = club["country_code"]
+                logger.info(f"Auto-resolved country_code='{resolved_country}' for club_id={club_id}")
         except Exception as e:
             logger.warning(f"Could not resolve country_code for club_id={club_id}: {e}")
     
@@ -191,17 +183,19 @@ def process_tilda_order(webhook_data: TildaWebhookData, db: Session) -> Ticket:
     db.refresh(db_ticket)
     
     logger.info(f"Created new ticket: {webhook_data.order_id}")
+    TILDA_WEBHOOKS.labels("created").inc()
     return db_ticket
 
 @router.post("/webhook", status_code=status.HTTP_200_OK)
 async def tilda_webhook(
     request: Request,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: HotSession = Depends(get_hot_db)
 ):
     """
     Webhook endpoint для получения заказов от Tilda.
     Защищён проверкой секрета (X-Tilda-Secret header).
+    Работа с БД — через run_db: не блокирует event loop ни в async-, ни в sync-режиме.
     """
     # ─── Проверка webhook secret ───
     webhook_secret = settings.TILDA_WEBHOOK_SECRET
@@ -209,6 +203,7 @@ async def tilda_webhook(
         incoming_secret = request.headers.get("X-Tilda-Secret", "")
         if not hmac.compare_digest(incoming_secret, webhook_secret):
             logger.warning("Tilda webhook: invalid secret from %s", request.client.host if request.client else "unknown")
+            TILDA_WEBHOOKS.labels("forbidden").inc()
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid webhook secret")
     
     try:
@@ -227,12 +222,14 @@ async def tilda_webhook(
         
         # Проверяем обязательные поля
         if not webhook_data.order_id:
+            TILDA_WEBHOOKS.labels("invalid").inc()
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Missing required field: orderid"
             )
         
         if not webhook_data.customer_name:
+            TILDA_WEBHOOKS.labels("invalid").inc()
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Missing required field: name"
@@ -241,10 +238,11 @@ async def tilda_webhook(
         # Обрабатываем только успешные платежи
         if webhook_data.payment_status.lower() not in ['confirmed', 'paid', 'success']:
             logger.info(f"Skipping order {webhook_data.order_id} with status: {webhook_data.payment_status}")
+            TILDA_WEBHOOKS.labels("skipped").inc()
             return {"status": "skipped", "reason": f"Payment status: {webhook_data.payment_status}"}
         
         # Создаем билет
-        ticket = process_tilda_order(webhook_data, db)
+        ticket = await run_db(db, lambda session: process_tilda_order(webhook_data, session))
         
         return {
             "status": "success", 
@@ -257,6 +255,7 @@ async def tilda_webhook(
         raise
     except Exception as e:
         logger.error(f"Error processing Tilda webhook: {str(e)}")
+        TILDA_WEBHOOKS.labels("error").inc()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Webhook processing error"
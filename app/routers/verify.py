@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import Optional
 
-from app.database import get_db
-from app.models import Ticket, ScanHistory
+from app.database import HotSession, get_db, get_hot_db, run_db
+from app.models import Ticket, ScanHistory, ArchivedTicket
 from app.schemas import VerifyRequest, VerifyResponse
 from app.security import parse_qr_data, verify_signature_from_qr
 from app.dependencies.auth import require_auth, AuthInfo
+from app.rollup import record_scan, rollup_total
+from app.metrics import SCANS
+from app.querybudget import query_budget
+from app.visibility import is_ticket_visible
 
 import logging
 logger = logging.getLogger("impreza.security")
@@ -18,7 +23,14 @@ router = APIRouter(prefix="/api", tags=["verify"])
 TICKET_EXPIRY_HOURS = 10
 
 @router.post("/verify", response_model=VerifyResponse)
-def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
+@query_budget(20)
+async def verify_ticket(request: VerifyRequest, db: HotSession = Depends(get_hot_db)):
+    return await run_db(db, check_ticket, request)
+
+
+def check_ticket(db: Session, request: VerifyRequest) -> VerifyResponse:
+    """Проверка QR и отметка входа. Sync-код на Session: в async-режиме
+    выполняется через AsyncSession.run_sync (app/database.py, run_db)"""
     
     # 1. Парсим QR
     qr_data = parse_qr_data(request.qr_data)
@@ -76,7 +88,7 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
                 signature_valid = True
             else:
                 logger.warning("Signature AND token mismatch for order %s — rejecting", order_id)
-                log_scan(db, ticket.id, order_id, "forged", request.scanner_id, "Signature mismatch", club_id=ticket.club_id)
+                log_scan(db, ticket.id, order_id, "forged", request.scanner_id, "Signature mismatch", club_id=ticket.club_id, event_name=ticket.event_name)
                 return VerifyResponse(
                     status="invalid",
                     message="Invalid ticket signature",
@@ -93,6 +105,17 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
     
     # 4. Билет не найден в БД
     if not ticket:
+        # Билет закрытого мероприятия (tickets_archive) — отдельное сообщение для сканера
+        archived = db.query(ArchivedTicket.club_id, ArchivedTicket.event_name).filter(
+            ArchivedTicket.order_id == order_id
+        ).first()
+        if archived:
+            log_scan(db, None, order_id, "invalid", request.scanner_id, "Event closed", club_id=archived.club_id, event_name=archived.event_name)
+            return VerifyResponse(
+                status="invalid",
+                message="Мероприятие завершено",
+                data=qr_data
+            )
         log_scan(db, None, order_id, "invalid", request.scanner_id, "Not found in DB", club_id=None)
         return VerifyResponse(
             status="invalid",
@@ -102,8 +125,8 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
     
     # Проверка: если билет скрыт от менеджеров — он "удалён" для сканера
     # Админ может сканировать скрытые билеты
-    if ticket.visible_to_managers == False and not request.is_admin:
-        log_scan(db, ticket.id, ticket.order_id, "invalid", request.scanner_id, "Hidden from managers", club_id=ticket.club_id)
+    if not is_ticket_visible(db, ticket) and not request.is_admin:
+        log_scan(db, ticket.id, ticket.order_id, "invalid", request.scanner_id, "Hidden from managers", club_id=ticket.club_id, event_name=ticket.event_name)
         return VerifyResponse(
             status="invalid",
             message="Билет удалён",
@@ -119,7 +142,7 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
     
     # 4. Проверяем статус
     if ticket.status == "cancelled":
-        log_scan(db, ticket.id, ticket.order_id, "invalid", request.scanner_id, "Cancelled", club_id=ticket.club_id)
+        log_scan(db, ticket.id, ticket.order_id, "invalid", request.scanner_id, "Cancelled", club_id=ticket.club_id, event_name=ticket.event_name)
         return VerifyResponse(
             status="invalid",
             message="Ticket has been cancelled",
@@ -131,7 +154,7 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
         ticket.last_scan_at = datetime.now()
         db.commit()
         
-        log_scan(db, ticket.id, ticket.order_id, "duplicate", request.scanner_id, notes=None, club_id=ticket.club_id)
+        log_scan(db, ticket.id, ticket.order_id, "duplicate", request.scanner_id, notes=None, club_id=ticket.club_id, event_name=ticket.event_name)
         
         quantity = ticket.quantity or 1
         return VerifyResponse(
@@ -150,7 +173,7 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
             db.commit()
             
             log_scan(db, ticket.id, ticket.order_id, "expired", request.scanner_id, 
-                    notes=f"Expired after {hours_passed:.1f}h", club_id=ticket.club_id)
+                    notes=f"Expired after {hours_passed:.1f}h", club_id=ticket.club_id, event_name=ticket.event_name)
             
             return VerifyResponse(
                 status="expired",
@@ -186,7 +209,7 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
             message = "Access granted"
         
         log_scan(db, ticket.id, ticket.order_id, "valid", request.scanner_id, 
-                notes=f"Entry {ticket.scan_count}/{quantity}", club_id=ticket.club_id)
+                notes=f"Entry {ticket.scan_count}/{quantity}", club_id=ticket.club_id, event_name=ticket.event_name)
         
         response_data = ticket_to_dict(ticket)
         response_data["quantity"] = quantity
@@ -209,7 +232,7 @@ def verify_ticket(request: VerifyRequest, db: Session = Depends(get_db)):
         db.commit()
         
         log_scan(db, ticket.id, ticket.order_id, "duplicate", request.scanner_id, 
-                notes=f"All entries used ({scan_count}/{quantity})", club_id=ticket.club_id)
+                notes=f"All entries used ({scan_count}/{quantity})", club_id=ticket.club_id, event_name=ticket.event_name)
         
         return VerifyResponse(
             status="used",
@@ -235,8 +258,11 @@ def ticket_to_dict(ticket: Ticket) -> dict:
     }
 
 
-def log_scan(db: Session, ticket_id, order_id, result, scanner_id, notes=None, club_id=None):
-    """IMPREZA: Добавлен параметр club_id для multitenancy"""
+def log_scan(db: Session, ticket_id, order_id, result, scanner_id, notes=None, club_id=None, event_name=None):
+    """IMPREZA: Добавлен параметр club_id для multitenancy
+    
+    ROLLUP: в той же транзакции инкрементируется scan_rollup (event_name — ключ мероприятия).
+    """
     scan = ScanHistory(
         ticket_id=ticket_id,
         order_id=order_id,
@@ -246,7 +272,9 @@ def log_scan(db: Session, ticket_id, order_id, result, scanner_id, notes=None, c
         club_id=club_id
     )
     db.add(scan)
+    record_scan(db, club_id, event_name, result)
     db.commit()
+    SCANS.labels(result).inc()
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -265,11 +293,16 @@ class LogDeniedRequest(BaseModel):
     club_id: Optional[int] = None
 
 @router.post("/log-denied")
-def log_denied_scan(request: LogDeniedRequest, db: Session = Depends(get_db)):
+@query_budget(10)
+async def log_denied_scan(request: LogDeniedRequest, db: HotSession = Depends(get_hot_db)):
     """
     Логирует denied скан БЕЗ изменения scan_count билета.
     Используется когда билет на другую дату/город.
     """
+    return await run_db(db, _log_denied, request)
+
+
+def _log_denied(db: Session, request: LogDeniedRequest) -> dict:
     # Пробуем найти билет для получения ticket_id
     ticket = db.query(Ticket).filter(Ticket.order_id == request.order_id).first()
     ticket_id = ticket.id if ticket else None
@@ -284,71 +317,95 @@ def log_denied_scan(request: LogDeniedRequest, db: Session = Depends(get_db)):
         result="denied",
         scanner_id=request.scanner_id,
         notes=notes,
-        club_id=club_id
+        club_id=club_id,
+        event_name=ticket.event_name if ticket else None
     )
     
     return {"status": "logged", "order_id": request.order_id, "reason": request.reason}
 
 
+DENIED_RESULTS = ("denied", "forged", "invalid")
+
+
 @router.get("/denied-scans")
+@query_budget(4)
 def get_denied_scans(
     club_id: Optional[int] = None,
     limit: int = 100,
+    before_time: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db),
     auth: AuthInfo = Depends(require_auth),
 ):
     """
     Получить список denied сканов для отображения в красной вкладке.
     Возвращает сканы со статусом 'denied', 'forged', 'invalid'.
+    
+    Один SELECT ... LEFT JOIN tickets (индекс ix_scan_history_denied_club_time).
+    Следующая страница — before_time/before_id из next_cursor.
+    total_count — из scan_rollup.
     """
-    query = db.query(ScanHistory).filter(
-        ScanHistory.scan_result.in_(["denied", "forged", "invalid"])
+    query = db.query(
+        ScanHistory.id,
+        ScanHistory.order_id,
+        ScanHistory.scan_result,
+        ScanHistory.notes,
+        ScanHistory.scan_time,
+        ScanHistory.club_id,
+        Ticket.id.label("ticket_found"),
+        Ticket.customer_name,
+        Ticket.customer_email,
+        Ticket.customer_phone,
+        Ticket.event_date,
+        Ticket.ticket_type,
+    ).outerjoin(Ticket, Ticket.id == ScanHistory.ticket_id).filter(
+        ScanHistory.scan_result.in_(DENIED_RESULTS)
     )
     
     if club_id:
         query = query.filter(ScanHistory.club_id == club_id)
     
-    # Сортируем по времени (новые первые)
-    query = query.order_by(ScanHistory.scan_time.desc())
+    if before_time is not None and before_id is not None:
+        query = query.filter(tuple_(ScanHistory.scan_time, ScanHistory.id) < tuple_(before_time, before_id))
+    
+    # Сортируем по времени (новые первые); id — для однозначного курсора
+    query = query.order_by(ScanHistory.scan_time.desc(), ScanHistory.id.desc())
     
     if limit:
         query = query.limit(limit)
     
-    scans = query.all()
+    rows = query.all()
     
     result = []
-    for scan in scans:
-        # Пробуем получить данные билета если есть
+    for row in rows:
+        # Данные билета, если он есть
         ticket_data = {}
-        if scan.ticket_id:
-            ticket = db.query(Ticket).filter(Ticket.id == scan.ticket_id).first()
-            if ticket:
-                ticket_data = {
-                    "name": ticket.customer_name,
-                    "email": ticket.customer_email,
-                    "phone": ticket.customer_phone,
-                    "event_date": ticket.event_date,
-                    "ticket_type": ticket.ticket_type
-                }
+        if row.ticket_found is not None:
+            ticket_data = {
+                "name": row.customer_name,
+                "email": row.customer_email,
+                "phone": row.customer_phone,
+                "event_date": row.event_date,
+                "ticket_type": row.ticket_type
+            }
         
         result.append({
-            "id": scan.id,
-            "order_id": scan.order_id or "",
-            "scan_result": scan.scan_result,
-            "notes": scan.notes or "",
-            "scanned_at": scan.scan_time.isoformat() if scan.scan_time else "",
-            "club_id": scan.club_id,
+            "id": row.id,
+            "order_id": row.order_id or "",
+            "scan_result": row.scan_result,
+            "notes": row.notes or "",
+            "scanned_at": row.scan_time.isoformat() if row.scan_time else "",
+            "club_id": row.club_id,
             **ticket_data
         })
     
-    # Также возвращаем общее количество denied
-    total_denied = db.query(ScanHistory).filter(
-        ScanHistory.scan_result.in_(["denied", "forged", "invalid"])
-    )
-    if club_id:
-        total_denied = total_denied.filter(ScanHistory.club_id == club_id)
+    next_cursor = None
+    if limit and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = {"before_time": last.scan_time.isoformat(), "before_id": last.id}
     
     return {
         "denied_scans": result,
-        "total_count": total_denied.count()
+        "total_count": rollup_total(db, DENIED_RESULTS, club_id),
+        "next_cursor": next_cursor
     }
@@ -0,0 +1,67 @@
+"""
+Правила видимости для менеджеров (visibility_rules): просмотр, удаление, компактизация.
+
+Сами правила создаются эндпоинтами скрытия/восстановления в tickets и history.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.batching import create_job, job_accepted
+from app.database import get_db
+from app.models import VisibilityRule
+from app.dependencies.auth import require_role, AuthInfo
+from app.visibility import TARGET_TICKETS, TARGET_HISTORY, compact_job, invalidate_rules, rule_to_dict
+
+router = APIRouter(prefix="/api/visibility-rules", tags=["visibility"])
+
+_TARGETS = (TARGET_TICKETS, TARGET_HISTORY)
+
+
+@router.get("/")
+def list_rules(
+    target: Optional[str] = None,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("manager")),
+):
+    """Правила от новых к старым (срабатывает первое подходящее)"""
+    query = db.query(VisibilityRule)
+    if target:
+        query = query.filter(VisibilityRule.target == target)
+    rules = query.order_by(VisibilityRule.id.desc()).all()
+    return {"rules": [rule_to_dict(r) for r in rules], "total": len(rules)}
+
+
+@router.delete("/{rule_id}")
+def delete_rule(
+    rule_id: int,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Удалить правило: строки в его scope снова подчиняются более старым правилам и флагам"""
+    rule = db.query(VisibilityRule).filter(VisibilityRule.id == rule_id).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail=f"Rule {rule_id} not found")
+    db.delete(rule)
+    db.commit()
+    invalidate_rules()
+    return {"success": True, "deleted": rule_id}
+
+
+@router.post("/compact")
+def compact_rules(
+    target: str,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    auth: AuthInfo = Depends(require_role("super")),
+):
+    """Записать итоговую видимость во флаги строк и удалить правила (фоновая задача).
+
+    Прогресс: GET /api/history/jobs/{job_id}
+    """
+    if target not in _TARGETS:
+        raise HTTPException(status_code=400, detail=f"target must be one of {_TARGETS}")
+    job_id = create_job(db, f"compact_{target}")
+    background_tasks.add_task(compact_job, job_id, target)
+    return job_accepted(job_id)
@@ -47,16 +47,32 @@ class TicketResponse(BaseModel):
     club_id: Optional[int]
     visible_to_managers: Optional[bool]
     quantity: Optional[int] = 1  # Количество персон на билете
+    archived: Optional[bool] = None  # True — билет закрытого мероприятия (tickets_archive)
     
     class Config:
         from_attributes = True
 
+class TicketTombstone(BaseModel):
+    """Билет, удалённый после watermark (для инкрементальной синхронизации)"""
+    id: int
+    order_id: str
+    deleted_at: Optional[datetime]
+
 class TicketListResponse(BaseModel):
     tickets: List[TicketResponse]
     total: int
     bought: int
     entered: int
     pending: int
+    total_persons: Optional[int] = None
+    entered_persons: Optional[int] = None
+    # SYNC: заполняются только в режиме updated_since
+    deleted: Optional[List[TicketTombstone]] = None
+    watermark: Optional[datetime] = None
+    watermark_id: Optional[int] = None  # id последней строки, пока has_more (after_id следующей страницы)
+    has_more: Optional[bool] = None
+    # Правила видимости менялись после updated_since — клиенту нужна полная перезагрузка
+    full_resync: Optional[bool] = None
 
 class VerifyRequest(BaseModel):
     qr_data: str
@@ -76,6 +92,9 @@ class StatsResponse(BaseModel):
     cancelled: int
     duplicate_attempts: int
     invalid_attempts: int
+    # Персоны: sum(quantity) и sum(least(scan_count, quantity))
+    total_persons: int = 0
+    entered_persons: int = 0
 
 class HistoryItem(BaseModel):
     id: int
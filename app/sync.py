@@ -0,0 +1,76 @@
+"""
+Инкрементальная синхронизация списков ("changed since").
+
+Клиент передаёт updated_since (watermark из предыдущего ответа) и получает
+только изменённые строки + tombstones удалённых билетов + новый watermark.
+
+Курсор составной — (watermark, watermark_id). Пока has_more, клиент
+дочитывает страницы с updated_since=watermark&after_id=watermark_id: строки
+строго после (метка, id), без перекрытия — страница из одинаковых меток не
+зацикливается. Последняя страница отдаёт watermark = время начала запроса
+и watermark_id = null: следующий цикл синхронизации идёт с перекрытием.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session
+
+from app.models import ArchivedTicket, DeletedTicket
+
+# Перекрытие окна: транзакция, начатая до нашего чтения и закоммиченная после,
+# получает updated_at < watermark. Отступаем назад, клиент дедуплицирует по id.
+SYNC_OVERLAP_SECONDS = 5
+
+
+def db_now(db: Session) -> datetime:
+    """Текущее время сервера БД (naive — как в колонках DateTime)"""
+    return db.query(func.localtimestamp()).scalar()
+
+
+def _naive(value: datetime) -> datetime:
+    return value.replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+def sync_since(updated_since: datetime) -> datetime:
+    """Нижняя граница окна с учётом перекрытия"""
+    return _naive(updated_since) - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+
+
+def sync_filter(column, id_column, updated_since: datetime, after_id: Optional[int] = None):
+    """Условие окна: продолжение страниц — строго после (метка, id),
+    новый цикл — от watermark с перекрытием"""
+    if after_id is not None:
+        return tuple_(column, id_column) > tuple_(_naive(updated_since), after_id)
+    return column >= sync_since(updated_since)
+
+
+def next_watermark(
+    rows: list, limit: int, column: str, started_at: datetime
+) -> tuple[datetime, Optional[int], bool]:
+    """Новый курсор (watermark, watermark_id) и флаг has_more.
+
+    Если выдача упёрлась в limit — курсор = (метка, id) последней строки
+    (клиент дочитывает следующей страницей с after_id), иначе — время
+    начала запроса без id.
+    """
+    if limit and len(rows) >= limit:
+        return getattr(rows[-1], column), rows[-1].id, True
+    return started_at, None, False
+
+
+def get_tombstones(db: Session, since: datetime, club_id: Optional[int] = None) -> list[dict]:
+    """Tombstones: билеты, ушедшие из tickets после since —
+    удалённые (deleted_tickets) и закрытых мероприятий (tickets_archive)"""
+    tombstones = []
+    for model, moved_at in ((DeletedTicket, DeletedTicket.deleted_at), (ArchivedTicket, ArchivedTicket.archived_at)):
+        query = db.query(model.original_id, model.order_id, moved_at.label("deleted_at")).filter(moved_at >= since)
+        if club_id:
+            query = query.filter(model.club_id == club_id)
+        tombstones.extend(
+            {"id": row.original_id, "order_id": row.order_id, "deleted_at": row.deleted_at}
+            for row in query.all()
+        )
+
+    tombstones.sort(key=lambda t: t["deleted_at"])
+    return tombstones
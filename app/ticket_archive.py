@@ -0,0 +1,236 @@
+"""
+Перенос билетов между tickets и таблицами-копиями (deleted_tickets, tickets_archive).
+
+Всё — множествами, без циклов по строкам:
+  - move_into          — WITH moved AS (DELETE FROM tickets ... RETURNING)
+                         INSERT INTO <копия> SELECT ... FROM moved
+  - restore_to_tickets — INSERT INTO tickets SELECT ... FROM <копия> ON CONFLICT DO NOTHING
+                         + DELETE ... RETURNING из копии + список конфликтов
+  - close_event / reopen_event — "мероприятие закрыто": tickets ⇄ tickets_archive
+"""
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, aliased
+
+from app.models import ArchivedTicket, ScanHistory, Ticket
+
+# Поля, копируемые один в один (id/created_at/updated_at → original_*)
+SNAPSHOT_FIELDS = (
+    "order_id", "transaction_id", "customer_name", "customer_email", "customer_phone",
+    "ticket_type", "event_date", "event_name", "price", "subtotal", "discount",
+    "payment_amount", "promocode", "qr_token", "qr_signature", "country_code",
+    "city_name", "club_id", "visible_to_managers", "quantity", "status", "scan_count",
+    "first_scan_at", "last_scan_at", "scanned_by", "telegram_message_id",
+)
+
+
+def move_into(db: Session, target, ticket_ids: list, **extra) -> int:
+    """Переносит билеты ticket_ids из tickets в target одним запросом. Не коммитит.
+
+    Удаляются и копируются одни и те же строки (DELETE ... RETURNING):
+    билет не может быть удалён, не попав в копию.
+    extra — значения служебных колонок target (deleted_by, archive_reason, ...).
+    """
+    columns = ["original_id", *SNAPSHOT_FIELDS, "original_created_at", "original_updated_at", *extra]
+    moved = (
+        delete(Ticket)
+        .where(Ticket.id.in_(ticket_ids))
+        .returning(Ticket.id, *[getattr(Ticket, field) for field in SNAPSHOT_FIELDS], Ticket.created_at, Ticket.updated_at)
+        .cte("moved")
+    )
+    source = select(
+        moved.c.id,
+        *[moved.c[field] for field in SNAPSHOT_FIELDS],
+        moved.c.created_at,
+        moved.c.updated_at,
+        *[literal(value) for value in extra.values()],
+    )
+    return db.execute(insert(target).from_select(columns, source)).rowcount
+
+
+def restore_to_tickets(db: Session, source, filters: list, keep_identity: bool = False) -> tuple[list[dict], list[dict]]:
+    """Возвращает строки source WHERE filters в tickets. Не коммитит.
+
+    Один INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING и один
+    DELETE ... RETURNING. Если в source несколько копий одного order_id —
+    берётся последняя. keep_identity — вернуть прежние id и created_at
+    (для tickets_archive: id никогда не переиспользуются последовательностью).
+
+    Возвращает (restored, conflicts):
+      restored  — [{source_id, ticket_id, order_id}]
+      conflicts — [{source_id, order_id, reason, existing_ticket_id}]
+    """
+    # correlate(None): подзапрос по той же таблице, что и внешний SELECT/DELETE —
+    # без этого SQLAlchemy скоррелирует его с внешней строкой
+    latest = (
+        select(source.id)
+        .where(*filters)
+        .distinct(source.order_id)
+        .order_by(source.order_id, source.id.desc())
+        .correlate(None)
+    )
+
+    columns = list(SNAPSHOT_FIELDS)
+    values = [getattr(source, field) for field in SNAPSHOT_FIELDS]
+    if keep_identity:
+        columns += ["id", "created_at"]
+        values += [source.original_id, func.coalesce(source.original_created_at, func.now())]
+
+    inserted = db.execute(
+        insert(Ticket)
+        .from_select(columns, select(*values).where(source.id.in_(latest)))
+        # Без конкретного ключа: кроме order_id уникален и qr_token
+        .on_conflict_do_nothing()
+        .returning(Ticket.id, Ticket.order_id)
+    ).all()
+    ticket_ids = {row.order_id: row.id for row in inserted}
+
+    removed = []
+    if ticket_ids:
+        removed = db.execute(
+            delete(source)
+            .where(source.id.in_(latest), source.order_id.in_(list(ticket_ids)))
+            .returning(source.id, source.order_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+    restored = [
+        {"source_id": row.id, "ticket_id": ticket_ids[row.order_id], "order_id": row.order_id}
+        for row in removed
+    ]
+
+    # Всё, что подходило под фильтр, но осталось в source
+    by_order = aliased(Ticket)
+    by_token = aliased(Ticket)
+    remaining = list(filters)
+    if restored:
+        remaining.append(source.id.notin_([r["source_id"] for r in restored]))
+    leftovers = db.execute(
+        select(source.id, source.order_id, by_order.id.label("order_ticket"), by_token.id.label("token_ticket"))
+        .outerjoin(by_order, by_order.order_id == source.order_id)
+        .outerjoin(by_token, and_(source.qr_token.isnot(None), by_token.qr_token == source.qr_token))
+        .where(*remaining)
+        .order_by(source.id)
+    ).all()
+
+    conflicts = []
+    for row in leftovers:
+        if row.order_ticket is not None:
+            reason = "order_id_exists"
+        elif row.token_ticket is not None:
+            reason = "qr_token_exists"
+        else:
+            # Старшая копия того же order_id (восстановлена более новая)
+            reason = "duplicate_copy"
+        conflicts.append({
+            "source_id": row.id,
+            "order_id": row.order_id,
+            "reason": reason,
+            "existing_ticket_id": row.order_ticket or row.token_ticket,
+        })
+    return restored, conflicts
+
+
+# ─── Закрытие мероприятия ───
+
+def close_event(db: Session, event_name: str, club_id: Optional[int] = None,
+                archived_by: Optional[str] = None) -> dict:
+    """Переносит билеты мероприятия в tickets_archive (со статусом и счётчиками
+    сканирования). scan_history остаётся, ticket_id обнуляется. Не коммитит.
+
+    Набор билетов фиксируется один раз (SELECT ... FOR UPDATE): продажа,
+    закоммиченная во время закрытия, остаётся в tickets, а не удаляется
+    мимо архива.
+    """
+    filters = [Ticket.event_name == event_name]
+    if club_id:
+        filters.append(Ticket.club_id == club_id)
+
+    ids = db.execute(select(Ticket.id).where(*filters).with_for_update()).scalars().all()
+    if not ids:
+        return {"archived": 0, "scans_unlinked": 0}
+
+    # До переноса: FK scan_history → tickets
+    unlinked = db.execute(
+        update(ScanHistory).where(ScanHistory.ticket_id.in_(ids)).values(ticket_id=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    archived = move_into(
+        db, ArchivedTicket, ids,
+        archived_by=archived_by,
+        archive_reason=f"Мероприятие закрыто: {event_name}",
+    )
+    return {"archived": archived, "scans_unlinked": unlinked}
+
+
+def reopen_event(db: Session, event_name: str, club_id: Optional[int] = None) -> dict:
+    """Возвращает билеты мероприятия из tickets_archive с прежними id
+    и перепривязывает их scan_history. Не коммитит."""
+    filters = [ArchivedTicket.event_name == event_name]
+    if club_id:
+        filters.append(ArchivedTicket.club_id == club_id)
+
+    restored, conflicts = restore_to_tickets(db, ArchivedTicket, filters, keep_identity=True)
+    relinked = 0
+    if restored:
+        relinked = db.execute(
+            update(ScanHistory)
+            .where(
+                ScanHistory.ticket_id.is_(None),
+                ScanHistory.order_id == Ticket.order_id,
+                Ticket.id.in_([r["ticket_id"] for r in restored]),
+            )
+            .values(ticket_id=Ticket.id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    return {"restored": len(restored), "scans_relinked": relinked, "conflicts": conflicts}
+
+
+def closable_events(db: Session, idle_days: int = 14, club_id: Optional[int] = None) -> list[dict]:
+    """Мероприятия без продаж и сканов последние idle_days дней — кандидаты на закрытие"""
+    last_activity = func.greatest(func.max(Ticket.created_at), func.max(Ticket.last_scan_at))
+    query = db.query(
+        Ticket.event_name,
+        func.count(Ticket.id).label("tickets"),
+        last_activity.label("last_activity"),
+    ).filter(Ticket.event_name.isnot(None))
+    if club_id:
+        query = query.filter(Ticket.club_id == club_id)
+    rows = query.group_by(Ticket.event_name).having(
+        last_activity < func.localtimestamp() - func.make_interval(0, 0, 0, idle_days)
+    ).order_by(last_activity).all()
+    return [
+        {"event_name": row.event_name, "tickets": row.tickets, "last_activity": str(row.last_activity)}
+        for row in rows
+    ]
+
+
+def archived_to_dict(ticket: ArchivedTicket) -> dict:
+    """Архивный билет в форме TicketResponse (id — прежний id билета)"""
+    return {
+        "id": ticket.original_id,
+        "order_id": ticket.order_id,
+        "customer_name": ticket.customer_name,
+        "customer_email": ticket.customer_email,
+        "customer_phone": ticket.customer_phone,
+        "ticket_type": ticket.ticket_type or "Standard",
+        "event_date": ticket.event_date,
+        "event_name": ticket.event_name,
+        "price": ticket.price or 0,
+        "subtotal": ticket.subtotal,
+        "promocode": ticket.promocode,
+        "status": ticket.status or "valid",
+        "scan_count": ticket.scan_count or 0,
+        "first_scan_at": ticket.first_scan_at,
+        "qr_token": ticket.qr_token,
+        "qr_signature": ticket.qr_signature,
+        "created_at": ticket.original_created_at or ticket.archived_at,
+        "city_name": ticket.city_name,
+        "country_code": ticket.country_code,
+        "club_id": ticket.club_id,
+        "visible_to_managers": ticket.visible_to_managers,
+        "quantity": ticket.quantity,
+        "archived": True,
+    }
@@ -0,0 +1,31 @@
+"""
+Полуоткрытые временные диапазоны [start, end) для фильтров по scan_time.
+
+func.date(scan_time) == today оборачивает колонку в функцию и не даёт
+использовать индекс. Вместо этого считаем границы суток площадки
+(VENUE_TIMEZONE) и переводим их в пояс, в котором БД пишет naive TIMESTAMP.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from app.config import settings
+
+
+def _to_db_naive(moment: datetime) -> datetime:
+    return moment.astimezone(ZoneInfo(settings.DB_TIMEZONE)).replace(tzinfo=None)
+
+
+def venue_today() -> date:
+    """Текущая дата по часовому поясу площадки"""
+    return datetime.now(ZoneInfo(settings.VENUE_TIMEZONE)).date()
+
+
+def day_range(day: Optional[date] = None, days: int = 1) -> tuple[datetime, datetime]:
+    """Границы [start, end) суток площадки в naive-времени БД"""
+    venue_tz = ZoneInfo(settings.VENUE_TIMEZONE)
+    day = day or venue_today()
+    start = datetime.combine(day, time.min, tzinfo=venue_tz)
+    end = datetime.combine(day + timedelta(days=days), time.min, tzinfo=venue_tz)
+    return _to_db_naive(start), _to_db_naive(end)
+
@@ -0,0 +1,336 @@
+"""
+Видимость для менеджеров через правила (visibility_rules).
+
+Скрытие мероприятия — одна вставка правила, а не UPDATE тысяч строк.
+Набор правил маленький и кэшируется; из него собирается SQL-выражение
+CASE WHEN <правило N> THEN ... WHEN <правило N-1> ... ELSE <старый флаг> END,
+которое read-пути используют в WHERE. Без правил выражение вырождается
+в прежний фильтр по флагу (и его индекс).
+
+Правило действует только на строки, существовавшие при его создании
+(id <= max_row_id): скрытие клуба или мероприятия не прячет билеты,
+проданные позже, — как раньше UPDATE менял только уже записанные строки.
+Билеты закрытых мероприятий (tickets_archive) проверяются по тем же
+правилам, по прежнему id (original_id).
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import and_, case, delete, false, func, literal, not_, true
+from sqlalchemy.orm import Session
+
+from app.batching import batched_update, run_job
+from app.cache import TTLCache
+from app.database import SessionLocal, on_primary, statement_class
+from app.models import ArchivedTicket, BatchJob, Ticket, ScanHistory, VisibilityRule
+
+logger = logging.getLogger("impreza.security")
+
+TARGET_TICKETS = "tickets"
+TARGET_HISTORY = "history"
+
+SCOPE_FIELDS = ("club_id", "city_name", "country_code", "event_name", "start_at", "end_at", "ticket_ids")
+
+# Короткий TTL: правило, созданное в другом воркере, подхватывается за секунды
+rules_cache = TTLCache("visibility_rules", ttl=5, maxsize=4)
+
+
+def _rule_snapshot(rule: VisibilityRule) -> dict:
+    return {"id": rule.id, "effect": rule.effect, "max_row_id": rule.max_row_id,
+            **{f: getattr(rule, f) for f in SCOPE_FIELDS}}
+
+
+def load_rules(db: Session, target: str) -> list[dict]:
+    """Правила target в порядке от новых к старым (снимки, не ORM-объекты)"""
+
+    def _load():
+        # Кэш общий для воркера — только из primary, даже если db читает реплику
+        with on_primary():
+            rows = db.query(VisibilityRule).filter(
+                VisibilityRule.target == target
+            ).order_by(VisibilityRule.id.desc()).all()
+        return [_rule_snapshot(r) for r in rows]
+
+    return rules_cache.get_or_set(target, _load)
+
+
+# ─── SQL ───
+
+def _ticket_match(rule: dict, model=Ticket):
+    """model — Ticket или ArchivedTicket (прежние id и created_at — в original_*)"""
+    row_id = model.original_id if model is ArchivedTicket else model.id
+    created_at = model.original_created_at if model is ArchivedTicket else model.created_at
+    conditions = []
+    if rule.get("max_row_id") is not None:
+        conditions.append(row_id <= rule["max_row_id"])
+    if rule["club_id"] is not None:
+        conditions.append(model.club_id == rule["club_id"])
+    if rule["city_name"]:
+        conditions.append(model.city_name == rule["city_name"])
+    if rule["country_code"]:
+        conditions.append(model.country_code == rule["country_code"])
+    if rule["event_name"]:
+        conditions.append(model.event_name == rule["event_name"])
+    if rule["start_at"]:
+        conditions.append(created_at >= rule["start_at"])
+    if rule["end_at"]:
+        conditions.append(created_at < rule["end_at"])
+    if rule["ticket_ids"]:
+        conditions.append(row_id.in_(rule["ticket_ids"]))
+    return and_(true(), *conditions)
+
+
+def _archived_match(rule: dict):
+    return _ticket_match(rule, ArchivedTicket)
+
+
+def _history_match(rule: dict):
+    conditions = []
+    if rule.get("max_row_id") is not None:
+        conditions.append(ScanHistory.id <= rule["max_row_id"])
+    if rule["club_id"] is not None:
+        conditions.append(ScanHistory.club_id == rule["club_id"])
+    if rule["start_at"]:
+        conditions.append(ScanHistory.scan_time >= rule["start_at"])
+    if rule["end_at"]:
+        conditions.append(ScanHistory.scan_time < rule["end_at"])
+    if rule["ticket_ids"]:
+        conditions.append(ScanHistory.ticket_id.in_(rule["ticket_ids"]))
+    return and_(true(), *conditions)
+
+
+def _is_global(rule: dict) -> bool:
+    return all(not rule[field] and rule[field] != 0 for field in SCOPE_FIELDS)
+
+
+def _visible_expr(rules: list[dict], match, default):
+    branches = []
+    for rule in rules:
+        if _is_global(rule) and rule.get("max_row_id") is None:
+            # Правило без scope и без границы (создано до max_row_id) перекрывает всё
+            default = true() if rule["effect"] == "show" else false()
+            break
+        branches.append((match(rule), literal(rule["effect"] == "show")))
+        if _is_global(rule):
+            # Более старые правила покрывают только строки до их границы — не дальше этой
+            break
+    if not branches:
+        return default
+    return case(*branches, else_=default)
+
+
+def ticket_visible(db: Session):
+    """SQL-условие "билет виден менеджерам" """
+    return _visible_expr(load_rules(db, TARGET_TICKETS), _ticket_match, Ticket.visible_to_managers == True)
+
+
+def history_visible(db: Session):
+    """SQL-условие "запись истории видна менеджерам" """
+    return _visible_expr(load_rules(db, TARGET_HISTORY), _history_match, ScanHistory.hidden_for_manager == False)
+
+
+def ticket_hidden(db: Session):
+    return not_(ticket_visible(db))
+
+
+def archived_ticket_visible(db: Session):
+    """SQL-условие "архивный билет виден менеджерам" — те же правила, что у tickets"""
+    return _visible_expr(load_rules(db, TARGET_TICKETS), _archived_match, ArchivedTicket.visible_to_managers == True)
+
+
+# ─── Python (для уже загруженного билета: verify, ответы API) ───
+
+def _ticket_matches(rule: dict, ticket) -> bool:
+    """ticket — Ticket или ArchivedTicket"""
+    archived = isinstance(ticket, ArchivedTicket)
+    row_id = ticket.original_id if archived else ticket.id
+    created_at = ticket.original_created_at if archived else ticket.created_at
+    if rule.get("max_row_id") is not None and (row_id is None or row_id > rule["max_row_id"]):
+        return False
+    if rule["club_id"] is not None and ticket.club_id != rule["club_id"]:
+        return False
+    if rule["city_name"] and ticket.city_name != rule["city_name"]:
+        return False
+    if rule["country_code"] and ticket.country_code != rule["country_code"]:
+        return False
+    if rule["event_name"] and ticket.event_name != rule["event_name"]:
+        return False
+    if rule["start_at"] and (created_at is None or created_at < rule["start_at"]):
+        return False
+    if rule["end_at"] and (created_at is None or created_at >= rule["end_at"]):
+        return False
+    if rule["ticket_ids"] and row_id not in rule["ticket_ids"]:
+        return False
+    return True
+
+
+def is_ticket_visible(db: Session, ticket) -> bool:
+    for rule in load_rules(db, TARGET_TICKETS):
+        if _ticket_matches(rule, ticket):
+            return rule["effect"] == "show"
+    return ticket.visible_to_managers != False
+
+
+# ─── Изменение правил ───
+
+def _scope(**scope) -> dict:
+    return {field: scope.get(field) or None for field in SCOPE_FIELDS}
+
+
+def _exact_scope(scope: dict) -> list:
+    return [
+        getattr(VisibilityRule, field).is_(None) if value is None else getattr(VisibilityRule, field) == value
+        for field, value in scope.items()
+    ]
+
+
+def max_row_id(db: Session, target: str) -> int:
+    """Граница нового правила: старший id строк target на этот момент.
+
+    Для билетов учитывается и tickets_archive — закрытое мероприятие
+    могло содержать самые новые билеты.
+    """
+    if target == TARGET_TICKETS:
+        return db.query(func.greatest(
+            db.query(func.max(Ticket.id)).scalar_subquery(),
+            db.query(func.max(ArchivedTicket.original_id)).scalar_subquery(),
+        )).scalar() or 0
+    return db.query(func.max(ScanHistory.id)).scalar() or 0
+
+
+def add_rule(db: Session, target: str, effect: str, created_by: Optional[str] = None, **scope) -> VisibilityRule:
+    """Добавляет правило. Не коммитит.
+
+    Правило действует на строки с id <= max_row_id на момент создания.
+    Правила с ровно таким же scope перекрыты новым — удаляются сразу,
+    чтобы набор правил не рос. Правило без scope перекрывает все правила target
+    (их границы не больше его собственной).
+    """
+    scope = _scope(**scope)
+    if (scope["start_at"] is None) != (scope["end_at"] is None):
+        raise ValueError("Date range must have both start and end")
+    stale = [VisibilityRule.target == target]
+    if any(value is not None for value in scope.values()):
+        stale.extend(_exact_scope(scope))
+    db.execute(delete(VisibilityRule).where(*stale).execution_options(synchronize_session=False))
+
+    rule = VisibilityRule(target=target, effect=effect, created_by=created_by,
+                          max_row_id=max_row_id(db, target), **scope)
+    db.add(rule)
+    return rule
+
+
+def unhide(db: Session, target: str, created_by: Optional[str] = None, **scope) -> VisibilityRule:
+    """Снимает скрытие для scope (вместе со старыми флагами в строках). Не коммитит.
+
+    Всегда одна вставка правила show — в том числе чтобы изменение было
+    видно инкрементальной синхронизации по created_at.
+    """
+    return add_rule(db, target, "show", created_by=created_by, **scope)
+
+
+def rules_changed_since(db: Session, target: str, since) -> bool:
+    """Было ли изменение правил после since (для updated_since-синхронизации)"""
+    return db.query(VisibilityRule.id).filter(
+        VisibilityRule.target == target,
+        VisibilityRule.created_at >= since,
+    ).first() is not None
+
+
+def set_tickets_visibility(db: Session, tickets: list, visible: bool, created_by: Optional[str] = None) -> int:
+    """Точечное скрытие/показ конкретных билетов. Не коммитит.
+
+    Пишется флаг в строке (это ограниченный список id); если билет
+    при этом перекрыт правилом с противоположным эффектом — добавляется
+    одно правило на все такие билеты.
+    """
+    rules = load_rules(db, TARGET_TICKETS)
+    overridden = []
+    for ticket in tickets:
+        ticket.visible_to_managers = visible
+        for rule in rules:
+            if _ticket_matches(rule, ticket):
+                if (rule["effect"] == "show") != visible:
+                    overridden.append(ticket.id)
+                break
+
+    if overridden:
+        add_rule(db, TARGET_TICKETS, "show" if visible else "hide", created_by=created_by, ticket_ids=overridden)
+    return len(tickets)
+
+
+# ─── Компактизация: правила → флаги строк ───
+
+def compact_job(job_id: str, target: str):
+    """Тело BackgroundTasks: записывает итоговую видимость во флаги строк
+    пакетами (app/batching.py) и удаляет учтённые правила.
+
+    Правила, добавленные во время прохода, новее снимка и остаются.
+    """
+    db = SessionLocal()
+    try:
+        rules = [
+            _rule_snapshot(r)
+            for r in db.query(VisibilityRule).filter(
+                VisibilityRule.target == target
+            ).order_by(VisibilityRule.id.desc()).all()
+        ]
+        db.commit()
+    finally:
+        db.close()
+
+    if target == TARGET_TICKETS:
+        model, column = Ticket, Ticket.visible_to_managers
+        value = _visible_expr(rules, _ticket_match, Ticket.visible_to_managers == True)
+    else:
+        model, column = ScanHistory, ScanHistory.hidden_for_manager
+        value = not_(_visible_expr(rules, _history_match, ScanHistory.hidden_for_manager == False))
+
+    run_job(job_id, model, [column.is_distinct_from(value)], {column.key: value})
+
+    db = SessionLocal()
+    try:
+        job = db.query(BatchJob).filter(BatchJob.id == job_id).first()
+        if rules and job is not None and job.status == "done" and target == TARGET_TICKETS:
+            # Архивные билеты тоже подчиняются правилам — без их флагов
+            # удаление правил вернуло бы закрытым мероприятиям старую видимость
+            archived_value = _visible_expr(rules, _archived_match, ArchivedTicket.visible_to_managers == True)
+            try:
+                with statement_class("batch"):
+                    batched_update(ArchivedTicket, [ArchivedTicket.visible_to_managers.is_distinct_from(archived_value)],
+                                   {"visible_to_managers": archived_value})
+            except Exception as e:
+                logger.error("Visibility compaction of tickets_archive failed, rules kept: %s", e)
+                return
+        if rules and job is not None and job.status == "done":
+            db.execute(
+                delete(VisibilityRule).where(VisibilityRule.id.in_([r["id"] for r in rules]))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            invalidate_rules()
+    finally:
+        db.close()
+
+
+def invalidate_rules():
+    """Вызывать после commit изменений правил"""
+    rules_cache.bump()
+
+
+def rule_to_dict(rule: VisibilityRule) -> dict:
+    return {
+        "id": rule.id,
+        "target": rule.target,
+        "effect": rule.effect,
+        "club_id": rule.club_id,
+        "city_name": rule.city_name,
+        "country_code": rule.country_code,
+        "event_name": rule.event_name,
+        "start_at": rule.start_at.isoformat() if rule.start_at else None,
+        "end_at": rule.end_at.isoformat() if rule.end_at else None,
+        "ticket_ids": rule.ticket_ids,
+        "max_row_id": rule.max_row_id,
+        "created_at": str(rule.created_at) if rule.created_at else None,
+        "created_by": rule.created_by,
+    }
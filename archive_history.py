@@ -0,0 +1,75 @@
+"""
+Холодный архив scan_history / deleted_tickets (app/archive.py).
+
+Запуск:
+    python archive_history.py detached                    # все отцеплённые месячные партиции
+    python archive_history.py partition scan_history_p202501
+    python archive_history.py range 2025-01-01 2025-03-31 [club_id]
+    python archive_history.py deleted-tickets 2025-01-01  # удалённые до даты
+
+Файлы пишутся в ARCHIVE_URL (каталог или s3://bucket/prefix), формат — ARCHIVE_FORMAT.
+"""
+
+import os
+import sys
+from datetime import datetime
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import engine, Base, SessionLocal
+from app.archive import archive_partition, archive_range, segment_to_dict
+from app.partitions import detached_partitions
+from app.timerange import day_range
+
+
+def _day(value: str):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _report(result):
+    if not result:
+        print("ℹ️  Нет строк для архивации")
+        return
+    print(f"✅ {result['row_count']} строк → {result['uri']} ({result['size_bytes']} байт)")
+
+
+def run(args: list[str]):
+    # Таблица манифеста могла ещё не существовать
+    Base.metadata.create_all(bind=engine)
+    command = args[0] if args else ""
+
+    if command == "detached":
+        with engine.connect() as conn:
+            pending = detached_partitions(conn)
+        if not pending:
+            print("ℹ️  Отцеплённых партиций нет")
+        for partition in pending:
+            print(f"📦 {partition['name']} (~{partition['approx_rows']} строк)")
+            _report(archive_partition(partition["name"], created_by="cli"))
+
+    elif command == "partition" and len(args) > 1:
+        _report(archive_partition(args[1], created_by="cli"))
+
+    elif (command == "range" and len(args) > 2) or (command == "deleted-tickets" and len(args) > 1):
+        if command == "range":
+            start = day_range(_day(args[1]))[0]
+            end = day_range(_day(args[2]))[1]
+            table, club_id = "scan_history", int(args[3]) if len(args) > 3 else None
+        else:
+            start, end = datetime(1970, 1, 1), day_range(_day(args[1]))[0]
+            table, club_id = "deleted_tickets", None
+
+        db = SessionLocal()
+        try:
+            segment = archive_range(db, table, start, end, club_id=club_id, created_by="cli")
+            _report(segment_to_dict(segment) if segment else None)
+        finally:
+            db.close()
+
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
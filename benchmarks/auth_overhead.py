@@ -0,0 +1,90 @@
+"""
+Микробенчмарк: накладные расходы авторизации на один запрос.
+
+Запуск:
+    python benchmarks/auth_overhead.py            # 20000 итераций
+    python benchmarks/auth_overhead.py 100000
+
+Сравнивает:
+  - decode      — прежний путь: jwt.decode + JWT_MIN_IAT + сборка AuthInfo
+  - cached      — _auth_from_token при прогретом кэше
+  - dependency  — require_auth целиком (Request + bearer), с кэшем и без
+БД не нужна.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+from fastapi.security import HTTPAuthorizationCredentials
+from starlette.requests import Request
+
+from app.config import settings
+from app.dependencies.auth import (
+    JWT_ALGORITHM, AuthInfo, _auth_from_token, _decode_jwt, require_auth, token_cache,
+)
+
+
+def _token() -> str:
+    now = datetime.now(timezone.utc)
+    payload = {
+        "club_id": 1, "role": "scanner", "name": "Krakow", "city_english": "Krakow",
+        "allowed_countries": ["PL"], "iat": now, "exp": now + timedelta(hours=24),
+    }
+    return jwt.encode(payload, settings.API_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def _decode_uncached(token: str) -> AuthInfo:
+    payload = _decode_jwt(token)
+    return AuthInfo(
+        auth_type="jwt",
+        role=payload.get("role", "observer"),
+        name=payload.get("name"),
+        allowed_countries=payload.get("allowed_countries"),
+        club_id=payload.get("club_id"),
+    )
+
+
+def _per_call_us(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def _dependency_us(token: str, n: int, cached: bool) -> float:
+    request = Request({"type": "http", "method": "GET", "path": "/api/verify", "headers": [],
+                       "client": ("127.0.0.1", 0)})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    start = time.perf_counter()
+    for _ in range(n):
+        if not cached:
+            token_cache.clear()
+        await require_auth(request, credentials)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def run(n: int):
+    token = _token()
+    _auth_from_token(token)  # прогрев кэша
+
+    results = {
+        "decode": _per_call_us(lambda: _decode_uncached(token), n),
+        "cached": _per_call_us(lambda: _auth_from_token(token), n),
+        "dependency (no cache)": asyncio.run(_dependency_us(token, n, cached=False)),
+        "dependency (cache)": asyncio.run(_dependency_us(token, n, cached=True)),
+    }
+    print(f"📊 Авторизация, {n} итераций, мкс на вызов:")
+    for name, value in results.items():
+        print(f"  {name:<22} {value:8.2f}")
+    print(f"  ускорение dependency:  x{results['dependency (no cache)'] / results['dependency (cache)']:.1f}")
+    print(f"  {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,362 @@
+"""
+Синтетический датасет для проверки на объёмах прода (1M билетов, 10M сканов).
+
+Запуск:
+    python benchmarks/generate_dataset.py --tickets 1000000 --scans 10000000 --workers 8
+    python benchmarks/generate_dataset.py --seed 7 --anchor 2026-06-01     # воспроизводимо
+    python benchmarks/generate_dataset.py clean --seed 7                    # удалить датасет
+
+Что генерируется (order_id = gen<seed>-<n>, удалённые — gen<seed>-d<n>):
+  - мероприятия: субботы клубов за --days-back дней до --anchor и
+    --days-ahead после; популярность мероприятий сильно неравномерная;
+  - tickets: event_date в форматах D.M / DD.MM, как пишет бот; quantity
+    (в основном 1, иногда 2–6), промокоды со скидкой, ~3% скрыто от
+    менеджеров, ~2% отменено; статус и scan_count согласованы со сканами;
+  - scan_history: входы на прошедшие мероприятия (valid по числу
+    quantity) плюс duplicate / denied / invalid / forged, в среднем
+    --scans / --tickets сканов на билет;
+  - deleted_tickets: --deleted снимков удалённых билетов;
+  - scan_rollup пересчитывается из scan_history (--no-rollup — пропустить).
+
+Загрузка — COPY в --workers процессах, шардами по --shard-size билетов.
+Содержимое шарда зависит только от --seed, --anchor, --shard-size и номера
+шарда, поэтому датасет одинаков при любом числе воркеров (id сканов — из
+sequence, их порядок может отличаться).
+"""
+
+import argparse
+import bisect
+import csv
+import io
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.database import SessionLocal, get_direct_engine
+from app.migrations import migrate
+from app.partitions import ensure_partitions
+from app.revenue import bump_revenue_version
+from app.rollup import rebuild_rollup
+from app.security import generate_signature
+from benchmarks.seed import delete_by_prefix, load_clubs
+
+TICKET_COLUMNS = (
+    "id", "order_id", "transaction_id", "customer_name", "customer_email", "customer_phone",
+    "ticket_type", "event_date", "event_name", "price", "subtotal", "discount", "payment_amount",
+    "promocode", "qr_token", "qr_signature", "country_code", "city_name", "club_id",
+    "visible_to_managers", "quantity", "status", "scan_count", "first_scan_at", "last_scan_at",
+    "scanned_by", "created_at", "updated_at",
+)
+SCAN_COLUMNS = (
+    "ticket_id", "order_id", "club_id", "hidden_for_manager", "scan_time", "scan_result",
+    "scanner_id", "notes",
+)
+DELETED_COLUMNS = TICKET_COLUMNS[1:] + (
+    "original_id", "original_created_at", "original_updated_at", "deleted_at", "deleted_by", "delete_reason",
+)
+
+EVENT_SERIES = ["IMPREZA", "IMPREZA Party", "AURA Night", "Студенческая вечеринка", "MEET AND GREET", "Halloween"]
+TICKET_TYPES = [("Standard", 60, 70), ("VIP", 150, 10), ("Early Bird", 45, 15), ("Table", 400, 5)]
+PROMOCODES = ["IMPREZA10", "STUDENT", "AURA15", "FRIENDS", "VIP20"]
+FIRST_NAMES = ["Анна", "Мария", "Иван", "Дмитрий", "Olga", "Katarzyna", "Piotr", "Anna", "Max", "Sofia",
+               "Алексей", "Юлия", "Tomasz", "Elena", "Nikita", "Daria"]
+LAST_NAMES = ["Иванова", "Петров", "Smirnova", "Kowalski", "Nowak", "Müller", "Сидоренко", "Wiśniewska",
+              "Kuznetsov", "Bondarenko", "Schmidt", "Popova"]
+EXTRA_SCAN_RESULTS = (["duplicate", "denied", "invalid", "forged"], [60, 25, 10, 5])
+DENIED_NOTES = ["wrong_date: QR={}, Filter={}", "wrong_city: QR={}, Filter={}"]
+DELETED_BY = ["super", "admin", "manager", "loadtest"]
+DELETE_REASONS = ["Возврат", "Дубль заказа", "Тестовый заказ", None]
+
+_plan: dict = {}
+
+
+# ─── План: мероприятия и параметры, общие для всех воркеров ───
+
+def plan_events(clubs: list, rng: random.Random, anchor: date, days_back: int, days_ahead: int) -> list:
+    """[(club_id, city, country, day, event_name)] — субботы, клуб участвует
+    примерно в половине; популярность (вес) — по Парето"""
+    first = anchor - timedelta(days=days_back)
+    first += timedelta(days=(5 - first.weekday()) % 7)
+    events = []
+    day = first
+    while day <= anchor + timedelta(days=days_ahead):
+        for club_id, city, country in clubs:
+            if rng.random() < 0.5:
+                events.append((club_id, city, country, day, f"{rng.choice(EVENT_SERIES)} {city}",
+                               rng.paretovariate(1.3)))
+        day += timedelta(days=7)
+    return events
+
+
+def make_plan(args, clubs: list, id_offset: int) -> dict:
+    rng = random.Random(args.seed)
+    anchor = args.anchor
+    events = plan_events(clubs, rng, anchor, args.days_back, args.days_ahead)
+    cum_weights, total = [], 0.0
+    for event in events:
+        total += event[5]
+        cum_weights.append(total)
+    past_share = sum(e[5] for e in events if e[3] < anchor) / total
+    return {
+        "url": settings.DATABASE_DIRECT_URL or settings.DATABASE_URL,
+        "seed": args.seed,
+        "prefix": f"gen{args.seed}-",
+        "anchor": anchor,
+        "tickets": args.tickets,
+        "deleted": args.deleted,
+        "shard_size": args.shard_size,
+        "id_offset": id_offset,
+        "events": [e[:5] for e in events],
+        "cum_weights": cum_weights,
+        # Сверх входов (quantity) — столько «лишних» сканов на билет прошедшего мероприятия
+        "extra_scans": max(args.scans / max(args.tickets, 1) / max(past_share, 0.01) - 1.1, 0.05),
+    }
+
+
+# ─── Генерация строк ───
+
+def _event_date(rng: random.Random, day: date) -> str:
+    # Бот пишет D.M без ведущих нулей, старые заказы — DD.MM
+    return f"{day.day}.{day.month}" if rng.random() < 0.8 else f"{day:%d.%m}"
+
+
+def _ticket(rng: random.Random, plan: dict, order_id: str, ticket_id: int) -> tuple[dict, list]:
+    """Строка tickets и её сканы"""
+    point = rng.random() * plan["cum_weights"][-1]
+    club_id, city, country, day, event_name = plan["events"][bisect.bisect_left(plan["cum_weights"], point)]
+    starts_at = datetime.combine(day, datetime.min.time()) + timedelta(hours=22)
+    anchor_at = datetime.combine(plan["anchor"], datetime.min.time())
+
+    ticket_type, base_price = rng.choices([t[:2] for t in TICKET_TYPES], [t[2] for t in TICKET_TYPES])[0]
+    roll = rng.random()
+    quantity = 1 if roll < 0.9 else 2 if roll < 0.97 else rng.randint(3, 6)
+    subtotal = float(base_price * quantity)
+    promocode = rng.choice(PROMOCODES) if rng.random() < 0.15 else None
+    discount = round(subtotal * rng.choice((0.1, 0.15, 0.2)), 2) if promocode else 0.0
+    created_at = min(starts_at - timedelta(minutes=rng.randint(30, 60 * 24 * 45)), anchor_at)
+    token = "%032x" % rng.getrandbits(128)
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES)
+    visible = rng.random() > 0.03
+    status = "cancelled" if rng.random() < 0.02 else "valid"
+
+    scans = []
+    valid_entries = duplicates = 0
+    if day < plan["anchor"] and status != "cancelled":
+        moment = starts_at + timedelta(minutes=rng.randint(0, 180))
+        no_show = rng.random() < 0.08
+        for _ in range(0 if no_show else quantity):
+            scans.append([moment, "valid", None])
+            valid_entries += 1
+            moment += timedelta(seconds=rng.randint(1, 900))
+        for _ in range(int(rng.expovariate(1 / plan["extra_scans"]))):
+            result = rng.choices(*EXTRA_SCAN_RESULTS)[0]
+            notes = None
+            if result == "denied":
+                notes = rng.choice(DENIED_NOTES).format(_event_date(rng, day), f"{rng.randint(1, 28)}.{day.month}")
+            elif result == "duplicate":
+                duplicates += 1
+            scans.append([moment, result, notes])
+            moment += timedelta(seconds=rng.randint(1, 3600))
+
+    scanner = f"scanner_{city.lower()}_{rng.randint(1, 4)}"
+    entry_times = [s[0] for s in scans if s[1] in ("valid", "duplicate")]
+    row = {
+        "id": ticket_id,
+        "order_id": order_id,
+        "transaction_id": f"tr{rng.getrandbits(40):010x}",
+        "customer_name": f"{first} {last}",
+        "customer_email": f"{order_id}@example.com",
+        "customer_phone": f"+48{rng.randint(500000000, 899999999)}",
+        "ticket_type": ticket_type,
+        "event_date": _event_date(rng, day),
+        "event_name": event_name,
+        "price": float(base_price),
+        "subtotal": subtotal,
+        "discount": discount,
+        "payment_amount": subtotal - discount,
+        "promocode": promocode,
+        "qr_token": token,
+        "qr_signature": generate_signature(order_id, token),
+        "country_code": country,
+        "city_name": city,
+        "club_id": club_id,
+        "visible_to_managers": visible,
+        "quantity": quantity,
+        "status": "used" if quantity and valid_entries >= quantity else status,
+        "scan_count": valid_entries + duplicates,
+        "first_scan_at": entry_times[0] if entry_times else None,
+        "last_scan_at": entry_times[-1] if entry_times else None,
+        "scanned_by": scanner if entry_times else None,
+        "created_at": created_at,
+        "updated_at": entry_times[-1] if entry_times else created_at,
+    }
+    scan_rows = [
+        (ticket_id, order_id, club_id, not visible, moment, result, scanner, notes)
+        for moment, result, notes in scans
+    ]
+    return row, scan_rows
+
+
+def _copy(cursor, table: str, columns: tuple, rows) -> int:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        count += 1
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return count
+
+
+# ─── Воркеры ───
+
+def _init_worker(plan: dict):
+    global _plan
+    _plan = plan
+
+
+def load_shard(task: tuple) -> tuple[str, int, int]:
+    """Генерирует и загружает один шард. Возвращает (kind, строк, сканов)"""
+    kind, shard = task
+    plan = _plan
+    size = plan["shard_size"]
+    total = plan["tickets"] if kind == "tickets" else plan["deleted"]
+    numbers = range(shard * size, min((shard + 1) * size, total))
+    # Своё зерно на шард: результат не зависит от того, какой воркер его взял
+    rng = random.Random(f"{plan['seed']}:{kind}:{shard}")
+
+    engine = create_engine(plan["url"], poolclass=NullPool)
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if kind == "tickets":
+            rows, scans = [], []
+            for n in numbers:
+                row, scan_rows = _ticket(rng, plan, f"{plan['prefix']}{n}", plan["id_offset"] + n + 1)
+                rows.append(tuple(row[c] for c in TICKET_COLUMNS))
+                scans.extend(scan_rows)
+            loaded = _copy(cursor, "tickets", TICKET_COLUMNS, rows)
+            scanned = _copy(cursor, "scan_history", SCAN_COLUMNS, scans)
+        else:
+            rows = []
+            for n in numbers:
+                row, _ = _ticket(rng, plan, f"{plan['prefix']}d{n}", 0)
+                deleted_at = row["updated_at"] + timedelta(days=rng.randint(0, 30))
+                rows.append(tuple(row[c] for c in TICKET_COLUMNS[1:]) + (
+                    plan["id_offset"] + plan["tickets"] + n + 1, row["created_at"], row["updated_at"],
+                    deleted_at, rng.choice(DELETED_BY), rng.choice(DELETE_REASONS),
+                ))
+            loaded = _copy(cursor, "deleted_tickets", DELETED_COLUMNS, rows)
+            scanned = 0
+        conn.commit()
+        return kind, loaded, scanned
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        engine.dispose()
+
+
+# ─── Команды ───
+
+def _prepare(plan: dict) -> None:
+    """Схема и партиции scan_history на весь период датасета"""
+    engine = get_direct_engine()
+    migrate(engine)
+    first_day = min(event[3] for event in plan["events"])
+    with engine.begin() as conn:
+        ensure_partitions(conn, start=first_day)
+
+
+def _finish(rollup: bool) -> None:
+    engine = get_direct_engine()
+    with engine.begin() as conn:
+        # id билетов заданы явно — sequence двигаем за максимум
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('tickets', 'id'), (SELECT max(id) FROM tickets))"))
+        # Билеты загружены COPY мимо ORM — кэш выручки работающего сервера устарел
+        bump_revenue_version(conn)
+    if rollup:
+        print("⏳ Пересчёт scan_rollup...")
+        db = SessionLocal()
+        try:
+            print(f"✅ scan_rollup: {rebuild_rollup(db)} бакетов")
+        finally:
+            db.close()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in ("tickets", "scan_history", "deleted_tickets", "scan_rollup"):
+            conn.execute(text(f"ANALYZE {table}"))
+
+
+def generate(args) -> None:
+    prefix = f"gen{args.seed}-"
+    db = SessionLocal()
+    try:
+        if db.execute(text("SELECT 1 FROM tickets WHERE order_id LIKE :p LIMIT 1"), {"p": f"{prefix}%"}).first():
+            print(f"❌ Датасет seed={args.seed} уже загружен — сначала: generate_dataset.py clean --seed {args.seed}")
+            return
+        clubs = load_clubs(db)
+        id_offset = db.execute(text("SELECT coalesce(max(id), 0) FROM tickets")).scalar()
+    finally:
+        db.close()
+
+    plan = make_plan(args, clubs, id_offset)
+    print(f"📋 Клубов: {len(clubs)}, мероприятий: {len(plan['events'])}, "
+          f"сканов сверх входов на билет: {plan['extra_scans']:.2f}")
+    _prepare(plan)
+
+    tasks = [("tickets", shard) for shard in range((args.tickets + args.shard_size - 1) // args.shard_size)]
+    tasks += [("deleted", shard) for shard in range((args.deleted + args.shard_size - 1) // args.shard_size)]
+
+    started = time.perf_counter()
+    totals = {"tickets": 0, "deleted": 0, "scans": 0}
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(args.workers, initializer=_init_worker, initargs=(plan,)) as pool:
+        for done, (kind, loaded, scanned) in enumerate(pool.imap_unordered(load_shard, tasks), 1):
+            totals[kind] += loaded
+            totals["scans"] += scanned
+            elapsed = time.perf_counter() - started
+            print(f"  [{done}/{len(tasks)}] билетов {totals['tickets']}, удалённых {totals['deleted']}, "
+                  f"сканов {totals['scans']} — {elapsed:.0f} с", flush=True)
+
+    _finish(rollup=not args.no_rollup)
+    elapsed = time.perf_counter() - started
+    rate = (totals["tickets"] + totals["scans"] + totals["deleted"]) / elapsed if elapsed else 0
+    print(f"✅ Датасет seed={args.seed} загружен за {elapsed:.0f} с ({rate:,.0f} строк/с): {totals}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетический датасет для нагрузочных тестов")
+    parser.add_argument("command", nargs="?", default="generate", choices=("generate", "clean"))
+    parser.add_argument("--tickets", type=int, default=1_000_000)
+    parser.add_argument("--scans", type=int, default=10_000_000, help="примерное число сканов")
+    parser.add_argument("--deleted", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--anchor", type=date.fromisoformat, default=date.today(),
+                        help="«сегодня» датасета (YYYY-MM-DD); для воспроизводимости задать явно")
+    parser.add_argument("--days-back", type=int, default=365)
+    parser.add_argument("--days-ahead", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--shard-size", type=int, default=20_000)
+    parser.add_argument("--no-rollup", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "clean":
+        print(f"🗑️ Удалено билетов датасета seed={args.seed}: {delete_by_prefix(f'gen{args.seed}-')}")
+    else:
+        generate(args)
+
+
+if __name__ == "__main__":
+    main()
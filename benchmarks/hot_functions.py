@@ -0,0 +1,208 @@
+"""
+Микробенчмарки функций, которые выполняются на каждый скан или вебхук:
+parse_qr_data, verify_signature_from_qr, generate_signature
+(app/security.py), normalize_city_name и TildaWebhookData
+(app/routers/tilda.py), ticket_to_dict (app/routers/verify.py).
+
+Запуск:
+    python benchmarks/hot_functions.py              # сравнить с baseline
+    python benchmarks/hot_functions.py --save       # записать новый baseline
+    python benchmarks/hot_functions.py --check      # регрессия → код выхода 1
+    python benchmarks/hot_functions.py -k parse_qr  # только совпадающие кейсы
+
+Baseline — benchmarks/baselines/hot_functions.json. Регрессия (--check)
+считается не по абсолютным мкс — они плавают от загрузки машины на десятки
+процентов, — а по отношению к эталонной функции (_reference: split/join +
+HMAC + dict, без кода приложения), замеренной в том же раунде: медиана
+отношений по --repeat раундам. Мкс на вызов (лучший из раундов) выводятся
+для информации. БД не нужна.
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.models import Ticket
+from app.routers.tilda import TildaWebhookData, normalize_city_name
+from app.routers.verify import ticket_to_dict
+from app.security import generate_signature, parse_qr_data, verify_signature_from_qr
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "hot_functions.json")
+
+
+def _sign(fields: list) -> str:
+    """Подпись бота: HMAC-SHA256 от полей через '|', первые 16 hex, upper"""
+    data = "|".join(fields).encode("utf-8")
+    return hmac.new(settings.QR_SECRET_KEY.encode("utf-8"), data, hashlib.sha256).hexdigest()[:16].upper()
+
+
+V2_FIELDS = ["AURA", "2", "100234", "Standard", "25.12", "John Doe", "john@example.com", "+48123456789",
+             "80", "1", "1", "9f86d081884c7d659a2feaa0c55ad015", "Krakow", "PL"]
+V2_CYRILLIC_FIELDS = ["AURA", "2", "100235", "VIP", "31.12", "Анна Иванова", "anna@mail.ru", "+48987654321",
+                      "150", "4", "1", "2c26b46b68ffc68ff99b453c1d304134", "Краков", "PL"]
+V1_FIELDS = ["AURA", "1", "100236", "Standard", "1.1", "Piotr Nowak", "piotr@wp.pl", "+48500100200",
+             "60", "1", "fcde2b2edba56bf408601fb721fe9b5c", "Warsaw", "PL"]
+
+QR = {
+    "v2": "|".join(V2_FIELDS + [_sign(V2_FIELDS)]),
+    "v2_cyrillic": "|".join(V2_CYRILLIC_FIELDS + [_sign(V2_CYRILLIC_FIELDS)]),
+    "v1": "|".join(V1_FIELDS + [_sign(V1_FIELDS)]),
+    # Старый формат без city/country (12 полей)
+    "old": "AURA|1|100237|Standard|5.5|Old Format|old@example.com|+48111|50|1|deadbeefdeadbeef|ABCDEF0123456789",
+    # USB-сканер в режиме клавиатуры: UTF-8 прочитан как latin-1 / неверная раскладка
+    "garbled_utf8": "|".join(V2_CYRILLIC_FIELDS + [_sign(V2_CYRILLIC_FIELDS)]).encode("utf-8").decode("latin-1"),
+    "garbled_layout": "FEHF|2|100235|VIP|31.12|Fyyf Bdfyjdf|anna@mail.ru|+48987654321|150|4|1|"
+                      "2c26b46b68ffc68ff99b453c1d304134|Rhfrjd|PL|" + _sign(V2_CYRILLIC_FIELDS),
+    "invalid": "https://example.com/not-a-ticket",
+}
+
+TILDA_PAYLOAD = {
+    "orderid": "1234567890", "tranid": "8251234:1234567", "name": "Анна Иванова", "email": "anna@mail.ru",
+    "phone": "+48 987 654 321", "amount": "150", "status": "paid", "ticket_type": "VIP", "event_date": "31.12",
+    "event_name": "IMPREZA New Year", "city": "Роттердам MEET AND GREET", "country": "", "club_id": "",
+    "promocode": "IMPREZA10", "formid": "form123456", "formname": "Cart",
+}
+
+
+def _reference():
+    """Эталонная нагрузка того же характера, что и горячие функции;
+    не меняется вместе с кодом приложения"""
+    fields = "|".join(V2_FIELDS).split("|")
+    digest = hmac.new(b"reference", "|".join(fields).encode("utf-8"), hashlib.sha256).hexdigest()
+    return {name: value.strip().lower() for name, value in zip(("a", "b", "c", "d", "e", "f"), fields)}, digest
+
+
+def _ticket() -> Ticket:
+    return Ticket(
+        order_id="100235", customer_name="Анна Иванова", customer_email="anna@mail.ru",
+        customer_phone="+48987654321", ticket_type="VIP", event_date="31.12", price=150.0,
+        promocode="IMPREZA10", scan_count=2, quantity=4, first_scan_at=datetime(2026, 12, 31, 22, 5),
+    )
+
+
+def cases() -> dict:
+    """Имя кейса → функция без аргументов"""
+    parsed = {name: parse_qr_data(qr) for name, qr in QR.items()}
+    ticket = _ticket()
+    result = {}
+    for name, qr in QR.items():
+        result[f"parse_qr_data[{name}]"] = lambda qr=qr: parse_qr_data(qr)
+    for name in ("v2", "v2_cyrillic", "v1", "old", "garbled_utf8"):
+        data = parsed[name]
+        result[f"verify_signature_from_qr[{name}]"] = lambda data=data: verify_signature_from_qr(data, data["signature"])
+    result["generate_signature"] = lambda: generate_signature("100234", "9f86d081884c7d659a2feaa0c55ad015")
+    for label, city in [("exact_en", "Krakow"), ("exact_ru", "Краков"), ("prefix", "Роттердам MEET AND GREET"),
+                        ("unknown", "Springfield")]:
+        result[f"normalize_city_name[{label}]"] = lambda city=city: normalize_city_name(city)
+    result["TildaWebhookData"] = lambda: TildaWebhookData(TILDA_PAYLOAD)
+    result["ticket_to_dict"] = lambda: ticket_to_dict(ticket)
+    return result
+
+
+def measure(selected: dict, repeat: int) -> tuple[dict, dict]:
+    """(мкс на вызов — лучший из repeat, отношение к _reference — медиана по раундам).
+
+    Замеры идут раундами по всем кейсам, а не подряд для одного кейса —
+    кратковременный шум (соседи по CPU, GC) не ложится целиком на один кейс.
+    Эталон замеряется перед каждым кейсом: отношение снимается в одних условиях.
+    """
+    def _timer(fn):
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        return lambda: timer.timeit(number) / number * 1e6
+
+    reference = _timer(_reference)
+    timers = {name: _timer(fn) for name, fn in selected.items()}
+    best = {name: float("inf") for name in selected}
+    ratios = {name: [] for name in selected}
+    for _ in range(repeat):
+        for name, timed in timers.items():
+            base = reference()
+            value = timed()
+            best[name] = min(best[name], value)
+            ratios[name].append(value / base)
+    return (
+        {name: round(value, 3) for name, value in best.items()},
+        {name: round(statistics.median(values), 4) for name, values in ratios.items()},
+    )
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args) -> int:
+    selected = {name: fn for name, fn in cases().items() if not args.k or args.k in name}
+    results, relative = measure(selected, args.repeat)
+
+    baseline = {}
+    if os.path.exists(BASELINE) and not args.save:
+        with open(BASELINE, encoding="utf-8") as f:
+            baseline = json.load(f)
+        meta = baseline.get("meta", {})
+        print(f"📋 Baseline: {meta.get('commit')} {meta.get('recorded_at', '')[:10]} ({meta.get('machine')}, "
+              f"Python {meta.get('python')})")
+
+    regressions = 0
+    print(f"📊 Горячие функции: мкс на вызов (лучший из {args.repeat}) и × эталона (медиана), "
+          f"регрессия — по × эталона:")
+    for name, value in results.items():
+        ratio = relative[name]
+        before = baseline.get("relative", {}).get(name)
+        if before:
+            change = (ratio - before) / before * 100
+            worse = change > args.tolerance
+            regressions += worse
+            mark = "❌" if worse else ("⚡" if change < -args.tolerance else "  ")
+            print(f"  {mark} {name:<42} {value:9.3f}  ×{ratio:7.3f}   baseline ×{before:7.3f}  {change:+6.1f}%")
+        else:
+            print(f"     {name:<42} {value:9.3f}  ×{ratio:7.3f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "recorded_at": datetime.now(timezone.utc).isoformat(),
+                    "commit": _git_commit(),
+                    "python": platform.python_version(),
+                    "machine": f"{platform.machine()} {platform.processor() or platform.platform()}",
+                    "repeat": args.repeat,
+                },
+                "results": results,
+                "relative": relative,
+            }, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"💾 Baseline записан: {BASELINE}")
+    elif baseline:
+        print(f"{'❌' if regressions else '✅'} Регрессий: {regressions} (допуск {args.tolerance}%)")
+    return 1 if args.check and regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих функций")
+    parser.add_argument("--save", action="store_true", help="записать результаты как baseline")
+    parser.add_argument("--check", action="store_true", help="код выхода 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=35.0, help="допуск по × эталона, %%")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("-k", default="", help="подстрока имени кейса")
+    return run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,496 @@
+"""
+Нагрузочный тест API: сценарии, p50/p95/p99, пропускная способность и SQL
+на запрос. Результат — JSON для сравнения между версиями.
+
+Сервер запускается отдельно, на тестовой базе PostgreSQL и с тем же .env
+(JWT_SECRET, QR_SECRET_KEY, TILDA_WEBHOOK_SECRET), без rate limit:
+
+    RATE_LIMIT_ENABLED=false uvicorn app.main:app --workers 4
+
+Запуск:
+    python benchmarks/loadtest.py run --url http://localhost:8000 --concurrency 64
+    python benchmarks/loadtest.py run --scenarios scan_storm,tilda_burst --output before.json
+    python benchmarks/loadtest.py compare before.json after.json   # регрессия → код выхода 1
+
+Сценарии (--scenarios, по умолчанию все):
+  scan_storm   — открытие дверей: /api/verify по свежим билетам, повторные
+                 сканы, мусорные QR (в т.ч. искажённые USB-сканером),
+                 /api/log-denied и групповые билеты (quantity > 1), которые
+                 одновременно сканируют несколько сканеров
+  admin_poll   — админка опрашивает /api/tickets/ и /api/stats/
+  tilda_burst  — волна продаж: /api/tilda/webhook, часть — повторы Tilda
+  bulk_ops     — массовое скрытие, показ и удаление билетов по ticket_ids
+
+Sync- и async-путь горячих эндпоинтов (DB_ASYNC_HOT_PATHS, app/database.py)
+сравниваются двумя прогонами при высокой конкурентности — сервер
+перезапускается с другим значением, режим записывается в meta.db_mode:
+
+    DB_ASYNC_HOT_PATHS=false ... uvicorn app.main:app --workers 4
+    python benchmarks/loadtest.py run --scenarios scan_storm,tilda_burst --concurrency 512 --output sync.json
+    DB_ASYNC_HOT_PATHS=true ... uvicorn app.main:app --workers 4
+    python benchmarks/loadtest.py run --scenarios scan_storm,tilda_burst --concurrency 512 --output async.json
+    python benchmarks/loadtest.py compare sync.json async.json
+
+Данные прогона создаются benchmarks/seed.py и удаляются в конце (--keep —
+оставить). SQL на запрос берётся из заголовка Server-Timing
+(SERVER_TIMING=true, app/querybudget.py).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from app.config import settings
+from app.routers.admin_auth import create_jwt_token
+from benchmarks.seed import BENCH_PREFIX, SeedData, cleanup, seed
+
+SCENARIOS = ("scan_storm", "admin_poll", "tilda_burst", "bulk_ops")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+_SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+# Строки, которые реально приходят со сканеров: обрезанные, не наш формат,
+# кириллица после USB-сканера с неверной раскладкой
+GARBAGE_QR = [
+    "AURA|2|broken",
+    "https://example.com/ticket/123",
+    "AURA|1|12345|VIP|25.12|Иван Петров|ivan@mail.ru|+48123|150|1|deadbeef|Краков|PL|ABCDEF",
+    "AURA|2|12345|VIP|25.12|Ð\x98Ð²Ð°Ð½|ivan@mail.ru|+48123|150|2|1|deadbeef|Krakow|PL|ABCDEF",
+    "",
+]
+
+TILDA_CITIES = ["Krakow", "Краков", "Варшава", "Berlin", "Роттердам MEET AND GREET", "Прага"]
+
+
+@dataclass
+class Call:
+    op: str
+    method: str
+    path: str
+    kwargs: dict = field(default_factory=dict)
+    tag: Optional[str] = None
+
+
+# Элемент очереди: один запрос или цепочка, выполняемая одним воркером по порядку
+Item = Union[Call, list]
+
+
+@dataclass
+class Sample:
+    op: str
+    status: int
+    latency: float
+    queries: Optional[int] = None
+    db_ms: Optional[float] = None
+    tag: Optional[str] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class Context:
+    client: httpx.AsyncClient
+    data: SeedData
+    concurrency: int
+    rng: random.Random
+    args: argparse.Namespace
+    super_headers: dict = field(default_factory=dict)
+    scanner_headers: dict = field(default_factory=dict)  # club_id → headers
+
+
+# ─── Драйвер ───
+
+def parse_server_timing(header: str) -> tuple[Optional[int], Optional[float]]:
+    match = _SERVER_TIMING_DB.search(header or "")
+    if not match:
+        return None, None
+    return int(match.group(2)), float(match.group(1))
+
+
+async def _send(ctx: Context, call: Call) -> Sample:
+    started = time.perf_counter()
+    try:
+        response = await ctx.client.request(call.method, call.path, **call.kwargs)
+    except httpx.HTTPError as e:
+        return Sample(call.op, 0, time.perf_counter() - started, tag=call.tag, error=type(e).__name__)
+    latency = time.perf_counter() - started
+
+    queries, db_ms = parse_server_timing(response.headers.get("server-timing", ""))
+    result = None
+    if call.op.startswith("verify"):
+        try:
+            result = response.json().get("status")
+        except ValueError:
+            pass
+    return Sample(call.op, response.status_code, latency, queries, db_ms, call.tag, result)
+
+
+async def run_items(ctx: Context, items: list) -> tuple[list, float]:
+    """concurrency воркеров разбирают очередь; соседние элементы очереди
+    выполняются одновременно разными воркерами"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    samples: list[Sample] = []
+
+    async def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            for call in item if isinstance(item, list) else [item]:
+                samples.append(await _send(ctx, call))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(ctx.concurrency)))
+    return samples, time.perf_counter() - started
+
+
+# ─── Сценарии ───
+
+def _verify(ctx: Context, op: str, qr: str, club_id: Optional[int], tag: Optional[str] = None) -> Call:
+    scanner = f"bench-{ctx.rng.randint(1, 16)}"
+    headers = dict(ctx.scanner_headers.get(club_id, {}), **{"X-Scanner-Id": scanner})
+    return Call(op, "POST", "/api/verify", {"json": {"qr_data": qr, "scanner_id": scanner}, "headers": headers}, tag)
+
+
+def scan_storm(ctx: Context) -> list:
+    rng, data = ctx.rng, ctx.data
+    items: list = [_verify(ctx, "verify_first", t.qr, t.club_id) for t in data.storm]
+
+    for _ in range(max(len(data.storm) // 50, 1)):
+        items.append(_verify(ctx, "verify_garbage", rng.choice(GARBAGE_QR), None))
+    for ticket in rng.sample(data.storm, len(data.storm) // 30):
+        items.append(Call("log_denied", "POST", "/api/log-denied", {
+            "json": {"order_id": ticket.order_id, "reason": "wrong_date", "scanner_id": "bench-1",
+                     "qr_event_date": "01.01", "filter_event_date": "02.01", "club_id": ticket.club_id},
+            "headers": ctx.scanner_headers.get(ticket.club_id, {}),
+        }))
+    rng.shuffle(items)
+
+    # Групповой билет: quantity + 1 скан подряд в очереди → одновременно
+    # на разных воркерах; лишний вход должен получить "used"
+    for ticket in data.groups:
+        position = rng.randint(0, len(items))
+        burst = [_verify(ctx, "verify_group", ticket.qr, ticket.club_id, tag=ticket.order_id)
+                 for _ in range(ticket.quantity + 1)]
+        items[position:position] = burst
+
+    # Повторный скан уже прошедших — в конце
+    for ticket in rng.sample(data.storm, len(data.storm) // 10):
+        items.append(_verify(ctx, "verify_repeat", ticket.qr, ticket.club_id))
+    return items
+
+
+def check_group_admission(data: SeedData, samples: list) -> dict:
+    """Сколько групповых билетов пустили больше (или меньше) quantity раз"""
+    granted = Counter(s.tag for s in samples if s.op == "verify_group" and s.result == "valid")
+    over = sum(max(granted[t.order_id] - t.quantity, 0) for t in data.groups)
+    under = sum(max(t.quantity - granted[t.order_id], 0) for t in data.groups)
+    return {"group_tickets": len(data.groups), "over_admitted_entries": over, "under_admitted_entries": under}
+
+
+def admin_poll(ctx: Context) -> list:
+    club_ids = [club[0] for club in ctx.data.clubs]
+    headers = ctx.super_headers
+    items = []
+    for n in range(ctx.args.admin_requests):
+        club_id = ctx.rng.choice(club_ids)
+        items.append([
+            Call("tickets_list", "GET", "/api/tickets/", {"params": {"club_id": club_id, "limit": 500}, "headers": headers}),
+            Call("tickets_list_all", "GET", "/api/tickets/",
+                 {"params": {"show_all_for_admin": "true", "limit": 1000}, "headers": headers}),
+            Call("stats_club", "GET", "/api/stats/", {"params": {"club_id": club_id}, "headers": headers}),
+            Call("stats_all", "GET", "/api/stats/", {"headers": headers}),
+        ][n % 4])
+    return items
+
+
+def tilda_burst(ctx: Context) -> list:
+    rng = ctx.rng
+    headers = {"X-Tilda-Secret": settings.TILDA_WEBHOOK_SECRET} if settings.TILDA_WEBHOOK_SECRET else {}
+    payloads = []
+    for n in range(ctx.args.tilda_orders):
+        payloads.append({
+            "orderid": f"{BENCH_PREFIX}{ctx.data.run_id}-tilda-{n}",
+            "tranid": f"tr{n}",
+            "name": f"Покупатель {n}",
+            "email": f"buyer{n}@bench.local",
+            "phone": f"+48{600000000 + n}",
+            "amount": str(rng.choice((60, 80, 100))),
+            "status": "paid",
+            "ticket_type": "Standard",
+            "event_date": "25.12",
+            "event_name": f"BENCH {ctx.data.run_id} Tilda",
+            "city": rng.choice(TILDA_CITIES),
+            "country": "",
+            "promocode": rng.choice(("", "TILDA5")),
+        })
+    items = [Call("tilda_new", "POST", "/api/tilda/webhook", {"json": p, "headers": headers}) for p in payloads]
+    # Tilda повторяет вебхук, если не дождалась ответа
+    items += [Call("tilda_retry", "POST", "/api/tilda/webhook", {"json": p, "headers": headers})
+              for p in rng.sample(payloads, len(payloads) // 20)]
+    return items
+
+
+def bulk_ops(ctx: Context) -> list:
+    headers = ctx.super_headers
+    ids = [t.id for t in ctx.data.bulk]
+    size = ctx.args.bulk_batch
+    items = []
+    for start in range(0, len(ids), size):
+        batch = ",".join(str(i) for i in ids[start:start + size])
+        items.append([
+            Call("hide", "PUT", "/api/tickets/hide-from-managers", {"params": {"ticket_ids": batch}, "headers": headers}),
+            Call("show", "PUT", "/api/tickets/show-to-managers", {"params": {"ticket_ids": batch}, "headers": headers}),
+            Call("delete", "DELETE", "/api/tickets/delete-range",
+                 {"params": {"ticket_ids": batch, "deleted_by": "loadtest"}, "headers": headers}),
+        ])
+    return items
+
+
+BUILDERS = {"scan_storm": scan_storm, "admin_poll": admin_poll, "tilda_burst": tilda_burst, "bulk_ops": bulk_ops}
+
+
+# ─── Отчёт ───
+
+def percentile(values: list, p: float) -> Optional[float]:
+    """Nearest-rank по отсортированному списку"""
+    if not values:
+        return None
+    index = min(max(math.ceil(p / 100 * len(values)) - 1, 0), len(values) - 1)
+    return round(values[index], 3)
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = sorted(s.latency * 1000 for s in samples)
+    queries = sorted(s.queries for s in samples if s.queries is not None)
+    db_ms = sorted(s.db_ms for s in samples if s.db_ms is not None)
+    errors = [s for s in samples if not 200 <= s.status < 400]
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "status": dict(Counter(str(s.error or s.status) for s in samples)),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": round(latencies[-1], 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        },
+        "queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 2),
+            "p95": percentile(queries, 95),
+            "max": queries[-1],
+        } if queries else None,
+        "db_ms": {"p50": percentile(db_ms, 50), "p95": percentile(db_ms, 95)} if db_ms else None,
+    }
+
+
+def report(samples: list, elapsed: float) -> dict:
+    result = summarize(samples, elapsed)
+    by_op = defaultdict(list)
+    for sample in samples:
+        by_op[sample.op].append(sample)
+    result["ops"] = {op: summarize(op_samples, elapsed) for op, op_samples in by_op.items()}
+    return result
+
+
+def print_report(name: str, result: dict):
+    latency = result["latency_ms"]
+    queries = result["queries_per_request"] or {}
+    print(f"📊 {name}: {result['requests']} запросов за {result['elapsed_s']} с, "
+          f"{result['throughput_rps']} rps, ошибок {result['errors']}")
+    print(f"  {'op':<18} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>6}")
+    for op, stats in sorted(result["ops"].items()):
+        lat = stats["latency_ms"]
+        sql = (stats["queries_per_request"] or {}).get("mean", "-")
+        print(f"  {op:<18} {stats['requests']:>6} {lat['p50']:>8} {lat['p95']:>8} {lat['p99']:>8} {sql:>6}")
+    print(f"  {'всего':<18} {result['requests']:>6} {latency['p50']:>8} {latency['p95']:>8} "
+          f"{latency['p99']:>8} {queries.get('mean', '-'):>6}")
+    if "checks" in result:
+        print(f"  проверки: {result['checks']}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# ─── Команды ───
+
+def _tokens(ctx: Context):
+    ctx.super_headers = {"Authorization": f"Bearer {create_jwt_token({'role': 'super', 'name': 'loadtest'})}"}
+    for club_id, city, country in ctx.data.clubs:
+        token = create_jwt_token({
+            "club_id": club_id, "role": "scanner", "name": city, "city_english": city,
+            "allowed_countries": [country],
+        })
+        ctx.scanner_headers[club_id] = {"Authorization": f"Bearer {token}"}
+
+
+async def run_scenarios(args, data: SeedData) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        ctx = Context(client, data, args.concurrency, random.Random(args.seed), args)
+        _tokens(ctx)
+        await asyncio.gather(*(client.get("/health") for _ in range(args.concurrency)))
+
+        results = {}
+        for name in args.scenarios:
+            samples, elapsed = await run_items(ctx, BUILDERS[name](ctx))
+            results[name] = report(samples, elapsed)
+            if name == "scan_storm":
+                results[name]["checks"] = check_group_admission(data, samples)
+            print_report(name, results[name])
+        return results, await server_db_mode(ctx)
+
+
+async def server_db_mode(ctx: Context) -> str:
+    """async — горячие эндпоинты сервера на AsyncSession (DB_ASYNC_HOT_PATHS);
+    пул async engine появляется в /api/stats/db-pool после первого запроса"""
+    try:
+        response = await ctx.client.get("/api/stats/db-pool", headers=ctx.super_headers)
+    except httpx.HTTPError:
+        return "unknown"
+    if response.status_code != 200:
+        return "unknown"
+    return "async" if "async" in response.json() else "sync"
+
+
+def run(args) -> int:
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"❌ Неизвестные сценарии: {', '.join(sorted(unknown))}")
+        return 2
+
+    started_at = datetime.now(timezone.utc)
+    data = seed(args.tickets, args.scans, args.storm, args.groups, args.bulk, args.seed)
+    try:
+        scenarios, db_mode = asyncio.run(run_scenarios(args, data))
+    finally:
+        if not args.keep:
+            print(f"🗑️ Удалено bench-билетов: {cleanup(data.run_id)}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {
+                "started_at": started_at.isoformat(),
+                "commit": _git_commit(),
+                "url": args.url,
+                "concurrency": args.concurrency,
+                "db_mode": db_mode,
+                "python": platform.python_version(),
+                "seed": {"seed": args.seed, "run_id": data.run_id, "tickets": data.tickets, "scans": data.scans,
+                         "storm": len(data.storm), "groups": len(data.groups), "bulk": len(data.bulk)},
+            },
+            "scenarios": scenarios,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"📋 Горячие эндпоинты сервера: {db_mode}")
+    print(f"💾 Результат: {output}")
+
+    over = scenarios.get("scan_storm", {}).get("checks", {}).get("over_admitted_entries", 0)
+    if over:
+        print(f"❌ Групповые билеты пропустили лишних входов: {over}")
+        return 1
+    return 0
+
+
+def compare(args) -> int:
+    """Регрессия: p95 или SQL на запрос выросли / rps упал больше чем на tolerance"""
+    with open(args.baseline, encoding="utf-8") as f:
+        old_run = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        new_run = json.load(f)
+    old, new = old_run["scenarios"], new_run["scenarios"]
+    old_meta, new_meta = old_run.get("meta", {}), new_run.get("meta", {})
+    print(f"📋 БД: {old_meta.get('db_mode', '?')} → {new_meta.get('db_mode', '?')}, "
+          f"concurrency {old_meta.get('concurrency')} → {new_meta.get('concurrency')}")
+    tolerance = args.tolerance / 100
+
+    def delta(a, b):
+        return f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+
+    regressions = 0
+    for name in [n for n in new if n in old]:
+        print(f"📊 {name}")
+        pairs = [("", old[name], new[name])] + [
+            (op, old[name]["ops"][op], stats) for op, stats in sorted(new[name]["ops"].items())
+            if op in old[name]["ops"]
+        ]
+        for op, before, after in pairs:
+            p95_old, p95_new = before["latency_ms"]["p95"], after["latency_ms"]["p95"]
+            rps_old, rps_new = before["throughput_rps"], after["throughput_rps"]
+            sql_old = (before["queries_per_request"] or {}).get("mean")
+            sql_new = (after["queries_per_request"] or {}).get("mean")
+            worse = (
+                (p95_old and p95_new and p95_new > p95_old * (1 + tolerance))
+                or (rps_old and rps_new and rps_new < rps_old * (1 - tolerance))
+                or (sql_old is not None and sql_new is not None and sql_new > sql_old + 0.5)
+            )
+            regressions += bool(worse)
+            mark = "❌" if worse else "✅"
+            print(f"  {mark} {op or 'всего':<18} p95 {p95_old} → {p95_new} ({delta(p95_old, p95_new)}), "
+                  f"rps {rps_old} → {rps_new} ({delta(rps_old, rps_new)}), sql {sql_old} → {sql_new}")
+
+    print(f"{'❌' if regressions else '✅'} Регрессий: {regressions} (допуск {args.tolerance}%)")
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="засеять данные, прогнать сценарии, сохранить JSON")
+    run_parser.add_argument("--url", default=os.getenv("LOADTEST_URL", "http://localhost:8000"))
+    run_parser.add_argument("--scenarios", type=lambda s: [x.strip() for x in s.split(",") if x.strip()],
+                            default=list(SCENARIOS))
+    run_parser.add_argument("--concurrency", type=int, default=64)
+    run_parser.add_argument("--timeout", type=float, default=30.0)
+    run_parser.add_argument("--tickets", type=int, default=20000, help="фоновые билеты")
+    run_parser.add_argument("--scans", type=int, default=100000, help="фоновая история сканов")
+    run_parser.add_argument("--storm", type=int, default=5000, help="билетов в скан-шторме")
+    run_parser.add_argument("--groups", type=int, default=200, help="групповых билетов (quantity > 1)")
+    run_parser.add_argument("--bulk", type=int, default=2000, help="билетов для bulk_ops")
+    run_parser.add_argument("--bulk-batch", type=int, default=50)
+    run_parser.add_argument("--admin-requests", type=int, default=400)
+    run_parser.add_argument("--tilda-orders", type=int, default=1000)
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--output", default="")
+    run_parser.add_argument("--keep", action="store_true", help="не удалять данные прогона")
+
+    compare_parser = commands.add_parser("compare", help="сравнить два JSON-результата")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=10.0, help="допуск, %%")
+
+    args = parser.parse_args()
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
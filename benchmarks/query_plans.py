@@ -0,0 +1,133 @@
+"""
+Проверка планов запросов: выборки scan_history по диапазону scan_time идут
+через составные индексы, а не Seq Scan.
+
+Запуск (нужен PostgreSQL из DATABASE_URL):
+    python benchmarks/query_plans.py --seed       # засеять bench-данные, проверить, удалить
+    python benchmarks/query_plans.py              # на уже загруженных данных (generate_dataset.py)
+
+Каждый запрос — форма из кода (stats «за сегодня», история сканов);
+EXPLAIN (FORMAT JSON) должен содержать Index/Index Only/Bitmap Index Scan
+по ожидаемому индексу. Индексы партиций PostgreSQL именует сам — они
+сопоставляются с индексом родителя через pg_inherits.
+Код выхода 1, если хотя бы один план не использует индекс.
+"""
+
+import argparse
+import os
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select, text
+
+from app.database import get_direct_engine
+from app.models import ScanHistory
+from app.timerange import day_range
+from benchmarks.seed import cleanup, seed
+
+INDEX_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+def cases(club_id: int) -> dict:
+    """Имя → (запрос, индекс, который он обязан использовать)"""
+    start, end = day_range()
+    week_start = end - timedelta(days=7)
+    return {
+        "stats_today_club_result": (
+            select(func.count()).select_from(ScanHistory).where(
+                ScanHistory.club_id == club_id,
+                ScanHistory.scan_time >= start,
+                ScanHistory.scan_time < end,
+                ScanHistory.scan_result == "valid",
+            ),
+            "ix_scan_history_club_time_result",
+        ),
+        "stats_today_club_by_result": (
+            select(ScanHistory.scan_result, func.count()).where(
+                ScanHistory.club_id == club_id,
+                ScanHistory.scan_time >= start,
+                ScanHistory.scan_time < end,
+            ).group_by(ScanHistory.scan_result),
+            "ix_scan_history_club_time_result",
+        ),
+        "stats_today_result": (
+            select(func.count()).select_from(ScanHistory).where(
+                ScanHistory.scan_result == "valid",
+                ScanHistory.scan_time >= start,
+                ScanHistory.scan_time < end,
+            ),
+            "ix_scan_history_result_time",
+        ),
+        "history_valid_latest": (
+            select(ScanHistory.id, ScanHistory.scan_time).where(
+                ScanHistory.scan_result == "valid",
+                ScanHistory.scan_time >= week_start,
+            ).order_by(ScanHistory.scan_time.desc()).limit(100),
+            "ix_scan_history_result_time",
+        ),
+    }
+
+
+def _plan_indexes(node: dict) -> list:
+    found = [node["Index Name"]] if node.get("Node Type") in INDEX_NODES and node.get("Index Name") else []
+    for child in node.get("Plans", []):
+        found.extend(_plan_indexes(child))
+    return found
+
+
+def _root_index(conn, name: str) -> str:
+    """Имя индекса родительской таблицы для индекса партиции"""
+    while True:
+        parent = conn.execute(text("""
+            SELECT p.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE c.relname = :name AND c.relkind IN ('i', 'I')
+        """), {"name": name}).scalar()
+        if parent is None:
+            return name
+        name = parent
+
+
+def explain(conn, stmt) -> dict:
+    compiled = stmt.compile(dialect=conn.dialect)
+    return conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()[0]["Plan"]
+
+
+def check(club_id: int) -> int:
+    failures = 0
+    with get_direct_engine().connect() as conn:
+        conn.execute(text("ANALYZE scan_history"))
+        print("🔍 Планы запросов scan_history:")
+        for name, (stmt, expected) in cases(club_id).items():
+            plan = explain(conn, stmt)
+            used = sorted({_root_index(conn, index) for index in _plan_indexes(plan)})
+            ok = expected in used
+            failures += not ok
+            print(f"  {'✅' if ok else '❌'} {name:<28} ожидается {expected}; в плане: {', '.join(used) or plan['Node Type']}")
+    print(f"{'❌' if failures else '✅'} Без индекса: {failures}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="EXPLAIN-проверка индексов scan_history")
+    parser.add_argument("--seed", action="store_true", help="засеять bench-данные на время проверки")
+    parser.add_argument("--tickets", type=int, default=20000)
+    parser.add_argument("--scans", type=int, default=200000)
+    parser.add_argument("--club", type=int, default=None, help="club_id для запросов (по умолчанию — первый из засеянных)")
+    args = parser.parse_args()
+
+    if not args.seed:
+        return check(args.club or 1)
+
+    data = seed(args.tickets, args.scans, storm=0, groups=0, bulk=0, days=30)
+    try:
+        return check(args.club or data.clubs[0][0])
+    finally:
+        print(f"🗑️ Удалено bench-билетов: {cleanup(data.run_id)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Данные для нагрузочного теста (benchmarks/loadtest.py).
+
+Пишет напрямую в DATABASE_URL (тот же PostgreSQL, что у сервера):
+  - билеты прогона: order_id = bench-<run>-<пул>-<n>, event_name = BENCH <run> <город>
+    (часть — на несколько человек, часть скрыта от менеджеров);
+  - историю сканов по этим билетам за последние дни + scan_rollup;
+  - отдельные пулы билетов для сценариев (скан-шторм, групповые билеты,
+    массовое удаление/скрытие).
+
+Запуск отдельно:
+    python benchmarks/seed.py --tickets 20000 --scans 100000
+    python benchmarks/seed.py cleanup            # удалить все bench-данные
+
+SQLite не подходит: схема использует партиции, ARRAY и ON CONFLICT
+PostgreSQL — нужна отдельная тестовая база PostgreSQL.
+"""
+
+import argparse
+import os
+import random
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.database import SessionLocal, get_direct_engine
+from app.migrations import migrate
+from app.models import DeletedTicket, ScanHistory, ScanRollup, Ticket
+from app.rollup import _grouped_scans, discount_scans
+from app.security import generate_signature, generate_token
+
+BENCH_PREFIX = "bench-"
+CHUNK = 5000
+
+# Если в clubs пусто (чистая тестовая база) — билеты раскладываются по этим городам
+FALLBACK_CLUBS = [
+    (1, "Krakow", "PL"), (2, "Warsaw", "PL"), (3, "Berlin", "DE"),
+    (4, "Amsterdam", "NL"), (5, "Prague", "CZ"), (6, "Vienna", "AT"),
+]
+
+SCAN_RESULTS = [("valid", 70), ("duplicate", 15), ("denied", 8), ("invalid", 5), ("forged", 2)]
+
+
+@dataclass
+class SeedTicket:
+    id: int
+    order_id: str
+    club_id: int
+    quantity: int
+    qr: str
+
+
+@dataclass
+class SeedData:
+    run_id: str
+    clubs: list
+    storm: list = field(default_factory=list)   # не сканированные, quantity 1
+    groups: list = field(default_factory=list)  # quantity > 1 — конкуренция сканеров
+    bulk: list = field(default_factory=list)    # для удаления/скрытия
+    tickets: int = 0
+    scans: int = 0
+
+
+def qr_string(ticket: dict) -> str:
+    """QR v2: AURA|2|order_id|type|date|name|email|phone|price|quantity|paid|token|city|country|signature"""
+    return "|".join([
+        "AURA", "2", ticket["order_id"], ticket["ticket_type"], ticket["event_date"],
+        ticket["customer_name"], ticket["customer_email"], ticket["customer_phone"],
+        str(int(ticket["price"])), str(ticket["quantity"]), "1", ticket["qr_token"],
+        ticket["city_name"], ticket["country_code"], ticket["qr_signature"],
+    ])
+
+
+def load_clubs(db) -> list:
+    """(club_id, city_english, country_code) существующих активных клубов"""
+    try:
+        rows = db.execute(text("""
+            SELECT c.club_id, c.city_english, co.country_code
+            FROM clubs c JOIN countries co ON c.country_id = co.country_id
+            WHERE c.is_active = TRUE ORDER BY c.club_id
+        """)).fetchall()
+    except Exception:
+        db.rollback()
+        rows = []
+    return [tuple(row) for row in rows] or FALLBACK_CLUBS
+
+
+def _ticket_row(rng: random.Random, run_id: str, n: int, club: tuple, kind: str) -> dict:
+    club_id, city, country = club
+    order_id = f"{BENCH_PREFIX}{run_id}-{kind}-{n}"
+    token = generate_token()
+    event_day = datetime.now() + timedelta(days=rng.randint(-30, 30))
+    if kind == "group":
+        quantity = rng.choice((2, 3, 4, 5))
+    else:
+        quantity = 2 if kind == "base" and rng.random() < 0.1 else 1
+    price = rng.choice((60, 80, 100, 150))
+    return {
+        "order_id": order_id,
+        "customer_name": f"Bench Guest {n}",
+        "customer_email": f"guest{n}@bench.local",
+        "customer_phone": f"+48{500000000 + n}",
+        "ticket_type": rng.choice(("Standard", "VIP", "Early Bird")),
+        "event_date": event_day.strftime("%d.%m"),
+        "event_name": f"BENCH {run_id} {city}",
+        "price": price,
+        "payment_amount": price,
+        "promocode": rng.choice(("", "", "", "BENCH10")),
+        "qr_token": token,
+        "qr_signature": generate_signature(order_id, token),
+        "city_name": city,
+        "country_code": country,
+        "club_id": club_id,
+        "quantity": quantity,
+        "status": "valid",
+        "scan_count": 0,
+        "visible_to_managers": kind != "base" or rng.random() > 0.05,
+    }
+
+
+def _insert_tickets(db, rows: list) -> list:
+    ids = []
+    for start in range(0, len(rows), CHUNK):
+        chunk = rows[start:start + CHUNK]
+        ids.extend(db.execute(insert(Ticket).returning(Ticket.id), chunk).scalars().all())
+    return ids
+
+
+def seed(tickets: int, scans: int, storm: int, groups: int, bulk: int,
+         seed_value: int = 42, days: int = 14) -> SeedData:
+    """Создаёт данные прогона; детерминировано по seed_value (кроме run_id и qr_token)"""
+    migrate(get_direct_engine())
+    rng = random.Random(seed_value)
+    run_id = f"{seed_value}t{datetime.now():%m%d%H%M%S}"
+    db = SessionLocal()
+    try:
+        clubs = load_clubs(db)
+        data = SeedData(run_id=run_id, clubs=clubs)
+        base = []
+
+        pools = {"base": tickets, "storm": storm, "group": groups, "bulk": bulk}
+        for kind, count in pools.items():
+            rows = [_ticket_row(rng, run_id, n, rng.choice(clubs), kind) for n in range(count)]
+            ids = _insert_tickets(db, rows)
+            data.tickets += len(ids)
+            seeded = [SeedTicket(id_, row["order_id"], row["club_id"], row["quantity"], qr_string(row))
+                      for id_, row in zip(ids, rows)]
+            if kind == "base":
+                base = list(zip(ids, rows))
+            elif kind == "storm":
+                data.storm = seeded
+            elif kind == "group":
+                data.groups = seeded
+            else:
+                data.bulk = seeded
+        db.commit()
+        print(f"✅ Билетов создано: {data.tickets} (run {run_id})")
+
+        if scans and base:
+            now = datetime.now()
+            weights = [w for _, w in SCAN_RESULTS]
+            results = [r for r, _ in SCAN_RESULTS]
+            for start in range(0, scans, CHUNK):
+                chunk = []
+                for _ in range(min(CHUNK, scans - start)):
+                    ticket_id, row = rng.choice(base)
+                    chunk.append({
+                        "ticket_id": ticket_id,
+                        "order_id": row["order_id"],
+                        "club_id": row["club_id"],
+                        "scan_time": now - timedelta(seconds=rng.randint(0, days * 86400)),
+                        "scan_result": rng.choices(results, weights)[0],
+                        "scanner_id": f"bench-scanner-{rng.randint(1, 8)}",
+                    })
+                db.execute(insert(ScanHistory), chunk)
+                data.scans += len(chunk)
+
+            # Rollup прогона — прибавляется к существующим бакетам
+            grouped = _grouped_scans(ScanHistory.order_id.like(f"{BENCH_PREFIX}{run_id}-%"))
+            stmt = pg_insert(ScanRollup).from_select(
+                ["club_id", "event_name", "bucket", "scan_result", "count"], grouped,
+            )
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[ScanRollup.club_id, ScanRollup.event_name, ScanRollup.bucket, ScanRollup.scan_result],
+                set_={"count": ScanRollup.count + stmt.excluded.count},
+            ))
+            db.commit()
+            print(f"✅ Сканов создано: {data.scans}")
+        return data
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def cleanup(run_id: str = "") -> int:
+    """Удаляет bench-данные (все прогоны или один run_id), включая билеты,
+    созданные вебхуком Tilda в сценарии tilda_burst"""
+    return delete_by_prefix(f"{BENCH_PREFIX}{run_id}-" if run_id else BENCH_PREFIX)
+
+
+def delete_by_prefix(prefix: str) -> int:
+    """Удаляет билеты, их сканы и удалённые билеты с order_id, начинающимся
+    с prefix (rollup уменьшается на удаляемые сканы). Возвращает число билетов."""
+    pattern = f"{prefix}%"
+    db = SessionLocal()
+    try:
+        scan_filter = ScanHistory.order_id.like(pattern)
+        discount_scans(db, scan_filter)
+        db.execute(delete(ScanHistory).where(scan_filter).execution_options(synchronize_session=False))
+        db.execute(delete(DeletedTicket).where(DeletedTicket.order_id.like(pattern))
+                   .execution_options(synchronize_session=False))
+        removed = db.execute(delete(Ticket).where(Ticket.order_id.like(pattern))
+                             .execution_options(synchronize_session=False)).rowcount
+        db.commit()
+        return removed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bench-данные для нагрузочного теста")
+    parser.add_argument("command", nargs="?", default="seed", choices=("seed", "cleanup"))
+    parser.add_argument("--tickets", type=int, default=20000)
+    parser.add_argument("--scans", type=int, default=100000)
+    parser.add_argument("--storm", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--bulk", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--run", default="", help="cleanup: только этот run_id")
+    args = parser.parse_args()
+
+    if args.command == "cleanup":
+        print(f"🗑️ Удалено bench-билетов: {cleanup(args.run)}")
+    else:
+        seed(args.tickets, args.scans, args.storm, args.groups, args.bulk, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Регрессия SQL-бюджета: эндпоинты с @query_budget и ходовые GET админки
+вызываются в процессе (TestClient) с SQL_BUDGET_MODE=raise — превышение
+бюджета или N+1 превращается в 500 (app/querybudget.py) и роняет проверку.
+
+Запуск (нужен PostgreSQL из DATABASE_URL, данные засеваются и удаляются):
+    python benchmarks/sql_budget.py
+    DB_ASYNC_HOT_PATHS=true python benchmarks/sql_budget.py    # async-путь горячих эндпоинтов
+
+Код выхода 1 — есть нарушения бюджета или 5xx.
+"""
+
+import argparse
+import os
+import sys
+
+# До импорта app: настройки читаются при импорте
+os.environ["SQL_BUDGET_MODE"] = "raise"
+os.environ["SERVER_TIMING"] = "true"
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import app
+from app.routers.admin_auth import create_jwt_token
+from benchmarks.loadtest import GARBAGE_QR, parse_server_timing
+from benchmarks.seed import SeedData, cleanup, seed
+
+
+def _headers(data: SeedData) -> tuple[dict, dict]:
+    super_headers = {"Authorization": f"Bearer {create_jwt_token({'role': 'super', 'name': 'sql-budget'})}"}
+    scanner_headers = {}
+    for club_id, city, country in data.clubs:
+        token = create_jwt_token({
+            "club_id": club_id, "role": "scanner", "name": city, "city_english": city,
+            "allowed_countries": [country],
+        })
+        scanner_headers[club_id] = {"Authorization": f"Bearer {token}"}
+    return super_headers, scanner_headers
+
+
+def calls(data: SeedData) -> list:
+    """(операция, метод, путь, kwargs) — каждая ветка горячих эндпоинтов хотя бы раз"""
+    super_headers, scanner_headers = _headers(data)
+    storm = data.storm[0]
+    club_id = storm.club_id
+    scanner = scanner_headers.get(club_id, {})
+
+    def verify(op, qr, headers):
+        return (op, "POST", "/api/verify", {"json": {"qr_data": qr, "scanner_id": "sql-budget"}, "headers": headers})
+
+    items = [
+        verify("verify_first", storm.qr, scanner),
+        verify("verify_repeat", storm.qr, scanner),
+        *(verify("verify_garbage", qr, {}) for qr in GARBAGE_QR),
+    ]
+    for ticket in data.groups[:2]:
+        headers = scanner_headers.get(ticket.club_id, {})
+        items += [verify("verify_group", ticket.qr, headers) for _ in range(ticket.quantity + 1)]
+    items += [
+        ("log_denied", "POST", "/api/log-denied", {
+            "json": {"order_id": data.storm[1].order_id, "reason": "wrong_date", "scanner_id": "sql-budget",
+                     "qr_event_date": "01.01", "filter_event_date": "02.01", "club_id": club_id},
+            "headers": scanner,
+        }),
+        ("denied_scans", "GET", "/api/denied-scans", {"params": {"club_id": club_id, "limit": 100}, "headers": scanner}),
+        ("tickets_list", "GET", "/api/tickets/", {"params": {"club_id": club_id, "limit": 500}, "headers": super_headers}),
+        ("tickets_admin", "GET", "/api/tickets/",
+         {"params": {"show_all_for_admin": "true", "include_archived": "true", "limit": 1000}, "headers": super_headers}),
+        ("tickets_sync", "GET", "/api/tickets/",
+         {"params": {"updated_since": "2000-01-01T00:00:00", "limit": 500}, "headers": super_headers}),
+        ("stats_club", "GET", "/api/stats/", {"params": {"club_id": club_id}, "headers": super_headers}),
+        ("stats_all", "GET", "/api/stats/", {"headers": super_headers}),
+    ]
+    return items
+
+
+def check(client: TestClient, data: SeedData) -> int:
+    failures = 0
+    print(f"🔍 SQL-бюджет (SQL_BUDGET_MODE=raise, горячие эндпоинты: "
+          f"{'async' if settings.DB_ASYNC_HOT_PATHS else 'sync'}):")
+    for op, method, path, kwargs in calls(data):
+        response = client.request(method, path, **kwargs)
+        queries, db_ms = parse_server_timing(response.headers.get("server-timing", ""))
+        failed = response.status_code >= 500
+        failures += failed
+        print(f"  {'❌' if failed else '✅'} {op:<16} {response.status_code}  sql {queries if queries is not None else '?'}")
+        if failed:
+            body = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+            for violation in body.get("violations", [body.get("detail", response.text[:200])]):
+                print(f"       {violation}")
+    print(f"{'❌' if failures else '✅'} Нарушений: {failures}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Проверка SQL-бюджета эндпоинтов (SQL_BUDGET_MODE=raise)")
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--scans", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    data = seed(args.tickets, args.scans, storm=10, groups=5, bulk=0, seed_value=args.seed)
+    try:
+        with TestClient(app) as client:
+            return check(client, data)
+    finally:
+        print(f"🗑️ Удалено bench-билетов: {cleanup(data.run_id)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
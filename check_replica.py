@@ -0,0 +1,73 @@
+"""
+Проверка маршрутизации чтения в реплику (DATABASE_REPLICA_URL).
+
+Запуск:
+    python check_replica.py
+
+Локально — с docker-compose.replica.yml (primary :5432, реплика :5433).
+Проверяет: отставание реплики, что SELECT через get_read_db идёт в реплику,
+что запись в той же сессии уходит в primary и дальше сессия читает из
+primary, и что on_primary() (read-your-writes) читает из primary.
+"""
+
+import os
+import sys
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import ReadSessionLocal, get_replica_engine, on_primary, pool_status, replica_lag, replica_usable
+
+IN_RECOVERY = text("SELECT pg_is_in_recovery()")
+
+
+def _served_by(db) -> str:
+    return "реплика" if db.execute(IN_RECOVERY).scalar() else "primary"
+
+
+def run() -> bool:
+    if get_replica_engine() is None:
+        print("ℹ️  DATABASE_REPLICA_URL не задан — все чтения идут в primary")
+        return True
+
+    lag = replica_lag()
+    print(f"📋 Отставание реплики: {lag if lag is not None else 'недоступна'} "
+          f"(порог {settings.REPLICA_MAX_LAG_SECONDS} с)")
+    if not replica_usable():
+        print("❌ Реплика не используется: недоступна или отстаёт больше порога")
+        return False
+
+    ok = True
+    db = ReadSessionLocal()
+    try:
+        checks = [("SELECT до записи", "реплика")]
+        results = [_served_by(db)]
+
+        db.execute(text("CREATE TEMP TABLE IF NOT EXISTS _replica_check (id int)"))
+        checks.append(("SELECT после записи", "primary"))
+        results.append(_served_by(db))
+        db.rollback()
+    finally:
+        db.close()
+
+    with on_primary():
+        db = ReadSessionLocal()
+        try:
+            checks.append(("SELECT в on_primary()", "primary"))
+            results.append(_served_by(db))
+        finally:
+            db.close()
+
+    for (name, expected), actual in zip(checks, results):
+        mark = "✅" if actual == expected else "❌"
+        ok &= actual == expected
+        print(f"  {mark} {name:<22} → {actual} (ожидалось: {expected})")
+    print(f"📊 Пулы: {pool_status()}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
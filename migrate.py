@@ -0,0 +1,43 @@
+"""
+Миграции схемы БД (app/migrations.py).
+
+Запуск:
+    python migrate.py            # применить недостающие миграции
+    python migrate.py status     # текущая версия и список миграций
+
+То же самое делает startup() при старте приложения; отдельный запуск нужен,
+чтобы мигрировать до деплоя (например, в release-фазе).
+"""
+
+import os
+import sys
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import get_direct_engine
+from app.migrations import migrate, status
+
+
+def run(command: str):
+    if command == "status":
+        info = status(get_direct_engine())
+        print(f"📋 Версия схемы: {info['current']} (последняя: {info['head']})")
+        for item in info["migrations"]:
+            mark = "✅" if item["applied_at"] else "⏳"
+            applied_at = item["applied_at"] or "не применена"
+            print(f"  {mark} {item['version']:>3}  {item['description']:<50} {applied_at}")
+
+    elif command == "":
+        applied = migrate(get_direct_engine())
+        if applied:
+            print(f"✅ Применены миграции: {applied}")
+        else:
+            print("ℹ️  Схема актуальна")
+
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else "")
@@ -0,0 +1,48 @@
+"""
+Партиционирование scan_history по месяцам.
+
+Запуск:
+    python partition_scan_history.py convert     # разовый перевод существующей таблицы
+    python partition_scan_history.py maintain    # новые партиции + retention (то же, что при старте)
+    python partition_scan_history.py list        # список партиций
+
+convert блокирует scan_history на время копирования — запускать в окно
+обслуживания, при остановленных сканерах.
+"""
+
+import os
+import sys
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import get_direct_engine
+from app.partitions import is_partitioned, convert_to_partitioned, maintain, list_partitions
+
+
+def run(command: str):
+    with get_direct_engine().begin() as conn:
+        if command == "convert":
+            if is_partitioned(conn):
+                print("ℹ️  scan_history уже партиционирована")
+                return
+            moved = convert_to_partitioned(conn)
+            print(f"✅ scan_history партиционирована, перенесено строк: {moved}")
+
+        elif command == "maintain":
+            if not is_partitioned(conn):
+                print("❌ scan_history не партиционирована — сначала convert")
+                return
+            result = maintain(conn)
+            print(f"✅ Создано: {result['created'] or '-'}; отцеплено/удалено: {result['removed'] or '-'}")
+
+        elif command == "list":
+            for partition in list_partitions(conn):
+                print(f"{partition['name']:<28} ~{partition['approx_rows']:>10} строк  {partition['bound']}")
+
+        else:
+            print(__doc__)
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else "")
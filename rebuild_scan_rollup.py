@@ -0,0 +1,38 @@
+"""
+Backfill / пересчёт таблицы scan_rollup из scan_history.
+
+Запуск:
+    python rebuild_scan_rollup.py            # все клубы
+    python rebuild_scan_rollup.py 12         # только club_id=12
+"""
+
+import os
+import sys
+
+# Добавляем путь к приложению
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import engine, SessionLocal
+from app.migrations import migrate
+from app.rollup import rebuild_rollup
+
+
+def run(club_id=None):
+    # Таблица могла ещё не существовать (первый деплой)
+    migrate(engine)
+
+    db = SessionLocal()
+    try:
+        buckets = rebuild_rollup(db, club_id)
+        scope = f"club_id={club_id}" if club_id is not None else "все клубы"
+        print(f"✅ scan_rollup пересчитан ({scope}): {buckets} бакетов")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка пересчёта rollup: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else None)